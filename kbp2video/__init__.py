@@ -6,5 +6,8 @@ __version__ = '0.2.2'
 # clog up the namespace if someone does an import *
 __all__ = ['DropLabel', 'FileResultSet', 'TrackTable', 'Ui_MainWindow']
 
+# First, so the time spent importing everything else is included
+from . import startup
+startup.mark("start")
 from ._gui import *
 from ._gui import run
@@ -7,28 +7,31 @@ __all__ = ["TrackTable", "FileResultSet", "DropLabel", "Ui_MainWindow"]
 import sys
 import os
 import collections
-import glob
-import difflib
 import string
 import re
 import time #sleep
-import fractions
-from PySide6.QtCore import QObject, QRunnable, QFile, QThreadPool, Q_ARG, QUrl, Q_RETURN_ARG, QDir, QEvent, QIODevice, QSettings, QSize, QRect, QMetaObject, QMargins, QCoreApplication, QTextStream, QProcess, QRegularExpression, Signal, Slot, QCommandLineParser
+import threading
+from PySide6.QtCore import QObject, QThreadPool, QTimer, Q_ARG, QUrl, Q_RETURN_ARG, QDir, QEvent, QSettings, QSize, QRect, QMetaObject, QMargins, QCoreApplication, QRegularExpression, Slot, QCommandLineOption, QCommandLineParser, QEventLoop
 from PySide6.QtGui import QColor, QImage, QKeySequence, Qt, QDesktopServices, QRegularExpressionValidator
-from PySide6.QtWidgets import QVBoxLayout, QFileDialog, QHBoxLayout, QSlider, QLabel, QLineEdit, QDoubleSpinBox, QSpacerItem, QInputDialog, QStackedWidget, QComboBox, QTableWidget, QGridLayout, QTableWidgetItem, QPushButton, QSpinBox, QHeaderView, QApplication, QTableView, QAbstractItemView, QMessageBox, QMainWindow, QLayout, QWidget, QMenuBar, QScrollArea, QSizePolicy, QStatusBar, QColorDialog, QCheckBox
+from PySide6.QtWidgets import QVBoxLayout, QFileDialog, QHBoxLayout, QSlider, QLabel, QLineEdit, QDoubleSpinBox, QSpacerItem, QInputDialog, QStackedWidget, QComboBox, QTableWidget, QGridLayout, QTableWidgetItem, QPushButton, QSpinBox, QHeaderView, QApplication, QTableView, QAbstractItemView, QMessageBox, QMainWindow, QLayout, QWidget, QMenuBar, QScrollArea, QSizePolicy, QStatusBar, QColorDialog, QCheckBox, QProgressDialog
 import PySide6
-from .utils import ClickLabel, bool2check, check2bool, mimedb
+from .utils import ClickLabel, bool2check, check2bool, set_application_names
 from .advanced_editor import AdvancedEditor
 from .advanced_options import AdvancedOptions
 from .progress_window import ProgressWindow
-import ffmpeg
+from .proof_dialog import ProofDialog
+from .review_dialog import ReviewDialog
+from .scanner import FolderScanner
+from .encoder import Converter, ConverterSignals, EncodeRunner, Priority, SchedulePolicy
+from . import spool
+from .journal import BatchJournal
+from . import conversion, discovery, filetypes, matching, proof, startup, updates
+from .capabilities import Capabilities, ffmpeg_capabilities
+from .conversion import KBPASSWrapper, ConversionSettings, SettingsError, SETTING_DEFAULTS
 import enum
-import kbputils
-import io
 import shutil
 from . import __version__
 import traceback
-import lastversion
 
 class TrackTableColumn(enum.Enum):
     KBP_ASS = 0
@@ -36,39 +39,6 @@ class TrackTableColumn(enum.Enum):
     Background = 2
     Advanced = 3
 
-# TODO: Possibly pull PlayRes? from .ass to letterbox
-class KBPASSWrapper:
-    def __init__(self, path):
-        if path.casefold().endswith(".ass"):
-            self.ass_path = path
-            # raise correct exception we would get later from opening
-            with open(path, "r") as _:
-                pass
-        else:
-            self.kbp_path = path
-            self.kbp_obj = kbputils.KBPFile(path)
-    def ass_data(self, **kwargs):
-        if hasattr(self,"kbp_path"):
-            # Re-read file in case it changed on disk
-            self.kbp_obj = kbputils.KBPFile(self.kbp_path)
-
-            tmp = io.StringIO()
-            kbputils.AssConverter(self.kbp_obj,**kwargs).ass_document().dump_file(tmp)
-            return tmp.getvalue()
-        else:
-            # Added for symmetry or something, but...
-            print("Probably shouldn't reach this code")
-            f = QFile(self.ass_path)
-            if not f.open(QIODevice.ReadOnly | QIODevice.Text):                                                                                  
-                raise IOError(f"Unable to open {self.ass_path}")
-            res = QTextStream(f).readAll()
-            f.close()
-            return res
-
-    def __str__(self):
-        return self.kbp_path if hasattr(self,"kbp_path") else self.ass_path
-
-
 # This should *probably* be redone as a QTableView with a proxy to better
 # manage the data and separate it from display
 class TrackTable(QTableWidget):
@@ -174,13 +144,16 @@ class TrackTable(QTableWidget):
             print(event)
 
 
+# indexes has a matching.TrigramIndex of the keys in each category, so search
+# doesn't need to compare against every one of them
 class FileResultSet(collections.namedtuple(
-        'FileResultSet', ('kbp', 'ass', 'audio', 'background'))):
+        'FileResultSet', ('kbp', 'ass', 'audio', 'background', 'indexes'))):
     __slots__ = ()
     PATH_REGEX = re.compile(r'^\w+-\d+|\w+-\d+$|\(Filtered.*|^[\d_]+')
+    STRIP_TABLE = str.maketrans("", "", string.punctuation + string.whitespace)
 
     def __new__(cls):
-        return super().__new__(cls, {}, {}, {}, {})
+        return super().__new__(cls, {}, {}, {}, {}, collections.defaultdict(matching.TrigramIndex))
 
     def __bool__(self):
         return bool(self.kbp) or bool(self.ass) or bool(
@@ -191,6 +164,7 @@ class FileResultSet(collections.namedtuple(
         key = FileResultSet.normalize(file)
         if not key in data:
             data[key] = set()
+            self.indexes[category].add(key)
         data[key].add(file)
 
     # Include both kbp and ass results. If there is any key with both kbp and
@@ -204,15 +178,14 @@ class FileResultSet(collections.namedtuple(
     def normalize(path):
         path = os.path.splitext(os.path.basename(path))[0]
         path = FileResultSet.PATH_REGEX.sub('', path)
-        return path.casefold().translate(str.maketrans(
-            "", "", string.punctuation + string.whitespace))
+        return path.casefold().translate(FileResultSet.STRIP_TABLE)
 
     def search(self, category, file, fuzziness=0.6):
         data = getattr(self, category)
         key = FileResultSet.normalize(file)
         # TODO: Include more results?
-        if result := difflib.get_close_matches(
-                key, data, n=3, cutoff=fuzziness):
+        if result := self.indexes[category].close_matches(
+                key, n=3, cutoff=fuzziness):
             return [files for key in result for files in data[key]]
         else:
             return []
@@ -222,22 +195,40 @@ class FileResultSet(collections.namedtuple(
         return [files for key, file_list in data.items()
                 for files in file_list]
 
+    # {file: key} for each file in category
+    def files(self, category):
+        return {file: key for key, file_list in getattr(self, category).items()
+                for file in file_list}
+
+    # Match files in category to all of projects ({project: key}) at once,
+    # see matching.assign. Returns (chosen, review). Only audio is given to one
+    # project at most, as a background can be shared. A lone project with no
+    # match is offered every file, and so is every project when there's only
+    # one background
+    def assign(self, category, projects):
+        chosen, review = matching.assign(projects, self.files(category), unique=category == 'audio')
+        if len(projects) == 1 or (category == 'background' and len(self.background) == 1):
+            fallback = sorted(self.all_files(category))
+            for project in projects:
+                if fallback and project not in chosen and project not in review:
+                    chosen[project] = fallback[0]
+                    if len(fallback) > 1:
+                        review[project] = fallback
+        return (chosen, review)
+
 
 class DropLabel(QLabel):
 
     def __init__(self, parent=None, **kwargs):
         super().__init__(parent, **kwargs)
         self.setAcceptDrops(True)
-        self.mimedb = mimedb
         self.setAlignment(Qt.AlignCenter)
         self.setStyleSheet("font: bold 50px")
 
     def identifyFile(self, path):
-        if path.casefold().endswith('.kbp'):
-            return 'kbp'
-        elif path.casefold().endswith('.ass'):
-            return 'ass'
-        elif path.casefold().endswith('.txt'):
+        filetype = filetypes.classify(path)
+        if filetype == 'txt':
+            import kbputils
             outfile = os.path.splitext(path)[0] + '.kbp'
             if not os.path.exists(outfile):
                 try:
@@ -245,7 +236,8 @@ class DropLabel(QLabel):
                 except:
                     print(traceback.format_exc())
                     return None
-        elif path.casefold().endswith('.lrc'):
+        elif filetype == 'lrc':
+            import kbputils
             outfile = os.path.splitext(path)[0] + '.kbp'
             if not os.path.exists(outfile):
                 try:
@@ -254,21 +246,32 @@ class DropLabel(QLabel):
                     print(traceback.format_exc())
                     return None
             return ('kbp', outfile)
-        elif (mime := self.mimedb.mimeTypeForFile(path)).name().startswith('audio/'):
-            return 'audio'
-        elif mime.name().startswith('image/') or mime.name().startswith('video/'):
-            return 'background'
         else:
-            return None
+            return filetype
+
+    # Whether a file could be one identifyFile picks up, going by its name
+    # alone. Names with no known extension could still be media, so they're
+    # let through
+    def mightBeRelevant(name):
+        return filetypes.by_name(name) is not None
+
+    # Add path to identified, as identifyFile found it to be
+    def addIdentified(identified, path, filetype):
+        if filetype:
+            # When identifyFile returns a tuple, it is overriding the path
+            if isinstance(filetype, tuple):
+                identified.add(*filetype)
+            else:
+                identified.add(filetype, path)
 
-    def generateFileList(self, paths, base_dir='',
-                         dir_expand=None, identified=None):
-        if identified is None:
-            identified = FileResultSet()
+    def generateFileList(self, paths, dir_expand=None):
+        identified = FileResultSet()
+        folders = []
         for path in paths:
-            path = os.path.abspath(os.path.join(base_dir, path))
-            isdir = os.path.isdir(path)
-            if isdir and dir_expand is None:
+            path = os.path.abspath(path)
+            if not os.path.isdir(path):
+                DropLabel.addIdentified(identified, path, self.identifyFile(path))
+            elif dir_expand is None:
                 result = QMessageBox.question(
                     self.parentWidget(),
                     "Import folder?",
@@ -276,52 +279,61 @@ class DropLabel(QLabel):
                     QMessageBox.StandardButtons(
                         QMessageBox.Yes | QMessageBox.YesToAll | QMessageBox.No | QMessageBox.NoToAll))
                 if result == QMessageBox.Yes:
-                    # TODO: fix rootdir
-                    self.generateFileList(
-                        glob.iglob(
-                            '**',
-                            root_dir=path,
-                            recursive=True),
-                        base_dir=path,
-                        dir_expand=True,
-                        identified=identified)
+                    folders.append(path)
                     # Leave dir_expand to prompt next time
                 elif result == QMessageBox.NoToAll:
                     dir_expand = False
                 elif result == QMessageBox.YesToAll:
-                    self.generateFileList(
-                        glob.iglob(
-                            '**',
-                            root_dir=path,
-                            recursive=True),
-                        base_dir=path,
-                        dir_expand=True,
-                        identified=identified)
+                    folders.append(path)
                     dir_expand = True
                 # else Leave dir_expand to prompt next time
-            if not isdir:
-                if filetype := self.identifyFile(path):
-                    # When identifyFile returns a tuple, it is overriding the path
-                    if isinstance(filetype, tuple):
-                        identified.add(*filetype)
-                    else:
-                        identified.add(filetype, path)
-
             elif dir_expand:
-                self.generateFileList(
-                    glob.iglob(
-                        '**',
-                        root_dir=path,
-                        recursive=True),
-                    base_dir=path,
-                    dir_expand=True,
-                    identified=identified)
+                folders.append(path)
+        if folders:
+            self.scanFolders(folders, identified)
         return identified
 
+    # Identify everything under folders on the scanner's threads, adding it to
+    # identified as each folder is listed. The window keeps running meanwhile,
+    # with a count of what's been found and a button to stop early, which
+    # keeps what was found up to then
+    def scanFolders(self, folders, identified):
+        scanner = FolderScanner(folders, self.identifyFile, DropLabel.mightBeRelevant)
+        progress = QProgressDialog("Scanning folders…", "Cancel", 0, 0, self.parentWidget(), minimumDuration=500)
+        progress.setWindowTitle("Import folder")
+        progress.setWindowModality(Qt.WindowModal)
+        loop = QEventLoop()
+
+        # Anything still queued from the threads once the scan is cancelled
+        # (or the loop has ended) is ignored
+        def found(batch):
+            if not scanner.cancelled.is_set():
+                for path, filetype in batch:
+                    DropLabel.addIdentified(identified, path, filetype)
+
+        def counted(folders, files):
+            if not scanner.cancelled.is_set():
+                progress.setLabelText(f"Scanning folders… {folders} listed, {files} files found")
+        scanner.found.connect(found)
+        scanner.progress.connect(counted)
+        scanner.finished.connect(loop.quit)
+        progress.canceled.connect(scanner.cancel)
+        progress.canceled.connect(loop.quit)
+        # Started from the loop so finishing right away still ends it
+        QTimer.singleShot(0, scanner.start)
+        loop.exec()
+        scanner.cancel()
+        progress.reset()
+        progress.deleteLater()
+
     def importFiles(self, data, drop=True):
         mainWindow = self.parentWidget().parentWidget().parentWidget()
         if data and (result := self.generateFileList(data)):
-            for key, files in (kbp_ass_data := result.merged_kbp_ass_data()).items():
+            table = self.parentWidget().widget(0)
+            # Key each new row's .kbp/.ass file was found under, and its item
+            projects = {}
+            items = {}
+            for key, files in result.merged_kbp_ass_data().items():
             #for key, files in result.kbp.items():
                 # TODO: handle multiple kbp files under one key
                 kbpassFile = next(iter(files))
@@ -330,7 +342,6 @@ class DropLabel(QLabel):
                 except:
                     QMessageBox.information(mainWindow, "Unable to process kbp", f"Failed to process .kbp file\n{kbpassFile}\n\nError Output:\n{traceback.format_exc()}")
                     continue
-                table = self.parentWidget().widget(0)
                 current = table.rowCount()
                 table.setRowCount(current + 1)
                 item = QTableWidgetItem(os.path.basename(kbpassFile))
@@ -341,42 +352,32 @@ class DropLabel(QLabel):
                 #if not (outputdir := mainWindow.outputDir).text():
                 #    outputdir.setText(os.path.dirname(kbpFile) + "/kbp2video")
                 mainWindow.lastinputdir = os.path.dirname(kbpassFile)
+                projects[kbpassFile] = key
+                items[kbpassFile] = item
+
+            # Audio and backgrounds are matched to all the new rows at once, so
+            # no audio file is used twice, and only the matches that are too
+            # close to call are shown to the user, all together
+            chosen = {}
+            review = []
+            for filetype, column in (('audio', 1), ('background', 2)):
+                if column == 2 and drop and mainWindow.skipBackgrounds.checkState() == Qt.Checked:
+                    continue
+                chosen[column], ambiguous = result.assign(filetype, projects)
+                review.extend((column, kbp, filetype, candidates) for kbp, candidates in sorted(ambiguous.items()))
+            self.reviewMatches(review, chosen, lambda kbp: kbp)
 
-                for filetype, column in (('audio', 1), ('background', 2)):
-                    if column == 2 and drop and mainWindow.skipBackgrounds.checkState() == Qt.Checked:
-                        continue
-                    # Update current in case sort moved it. Needs to be done each time in case one of these columns is the sort field
-                    current = table.row(item)
-                    match = result.search(filetype, kbpassFile)
-
-                    # If there happens to be only one kbp, assume all selected audio/backgrounds were intended for it
-                    # Also, if there happens to be only one background, assume
-                    # it's for all the KBPs
-                    if not match and (len(kbp_ass_data) == 1 or (
-                            filetype == 'background' and len(getattr(result, 'background')) == 1)):
-                        match = result.all_files(filetype)
-                        print(match)
-                    if not match:
-                        continue
-
+            for column, matches in chosen.items():
+                for kbp, match in matches.items():
                     print(f"Match found: {match}")
-
-                    if len(match) > 1:
-                        choice, ok = QInputDialog.getItem(
-                            self.parentWidget(), f"Select {filetype} file to use",
-                            f"Multiple potential {filetype} files were found for {kbpassFile}. Please select one, or enter a different path.",
-                            match)
-                        if ok:
-                            match = [choice]
-                        else:
-                            continue
-
-                    match_item = QTableWidgetItem(os.path.basename(match[0]))
-                    match_item.setData(Qt.UserRole, match[0])
-                    match_item.setToolTip(match[0])
+                    match_item = QTableWidgetItem(os.path.basename(match))
+                    match_item.setData(Qt.UserRole, match)
+                    match_item.setToolTip(match)
                     match_item.setFlags(Qt.ItemIsSelectable | Qt.ItemIsEnabled | Qt.ItemNeverHasChildren)
-                    table.setItem(current, column, match_item)
+                    # Row looked up each time in case sort moved it
+                    table.setItem(table.row(items[kbp]), column, match_item)
 
+            for item in items.values():
                 # Process audio/background options from KBP file
                 current = table.row(item)
                 if hasattr((k := item.data(Qt.UserRole)), "kbp_obj"):
@@ -404,62 +405,76 @@ class DropLabel(QLabel):
             # Need the item itself instead of the row due to potential reordering with sorting
             # TODO: figure out what to do if a kbp file is in the list twice - currently it just updates the last one
             data = dict((table.key(row, TrackTableColumn.KBP_ASS.value), table.item(row, TrackTableColumn.KBP_ASS.value)) for row in range(table.rowCount()))
+            projects = {key: key for key in data}
+            def fname(key):
+                return table.filename(table.indexFromItem(data[key]).row(), TrackTableColumn.KBP_ASS.value)
+            chosen = {}
+            review = []
             for filetype, column in (('audio', TrackTableColumn.Audio.value), ('background', TrackTableColumn.Background.value)):
                 if column == TrackTableColumn.Background.value and drop and mainWindow.skipBackgrounds.checkState() == Qt.Checked:
                     continue
-                for key in getattr(result, filetype):
-                    if len(filenames := list(getattr(result, filetype)[key])) > 1:
+                chosen[column], ambiguous = matching.assign(projects, result.files(filetype), unique=filetype == 'audio')
+
+                # If just one file was dropped, assume it was intentional and prompt with all the kbps
+                if not chosen[column] and not ambiguous and len(files := result.all_files(filetype)) == 1:
+                    if len(data) > 1:
+                        names = {fname(key): key for key in data}
                         choice, ok = QInputDialog.getItem(
-                            self.parentWidget(), f"Select {filetype} file to use",
-                            f"Multiple potential {filetype} files were found with similar names. Please select one to import. If multiple are needed, rerun the import with those files after this one is completed. To skip all, hit cancel.",
-                            filenames,
+                            self.parentWidget(), "Select KBP file to use",
+                            f"Multiple potential KBP files were found for {files[0]}. Please select one or hit cancel to skip.",
+                            names.keys(),
                             editable=False)
                         if ok:
-                            filenames = [choice]
-                        else:
-                            continue
-
-                    search_results = difflib.get_close_matches(key, data, n=3, cutoff=0.6)
-
-                    # If just one file was dropped, assume it was intentional and prompt with all the kbps
-                    if not search_results and len(result.all_files(filetype)) == 1:
-                        search_results = data
-
-                    if match := dict((table.filename(table.indexFromItem(data[key]).row(), TrackTableColumn.KBP_ASS.value), data[key]) for key in search_results):
-                        if len(match) > 1:
-                            choice, ok = QInputDialog.getItem(
-                                self.parentWidget(), "Select KBP file to use",
-                                f"Multiple potential KBP files were found for {filenames[0]}. Please select one or hit cancel to skip.",
-                                match.keys(),
-                                editable=False)
-                            if ok:
-                                match = {choice: match[choice]}
-                            else:
-                                continue
-                        if match:
-                            fname, kbp = match.popitem()
-                            current = table.item(table.indexFromItem(kbp).row(), column)
-                            if current and current.text():
-                                answer = QMessageBox.question(
-                                    self.parentWidget(),
-                                    "Replace file?",
-                                    f"Replace {filetype} file\n{table.item_filename(current)} for\n{fname}\nwith\n{filenames[0]}?",
-                                    QMessageBox.StandardButtons(
-                                        QMessageBox.Yes | QMessageBox.No))
-                                if answer != QMessageBox.Yes:
-                                    continue
-                            match_item = QTableWidgetItem(os.path.basename(filenames[0]))
-                            # filetype in audio, background
-                            match_item.setData(Qt.UserRole, filenames[0])
-                            match_item.setToolTip(filenames[0])
-                            match_item.setFlags(Qt.ItemIsSelectable | Qt.ItemIsEnabled | Qt.ItemNeverHasChildren)
-                            table.setItem(table.indexFromItem(kbp).row(), column, match_item)
+                            chosen[column][names[choice]] = files[0]
+                    else:
+                        chosen[column][next(iter(data))] = files[0]
+                review.extend((column, key, filetype, candidates) for key, candidates in sorted(ambiguous.items()))
+            self.reviewMatches(review, chosen, fname)
+
+            replacing = [(column, key) for column, matches in chosen.items() for key in matches
+                         if (current := table.item(table.indexFromItem(data[key]).row(), column)) and current.text()]
+            if replacing:
+                changes = [f"{fname(key)}:\n{table.item_filename(table.item(table.indexFromItem(data[key]).row(), column))} → {chosen[column][key]}"
+                           for column, key in replacing]
+                answer = QMessageBox.question(
+                    self.parentWidget(),
+                    "Replace files?",
+                    "Replace files that are already set?\n\n" + "\n".join(changes[:10]) + (f"\n…and {len(changes) - 10} more" if len(changes) > 10 else ""),
+                    QMessageBox.StandardButtons(
+                        QMessageBox.Yes | QMessageBox.No))
+                if answer != QMessageBox.Yes:
+                    for column, key in replacing:
+                        del chosen[column][key]
+
+            for column, matches in chosen.items():
+                for key, match in matches.items():
+                    match_item = QTableWidgetItem(os.path.basename(match))
+                    # filetype in audio, background
+                    match_item.setData(Qt.UserRole, match)
+                    match_item.setToolTip(match)
+                    match_item.setFlags(Qt.ItemIsSelectable | Qt.ItemIsEnabled | Qt.ItemNeverHasChildren)
+                    table.setItem(table.indexFromItem(data[key]).row(), column, match_item)
 
         else:
             QMessageBox.information(
                 self.parentWidget(), "No Files Found",
                 "No relevant files discovered with provided file list.")
 
+    # Show the matches in review ([(column, project, file type, candidates)])
+    # in one table for the user to check, and update chosen ({column: {project:
+    # file}}) with the result. label gives the .kbp/.ass file of a project
+    def reviewMatches(self, review, chosen, label):
+        if not review:
+            return
+        entries = [(label(project), filetype, candidates, chosen[column].get(project))
+                   for column, project, filetype, candidates in review]
+        choices = ReviewDialog.showReviewDialog(entries, self.parentWidget()) or [None] * len(review)
+        for (column, project, _, _), choice in zip(review, choices):
+            if choice:
+                chosen[column][project] = choice
+            else:
+                chosen[column].pop(project, None)
+
     def dropEvent(self, event):
         mimedata = event.mimeData()
         data = []
@@ -498,26 +513,6 @@ class DropLabel(QLabel):
     def dragLeaveEvent(self, event):
         self.parentWidget().setCurrentIndex(0)
 
-class ConverterSignals(QObject):
-    started = Signal()
-    finished = Signal()
-    progress = Signal(int, int, str, int, int)
-    error = Signal(str, bool)
-    data = Signal(dict)
-
-class Converter(QRunnable):
-    def __init__(self, function, *args, **kwargs):
-        super().__init__()
-        self.signals = ConverterSignals()
-        self.function = function
-        self.signals.cancelled = False #TODO: Seems to work, but is this a good idea?
-        self.args = args
-        self.kwargs = kwargs
-
-    @Slot()
-    def run(self):
-        self.function(self.signals, *self.args, **self.kwargs)
-
 class EventFilter(QObject):
     def __init__(self, parent, filter_fn):
         super().__init__(parent)
@@ -527,6 +522,7 @@ class EventFilter(QObject):
 class UpdateBox(QMessageBox):
     def _lastversion_wrap(self, signals):
         try:
+            import lastversion
             result = {}
             version = lastversion.has_update(repo="ItMightBeKaraoke/kbp2video", at="github", pre_ok=True, current_version=__version__)
             if version:
@@ -562,14 +558,20 @@ class UpdateBox(QMessageBox):
 
 class Ui_MainWindow(QMainWindow):
 
-    RELEVANT_FILE_FILTER = "*." + " *.".join(
-        "kbp flac wav ogg opus mp3 aac mp4 mkv avi webm mov mpg mpeg jpg jpeg png gif jfif jxl bmp tiff webp".split())
+    RELEVANT_FILE_FILTER = filetypes.RELEVANT_FILE_FILTER
+
+    DEFAULT_CONCURRENT_JOBS = conversion.DEFAULT_CONCURRENT_JOBS
 
     def __init__(self, app, preload_files=None):
         super().__init__()
         self.app = app
         self.preload_files = preload_files
+        # Left over from a batch that didn't finish, if any
+        self.journal = BatchJournal(parent=self)
+        self.journal.load()
+        startup.mark("journal")
         self.setupUi()
+        self.update_resume_action()
 
     # Convenience method for adding a Qt object as a property in self and and
     # setting its Qt object name
@@ -594,6 +596,8 @@ class Ui_MainWindow(QMainWindow):
         self.filemenu.addAction("&Add/Import Files", Qt.CTRL | Qt.Key_I, self.add_files_button)
         self.filemenu.addAction("&Load settings from file…", Qt.CTRL | Qt.Key_L, self.prompt_import_settings_file)
         self.filemenu.addAction("&Export settings…", Qt.CTRL | Qt.Key_E, self.prompt_export_settings_file)
+        self.filemenu.addAction("&Submit to render spool…", self.submit_to_spool)
+        self.resumeAction = self.filemenu.addAction("&Resume interrupted batch", self.resumeConversion)
         self.filemenu.addAction("&Quit", QKeySequence.Quit, self.app.quit)
         self.editmenu = self.menubar.addMenu("&Edit")
         # TODO: Ctrl-A already works, would this be helpful
@@ -603,8 +607,9 @@ class Ui_MainWindow(QMainWindow):
         self.editmenu.addAction("&Open/Edit Selected Files", QKeySequence.Open, self.remove_files_button)
         self.editmenu.addAction("&Intro/Outro Settings", Qt.CTRL | Qt.Key_Return, self.advanced_button)
         self.editmenu.addAction("&Lyrics Import Options", self.advanced_options)
+        self.editmenu.addAction("&Proof Render Selected…", Qt.CTRL | Qt.Key_P, self.runProofConversion)
         self.helpmenu = self.menubar.addMenu("&Help")
-        self.helpmenu.addAction("&About", lambda: QMessageBox.about(self, "About kbp2video", f"kbp2video version: {__version__}\n\nUsing:\nkbputils version: {kbputils.__version__}\nPySide6 version: {PySide6.__version__}\nffmpeg version: {ffmpeg_version}"))
+        self.helpmenu.addAction("&About", self.showAbout)
         self.helpmenu.addAction("&Check for Updates…", lambda: UpdateBox.update_check(self))
         self.setMenuBar(self.menubar)
 
@@ -613,13 +618,11 @@ class Ui_MainWindow(QMainWindow):
         # No point in updating the status bar with empty messages
         self.installEventFilter(EventFilter(self, lambda obj, event: True if event.type() == QEvent.StatusTip and not event.tip() else False))
 
-        ffmpeg_version=""
-
-        QCoreApplication.setOrganizationName("ItMightBeKaraoke")
-        QCoreApplication.setApplicationName("kbp2video")
-        QCoreApplication.setOrganizationDomain("itmightbekaraoke.com")
+        set_application_names()
 
         self.settings = QSettings()
+        # capabilities.Capabilities of ffmpeg, once they're known
+        self.capabilities = None
 
         ##################### Left pane #####################
 
@@ -720,13 +723,7 @@ class Ui_MainWindow(QMainWindow):
             alignment=Qt.AlignCenter)), gridRow, 0, 1, 3)
 
         gridRow += 1
-        self.aspectRatioOptions = [
-            "CDG, borders (25:18, True)",
-            "Wide, borders (16:9, True)",
-            "Standard, borders (4:3, True)",
-            "CDG no border (3:2, False)",
-            "Wide no border (16:9, False)",
-        ]
+        self.aspectRatioOptions = list(conversion.ASPECT_RATIO_OPTIONS)
         self.gridLayout.addWidget(
             self.bind("aspectLabel", ClickLabel()), gridRow, 0)
         self.gridLayout.addWidget(
@@ -842,15 +839,7 @@ class Ui_MainWindow(QMainWindow):
         self.gridLayout.addWidget(self.bind("loopBGLabel", ClickLabel(buddy=self.loopBGBox, buddyMethod=QCheckBox.toggle)), gridRow, 1, 1, 2)
 
         gridRow += 1
-        self.resolutionOptions = [
-            "1500x1080",
-            "1920x1080 (1080p)",
-            "3000x2160",
-            "3840x2160 (4K)",
-            "1000x720",
-            "1280x720 (720p)",
-            "640x480"
-        ]
+        self.resolutionOptions = list(conversion.RESOLUTION_OPTIONS)
         self.gridLayout.addWidget(
             self.bind("resolutionLabel", ClickLabel()), gridRow, 0)
         self.gridLayout.addWidget(
@@ -865,12 +854,7 @@ class Ui_MainWindow(QMainWindow):
         #self.gridLayout.addWidget(self.bind("overrideBGLabel", ClickLabel(buddy=self.overrideBGResolution, buddyMethod=QCheckBox.toggle)), gridRow, 1, 1, 2)
 
         gridRow += 1
-        self.containerOptions = {
-            "mp4": (("h264", "libvpx-vp9", "libx265", "libsvtav1"), ("aac", "mp3", "libopus")),
-            "mkv": (("libvpx-vp9", "h264", "libx265", "libsvtav1"), ("flac", "libopus", "aac", "mp3")),
-            "webm": (("libvpx-vp9", "libsvtav1"), ("libopus",)),
-            "mov": (("png",), ("aac",)),
-        }
+        self.containerOptions = conversion.CONTAINER_OPTIONS
         self.gridLayout.addWidget(
             self.bind("containerLabel", ClickLabel()), gridRow, 0)
         self.gridLayout.addWidget(
@@ -963,10 +947,85 @@ class Ui_MainWindow(QMainWindow):
         self.gridLayout.addWidget(self.bind("skipBackgrounds", QCheckBox()), gridRow, 0, alignment=Qt.AlignRight)
         self.gridLayout.addWidget(self.bind("skipBackgroundsLabel", ClickLabel(buddy=self.skipBackgrounds, buddyMethod=QCheckBox.toggle)), gridRow, 1, 1, 2)
 
+        gridRow += 1
+        self.gridLayout.addWidget(
+            self.bind("concurrentJobsLabel", ClickLabel()), gridRow, 0)
+        self.gridLayout.addWidget(
+            self.bind(
+                "concurrentJobs",
+                QSpinBox(
+                    minimum=1,
+                    maximum=max(1, os.cpu_count() or 1),
+                    sizePolicy=QSizePolicy(
+                        QSizePolicy.Maximum,
+                        QSizePolicy.Maximum))),
+            gridRow, 1)
+        self.concurrentJobsLabel.setBuddy(self.concurrentJobs)
+
+        gridRow += 1
+        self.gridLayout.addWidget(
+            self.bind("scheduleLabel", ClickLabel()), gridRow, 0)
+        self.gridLayout.addWidget(
+            self.bind("scheduleBox", QComboBox()), gridRow, 1, 1, 2)
+        self.scheduleBox.addItems(["Table order", "Longest first", "Shortest first"])
+        self.scheduleLabel.setBuddy(self.scheduleBox)
+
+        gridRow += 1
+        self.gridLayout.addWidget(
+            self.bind("priorityLabel", ClickLabel()), gridRow, 0)
+        self.gridLayout.addWidget(
+            self.bind("priorityBox", QComboBox()), gridRow, 1, 1, 2)
+        self.priorityBox.addItems(["Normal", "Low", "Idle"])
+        self.priorityLabel.setBuddy(self.priorityBox)
+
+        gridRow += 1
+        self.gridLayout.addWidget(
+            self.bind("chunkLengthLabel", ClickLabel()), gridRow, 0)
+        self.gridLayout.addWidget(
+            self.bind(
+                "chunkLength",
+                QSpinBox(
+                    minimum=0,
+                    maximum=3600,
+                    singleStep=30,
+                    sizePolicy=QSizePolicy(
+                        QSizePolicy.Maximum,
+                        QSizePolicy.Maximum))),
+            gridRow, 1)
+        self.chunkLengthLabel.setBuddy(self.chunkLength)
+
+        gridRow += 1
+        self.gridLayout.addWidget(
+            self.bind("scratchDirLabel", ClickLabel()), gridRow, 0)
+        self.gridLayout.addWidget(
+            self.bind("scratchDir", QLineEdit()), gridRow, 1)
+        self.gridLayout.addWidget(
+            self.bind("scratchDirButton", QPushButton(clicked=self.scratch_dir)), gridRow, 2)
+        self.scratchDirLabel.setBuddy(self.scratchDir)
+
+        gridRow += 1
+        self.gridLayout.addWidget(self.bind("skipUpToDate", QCheckBox()), gridRow, 0, alignment=Qt.AlignRight)
+        self.gridLayout.addWidget(self.bind("skipUpToDateLabel", ClickLabel(buddy=self.skipUpToDate, buddyMethod=QCheckBox.toggle)), gridRow, 1, 1, 2)
+
         gridRow += 1
         self.gridLayout.addWidget(self.bind("checkUpdates", QCheckBox()), gridRow, 0, alignment=Qt.AlignRight)
         self.gridLayout.addWidget(self.bind("checkUpdatesLabel", ClickLabel(buddy=self.checkUpdates, buddyMethod=QCheckBox.toggle)), gridRow, 1, 1, 2)
 
+        gridRow += 1
+        self.gridLayout.addWidget(
+            self.bind("updateIntervalLabel", ClickLabel()), gridRow, 0)
+        self.gridLayout.addWidget(
+            self.bind(
+                "updateInterval",
+                QSpinBox(
+                    minimum=0,
+                    maximum=24 * 30,
+                    sizePolicy=QSizePolicy(
+                        QSizePolicy.Maximum,
+                        QSizePolicy.Maximum))),
+            gridRow, 1)
+        self.updateIntervalLabel.setBuddy(self.updateInterval)
+
         gridRow += 1
         self.gridLayout.addItem(QSpacerItem(20, 20, QSizePolicy.Minimum, QSizePolicy.Expanding), gridRow, 0, 1, 3)
         self.gridLayout.setRowStretch(gridRow, 10)
@@ -988,40 +1047,36 @@ class Ui_MainWindow(QMainWindow):
         self.horizontalLayout.addItem(QSpacerItem(
             20, 40, QSizePolicy.Minimum, QSizePolicy.Expanding))
 
+        startup.mark("setupUi")
         self.loadSettings()
+        startup.mark("loadSettings")
 
         self.retranslateUi()
 
-        try:
-            q = QProcess(program="ffmpeg", arguments=["-version"])
-            q.start()
-        except:
-            ffmpeg_version="UNKNOWN"
-
-        versions = {"kbp2video": __version__, "kbputils": kbputils.__version__}
-        if check2bool(self.checkUpdates):
-            version = lastversion.has_update(repo=f"ItMightBeKaraoke/kbp2video", at="github", pre_ok=True, current_version=versions["kbp2video"])
-            if version:
-                versions["kbp2video"] += f" [update to {version}]"
-            version = lastversion.has_update(repo=f"kbputils", at="pip", current_version=versions["kbputils"])
-            if version:
-                versions["kbputils"] += f" [update to {version}]"
-
-        if not ffmpeg_version:
-            try:
-                q.waitForFinished(1000 if check2bool(self.checkUpdates) else 2000)
-                q.setReadChannel(QProcess.StandardOutput)
-                version_line = q.readLine().toStdString().split()
-                ffmpeg_version = version_line[i+1] if (i := version_line.index("version")) else 'UNKNOWN'
-            except:
-                ffmpeg_version = "MISSING/UNKNOWN"
-        self.statusbar.showMessage(f"kbp2video {versions['kbp2video']} (kbputils {versions['kbputils']}, ffmpeg {ffmpeg_version}, PySide6 {PySide6.__version__})")
+        # Listing what ffmpeg supports can take a moment if it isn't cached
+        self.capabilitiesRunner = Converter(self._capabilities_wrap)
+        self.capabilitiesRunner.signals.data.connect(self.capabilities_found)
+        QThreadPool.globalInstance().start(self.capabilitiesRunner)
+
+        # Finding kbputils' version means importing it, and ffmpeg's means
+        # running it when it isn't cached, so both are left to the thread
+        # pool and the window doesn't wait for them. The update check needs
+        # them, so it starts once they're known
+        self.kbputils_version = ""
+        self.versions = {"kbp2video": __version__, "kbputils": ""}
+        self.ffmpeg_version = discovery.cached_version(self.settings)
+        self.showVersions()
+        self.versionRunner = Converter(self._versions_wrap, not self.ffmpeg_version)
+        self.versionRunner.signals.data.connect(self.versions_found)
+        QThreadPool.globalInstance().start(self.versionRunner)
 
         QMetaObject.connectSlotsByName(self)
+        startup.mark("setupUi")
 
         if self.preload_files:
             self.filedrop.importFiles(self.preload_files)
             delattr(self, "preload_files")
+            startup.mark("preload files")
 
     # setupUi
 
@@ -1162,6 +1217,88 @@ class Ui_MainWindow(QMainWindow):
                                                                          )
                                      """)
 
+    # Check for updates on a thread of its own, so neither the window nor
+    # conversions wait on the network, unless the last check is recent enough
+    def startUpdateCheck(self):
+        current = {"kbp2video": __version__, "kbputils": self.kbputils_version}
+        if (cached := updates.cached_result(self.settings, current, self.updateInterval.value())) is not None:
+            self.showUpdates(cached)
+            return
+        self.updateSignals = ConverterSignals()
+        self.updateSignals.data.connect(lambda data: self.updates_found(current, data))
+        threading.Thread(target=updates.run_check, args=(self.updateSignals, current), daemon=True).start()
+
+    def updates_found(self, current, data):
+        if "timeout" in data:
+            self.versions["kbp2video"] += " [update check timed out]"
+            if self.statusbar.currentMessage().startswith("kbp2video "):
+                self.showVersions()
+            return
+        if "error" in data:
+            print(f"Update check failed:\n{data['error']}")
+            return
+        updates.store_result(self.settings, current, data["updates"])
+        self.showUpdates(data["updates"])
+
+    # Add newer versions ({package: version or ""}) to the status bar
+    def showUpdates(self, newer):
+        for package, version in newer.items():
+            if version and package in self.versions:
+                self.versions[package] += f" [update to {version}]"
+        if self.statusbar.currentMessage().startswith("kbp2video "):
+            self.showVersions()
+
+    def showVersions(self):
+        self.statusbar.showMessage(f"kbp2video {self.versions['kbp2video']} (kbputils {self.versions['kbputils'] or 'checking…'}, ffmpeg {self.ffmpeg_version or 'checking…'}, PySide6 {PySide6.__version__})")
+
+    def showAbout(self):
+        import kbputils
+        QMessageBox.about(self, "About kbp2video", f"kbp2video version: {__version__}\n\nUsing:\nkbputils version: {kbputils.__version__}\nPySide6 version: {PySide6.__version__}\nffmpeg version: {self.ffmpeg_version or 'UNKNOWN'}")
+
+    def _versions_wrap(self, signals, find_ffmpeg):
+        import kbputils
+        data = {"kbputils": kbputils.__version__}
+        if find_ffmpeg:
+            data["ffmpeg"], data["version"] = discovery.ffmpeg_version()
+        signals.data.emit(data)
+
+    def versions_found(self, data):
+        self.kbputils_version = self.versions["kbputils"] = data["kbputils"]
+        if "version" in data:
+            self.ffmpeg_version = data["version"]
+            if data["ffmpeg"]:
+                discovery.remember_version(self.settings, data["ffmpeg"], data["version"])
+        # Unless something else has been shown since
+        if self.statusbar.currentMessage().startswith("kbp2video "):
+            self.showVersions()
+        if check2bool(self.checkUpdates):
+            self.startUpdateCheck()
+
+    def _capabilities_wrap(self, signals):
+        capabilities = ffmpeg_capabilities()
+        signals.data.emit(capabilities.to_json() if capabilities else {})
+
+    def capabilities_found(self, data):
+        if data:
+            self.capabilities = Capabilities(**data)
+            self.markUnsupported()
+
+    # Grey out codecs the installed ffmpeg doesn't have, and containers with
+    # none of their video codecs
+    def markUnsupported(self):
+        if not self.capabilities:
+            return
+        for n, (video_codecs, _) in enumerate(self.containerOptions.values()):
+            self.setItemSupported(self.containerBox, n, any(self.capabilities.supports(x) for x in video_codecs))
+        for box in (self.vcodecBox, self.acodecBox):
+            for n in range(box.count()):
+                self.setItemSupported(box, n, self.capabilities.supports(box.itemText(n)))
+
+    def setItemSupported(self, box, index, supported):
+        item = box.model().item(index)
+        item.setEnabled(supported)
+        item.setToolTip("" if supported else QCoreApplication.translate("MainWindow", "Not supported by the installed ffmpeg", None))
+
     def updateCodecs(self):
         for idx, box in enumerate((self.vcodecBox, self.acodecBox)):
             box.setMaxCount(0)
@@ -1169,6 +1306,7 @@ class Ui_MainWindow(QMainWindow):
             box.addItems(self.containerOptions[self.containerBox.currentText()][idx])
             if box == self.acodecBox:
                 box.addItem("None")
+        self.markUnsupported()
         if self.containerBox.currentText() == "mov":
             self.old_lossless_state = self.lossless.checkState()
             self.lossless.setChecked(True)
@@ -1190,6 +1328,10 @@ class Ui_MainWindow(QMainWindow):
             else:
                 self.outputDir.setText(outputdir)
 
+    def scratch_dir(self):
+        if scratchdir := QFileDialog.getExistingDirectory(self, dir=self.scratchDir.text()):
+            self.scratchDir.setText(scratchdir)
+
     def saveSettings(self, file = None):
         if file:
             if os.path.exists(file):
@@ -1200,6 +1342,16 @@ class Ui_MainWindow(QMainWindow):
             settings = self.settings
 
         to_save = {
+            **self.current_settings(),
+            **{"lyricimport/" + x: Ui_MainWindow.lyricsettings[x] for x in Ui_MainWindow.lyricsettings},
+        }
+        for setting, value in to_save.items():
+            settings.setValue(setting, value)
+        settings.sync()
+
+    # Conversion settings as shown in the window, keyed like SETTING_DEFAULTS
+    def current_settings(self):
+        return {
             "subtitle/aspect_ratio": self.aspectRatioBox.currentText(),
             "subtitle/fade_in": self.fadeIn.value(),
             "subtitle/fade_out": self.fadeOut.value(),
@@ -1222,12 +1374,15 @@ class Ui_MainWindow(QMainWindow):
             "kbp2video/relative_path": check2bool(self.relative),
             "kbp2video/output_dir": self.outputDir.text(),
             "kbp2video/ignore_bg_files_drag_drop": check2bool(self.skipBackgrounds),
+            "kbp2video/concurrent_jobs": self.concurrentJobs.value(),
+            "kbp2video/schedule_index": self.scheduleBox.currentIndex(),
             "kbp2video/check_updates": check2bool(self.checkUpdates),
-            **{"lyricimport/" + x: Ui_MainWindow.lyricsettings[x] for x in Ui_MainWindow.lyricsettings},
+            "kbp2video/update_check_hours": self.updateInterval.value(),
+            "kbp2video/skip_up_to_date": check2bool(self.skipUpToDate),
+            "kbp2video/chunk_seconds": self.chunkLength.value(),
+            "kbp2video/priority_index": self.priorityBox.currentIndex(),
+            "kbp2video/scratch_dir": self.scratchDir.text(),
         }
-        for setting, value in to_save.items():
-            settings.setValue(setting, value)
-        settings.sync()
 
     def loadSettings(self, file = None):
         
@@ -1255,16 +1410,16 @@ class Ui_MainWindow(QMainWindow):
         elif aspect_text != "<NONEXISTENT>":
             self.aspectRatioBox.setCurrentText(aspect_text)
 
-        self.fadeIn.setValue(settings.value("subtitle/fade_in", type=int, defaultValue=50))
-        self.fadeOut.setValue(settings.value("subtitle/fade_out", type=int, defaultValue=50))
-        self.offset.setValue(settings.value("subtitle/offset", type=float, defaultValue=0.0))
-        self.offset_check_box(setState=bool2check(settings.value("subtitle/override_offset", type=bool, defaultValue=False)))
-        self.transparencyBox.setCheckState(bool2check(settings.value("subtitle/transparent_bg", type=bool, defaultValue=True)))
-        self.ktBox.setCheckState(bool2check(settings.value("subtitle/allow_kt", type=bool, defaultValue=False)))
-        self.spacingBox.setCheckState(bool2check(settings.value("subtitle/style1_spacing", type=bool, defaultValue=False)))
-        self.overflowBox.setCurrentText(settings.value("subtitle/overflow", type=str, defaultValue="no wrap"))
-        self.updateColor(setColor=settings.value("video/background_color", type=str, defaultValue="#000000"))
-        self.loopBGBox.setCheckState(bool2check(settings.value("video/loop_bg", type=bool, defaultValue=False)))
+        self.fadeIn.setValue(settings.value("subtitle/fade_in", type=int, defaultValue=SETTING_DEFAULTS["subtitle/fade_in"]))
+        self.fadeOut.setValue(settings.value("subtitle/fade_out", type=int, defaultValue=SETTING_DEFAULTS["subtitle/fade_out"]))
+        self.offset.setValue(settings.value("subtitle/offset", type=float, defaultValue=SETTING_DEFAULTS["subtitle/offset"]))
+        self.offset_check_box(setState=bool2check(settings.value("subtitle/override_offset", type=bool, defaultValue=SETTING_DEFAULTS["subtitle/override_offset"])))
+        self.transparencyBox.setCheckState(bool2check(settings.value("subtitle/transparent_bg", type=bool, defaultValue=SETTING_DEFAULTS["subtitle/transparent_bg"])))
+        self.ktBox.setCheckState(bool2check(settings.value("subtitle/allow_kt", type=bool, defaultValue=SETTING_DEFAULTS["subtitle/allow_kt"])))
+        self.spacingBox.setCheckState(bool2check(settings.value("subtitle/style1_spacing", type=bool, defaultValue=SETTING_DEFAULTS["subtitle/style1_spacing"])))
+        self.overflowBox.setCurrentText(settings.value("subtitle/overflow", type=str, defaultValue=SETTING_DEFAULTS["subtitle/overflow"]))
+        self.updateColor(setColor=settings.value("video/background_color", type=str, defaultValue=SETTING_DEFAULTS["video/background_color"]))
+        self.loopBGBox.setCheckState(bool2check(settings.value("video/loop_bg", type=bool, defaultValue=SETTING_DEFAULTS["video/loop_bg"])))
 
         # Restore existing or custom option
         resolution_text = settings.value("video/output_resolution", type=str, defaultValue="<NONEXISTENT>")
@@ -1274,12 +1429,12 @@ class Ui_MainWindow(QMainWindow):
             self.resolutionBox.setCurrentText(resolution_text)
 
         #self.overrideBGResolution.setCheckState(bool2check(settings.value("video/override_bg_resolution", type=bool, defaultValue=False)))
-        self.containerBox.setCurrentIndex(settings.value("video/container_format_index", type=int, defaultValue=0))
+        self.containerBox.setCurrentIndex(settings.value("video/container_format_index", type=int, defaultValue=SETTING_DEFAULTS["video/container_format_index"]))
         self.updateCodecs()
-        self.vcodecBox.setCurrentIndex(settings.value("video/video_codec_index", type=int, defaultValue=0))
-        self.lossless.setCheckState(bool2check(settings.value("video/lossless", type=bool, defaultValue=False)))
-        self.quality.setValue(settings.value("video/quality", type=int, defaultValue=23))
-        self.acodecBox.setCurrentIndex(settings.value("video/audio_codec_index", type=int, defaultValue=0))
+        self.vcodecBox.setCurrentIndex(settings.value("video/video_codec_index", type=int, defaultValue=SETTING_DEFAULTS["video/video_codec_index"]))
+        self.lossless.setCheckState(bool2check(settings.value("video/lossless", type=bool, defaultValue=SETTING_DEFAULTS["video/lossless"])))
+        self.quality.setValue(settings.value("video/quality", type=int, defaultValue=SETTING_DEFAULTS["video/quality"]))
+        self.acodecBox.setCurrentIndex(settings.value("video/audio_codec_index", type=int, defaultValue=SETTING_DEFAULTS["video/audio_codec_index"]))
 
         # transition from previous str type
         if settings.contains("video/audio_bitrate") and not settings.contains("video/audio_bitrate_kb"):
@@ -1292,11 +1447,18 @@ class Ui_MainWindow(QMainWindow):
             settings.remove("video/audio_bitrate")
             settings.setValue("video/audio_bitrate_kb", new_bitrate)
 
-        self.abitrateBox.setValue(settings.value("video/audio_bitrate_kb", type=int, defaultValue=256))
-        self.relative.setCheckState(bool2check(settings.value("kbp2video/relative_path", type=bool, defaultValue=True)))
-        self.outputDir.setText(settings.value("kbp2video/output_dir", type=str, defaultValue="kbp2video"))
-        self.skipBackgrounds.setCheckState(bool2check(settings.value("kbp2video/ignore_bg_files_drag_drop", type=bool, defaultValue=False)))
-        self.checkUpdates.setCheckState(bool2check(settings.value("kbp2video/check_updates", type=bool, defaultValue=False)))
+        self.abitrateBox.setValue(settings.value("video/audio_bitrate_kb", type=int, defaultValue=SETTING_DEFAULTS["video/audio_bitrate_kb"]))
+        self.relative.setCheckState(bool2check(settings.value("kbp2video/relative_path", type=bool, defaultValue=SETTING_DEFAULTS["kbp2video/relative_path"])))
+        self.outputDir.setText(settings.value("kbp2video/output_dir", type=str, defaultValue=SETTING_DEFAULTS["kbp2video/output_dir"]))
+        self.skipBackgrounds.setCheckState(bool2check(settings.value("kbp2video/ignore_bg_files_drag_drop", type=bool, defaultValue=SETTING_DEFAULTS["kbp2video/ignore_bg_files_drag_drop"])))
+        self.concurrentJobs.setValue(settings.value("kbp2video/concurrent_jobs", type=int, defaultValue=SETTING_DEFAULTS["kbp2video/concurrent_jobs"]))
+        self.scheduleBox.setCurrentIndex(settings.value("kbp2video/schedule_index", type=int, defaultValue=SETTING_DEFAULTS["kbp2video/schedule_index"]))
+        self.checkUpdates.setCheckState(bool2check(settings.value("kbp2video/check_updates", type=bool, defaultValue=SETTING_DEFAULTS["kbp2video/check_updates"])))
+        self.updateInterval.setValue(settings.value("kbp2video/update_check_hours", type=int, defaultValue=SETTING_DEFAULTS["kbp2video/update_check_hours"]))
+        self.skipUpToDate.setCheckState(bool2check(settings.value("kbp2video/skip_up_to_date", type=bool, defaultValue=SETTING_DEFAULTS["kbp2video/skip_up_to_date"])))
+        self.chunkLength.setValue(settings.value("kbp2video/chunk_seconds", type=int, defaultValue=SETTING_DEFAULTS["kbp2video/chunk_seconds"]))
+        self.priorityBox.setCurrentIndex(settings.value("kbp2video/priority_index", type=int, defaultValue=SETTING_DEFAULTS["kbp2video/priority_index"]))
+        self.scratchDir.setText(settings.value("kbp2video/scratch_dir", type=str, defaultValue=SETTING_DEFAULTS["kbp2video/scratch_dir"]))
         Ui_MainWindow.lyricsettings = {
             "max_lines_per_page": 6,
             "min_gap_for_new_page": 1000,
@@ -1312,62 +1474,156 @@ class Ui_MainWindow(QMainWindow):
             self.saveSettings()  # Save to disk any new defaults that were used
 
     def runAssConversion(self):
-        self.saveSettings()
-        converter = Converter(self.conversion_runner, assOnly = True)
+        if not (settings := self.conversion_settings()):
+            return
+        converter = Converter(self.conversion_runner, settings, self.table_rows(), assOnly = True)
+        converter.signals.status.connect(self.statusbar.showMessage)
         # worker.signals.finished.connect
         QThreadPool.globalInstance().start(converter)
 
     def runConversion(self):
-        self.saveSettings()
-        converter = Converter(self.conversion_runner)
-        # worker.signals.finished.connect
+        if not (settings := self.conversion_settings()):
+            return
+        rows = self.table_rows()
+        self.journal.start(settings, rows)
+        self.run_batch(settings, rows, self.confirm_overwrite)
+
+    # Run the unfinished jobs from the last batch again, with the settings it
+    # was started with
+    def resumeConversion(self):
+        if not self.journal.load() or not self.journal.unfinished():
+            self.info("Nothing to resume", "The last batch conversion has no unfinished files.")
+            self.update_resume_action()
+            return
+        settings = ConversionSettings(self.journal.data["settings"])
+        try:
+            settings.validate()
+        except SettingsError as e:
+            self.info(e.title, e.message)
+            return
+        skip = self.journal.prepare_resume(settings)
+        # .ass files from this batch can be replaced without asking again
+        self.run_batch(settings, self.journal.rows(), lambda assfile: True, skip)
+
+    # Render part of each selected row, to check timing without waiting for
+    # whole songs. Not recorded in the journal
+    def runProofConversion(self):
+        if not (selected := sorted(set(x.row() for x in self.tableWidget.selectedIndexes()))):
+            return
+        if not (settings := self.conversion_settings()):
+            return
+        rows = [self.table_rows()[x] for x in selected]
+        pages = ()
+        if len(rows) == 1 and hasattr(kbp_obj := rows[0][0], "kbp_path"):
+            try:
+                pages = proof.page_windows(kbp_obj.parsed()[1], settings.kbputils_options.get("offset"))
+            except OSError:
+                pass
+        if not (window := ProofDialog.showProofDialog(self.settings, pages, self)):
+            return
+        settings.proof = window
+        self.run_batch(settings, rows, self.confirm_overwrite, journal=False)
+
+    def run_batch(self, settings, rows, confirm_overwrite, skip=(), journal=True):
+        converter = Converter(self.conversion_runner, settings, rows, confirm_overwrite=confirm_overwrite, skip=skip)
+        converter.signals.status.connect(self.statusbar.showMessage)
+        # Preparing jobs happens on the thread pool, but the runner lives on
+        # this thread and is driven by the event loop
+        runner = EncodeRunner(
+                len(rows),
+                self.concurrentJobs.value(),
+                SchedulePolicy(self.scheduleBox.currentIndex()),
+                parent=self,
+                priority=Priority(self.priorityBox.currentIndex()))
+        converter.signals.job.connect(runner.add_job)
+        converter.signals.prepared.connect(runner.finish_input)
+        runner.progress.connect(converter.signals.progress)
+        runner.file_done.connect(converter.signals.file_done)
+        runner.error.connect(converter.signals.error)
+        runner.status.connect(self.statusbar.showMessage)
+        converter.signals.paused.connect(runner.set_paused)
+        # Rows that have been reported done, successful or not
+        results = {}
+        converter.signals.file_done.connect(lambda row, success: results.__setitem__(row, success))
+        runner.finished.connect(lambda success: self.conversion_finished(converter.signals, runner, success, rows, results, journal))
+        if journal:
+            runner.started.connect(self.journal.job_started)
+            converter.signals.file_done.connect(self.journal.file_done)
+        QThreadPool.globalInstance().start(converter)
+        if not ProgressWindow.showProgressWindow(len(rows), converter.signals, self, can_pause=True):
+            converter.signals.cancelled = True
+            runner.cancel()
+        # ffmpeg can take a moment to exit after cancelling
+        if runner.done:
+            runner.deleteLater()
+        else:
+            runner.finished.connect(runner.deleteLater)
+        if journal:
+            if not self.journal.unfinished():
+                self.journal.clear()
+            self.update_resume_action()
+
+    def update_resume_action(self):
+        self.resumeAction.setEnabled(bool(self.journal.unfinished()))
+
+    # Write the prepared jobs to a spool directory for kbp2video worker
+    # processes to render, possibly on other machines
+    def submit_to_spool(self):
+        if not self.tableWidget.rowCount():
+            return
+        spool_dir = QFileDialog.getExistingDirectory(self, "Select spool folder to submit jobs to", dir=self.settings.value("kbp2video/spool_dir", type=str, defaultValue=""))
+        if not spool_dir:
+            return
+        try:
+            spool.init_spool(spool_dir)
+        except spool.SpoolError as e:
+            QMessageBox.warning(self, "Unable to use spool folder", str(e))
+            return
+        self.settings.setValue("kbp2video/spool_dir", spool_dir)
+        if not (settings := self.conversion_settings()):
+            return
+        converter = Converter(self.conversion_runner, settings, self.table_rows(), spool_dir=spool_dir)
+        converter.signals.status.connect(self.statusbar.showMessage)
         QThreadPool.globalInstance().start(converter)
         if not ProgressWindow.showProgressWindow(self.tableWidget.rowCount(), converter.signals, self):
             converter.signals.cancelled = True
 
-    def resolved_output_dir(self, kbp):
-        if check2bool(self.relative):
-
-            # If relative is set, assume .ass dir is the output dir because we
-            # no longer know the project file
-            if kbp.casefold().endswith(".ass"):
-                return os.path.dirname(kbp)
-            else:
-                # TODO: check if self.outputDir starts with a slash? Otherwise it behaves like an absolute path
-                return os.path.join(os.path.dirname(kbp), self.outputDir.text())
-        else:
-            return self.outputDir.text()
-    
-    def assFile(self, kbp):
-        filename = os.path.basename(kbp)
+    def conversion_finished(self, signals, runner, success, rows, results, journal):
+        if not runner.cancelled:
+            self.statusbar.showMessage(f"Conversion completed{'' if success else ' (with errors)'}!")
+            signals.finished.emit()
+        elif unfinished := [str(rows[n][0]) for n in range(len(rows)) if n not in results]:
+            self.info("Conversion cancelled",
+                      f"{len(unfinished)} file(s) were not finished, and any partial videos were removed:\n\n" + "\n".join(unfinished) +
+                      ("\n\nUse File > Resume interrupted batch to finish them." if journal else ""))
+
+    # Save and return the current settings for a conversion, or None if they
+    # can't be used
+    def conversion_settings(self):
         # This REALLY needs to be set...
         while not check2bool(self.relative) and not self.outputDir.text():
             self.output_dir()
-        return self.resolved_output_dir(kbp) + "/" + filename[:-4].translate(str.maketrans("","",":;,'=\"")) + ".ass"
-    
-    def vidFile(self, kbp):
-        filename = os.path.basename(kbp)
-        return self.resolved_output_dir(kbp) + "/" + filename[:-4] + "." + self.containerBox.currentText()
-
-    def get_aspect_ratio(self):
-        text = self.aspectRatioBox.currentText()
-        if (res := re.search(r'\((.*)\)', text)):
-            text = res.group(1)
-        ratio, border = (x.strip() for x in text.partition(",")[0:3:2])
-        if border.upper() == "TRUE" or border == "":
-            border = True
-        elif border.upper() == "FALSE":
-            border = False
-        else:
-            border = None
-        ratio = list(ratio.partition(":")[0:3:2])
-        for n, i in enumerate(ratio):
-            try:
-                ratio[n] = int(i.strip())
-            except ValueError:
-                ratio[n] = None
-        return (ratio, border)
-       
+        self.saveSettings()
+        settings = ConversionSettings(self.current_settings())
+        try:
+            settings.validate()
+        except SettingsError as e:
+            self.info(e.title, e.message)
+            return None
+        return settings
+
+    # Snapshot of the table for conversion.prepare_jobs, so the worker thread
+    # doesn't need to touch the widgets
+    def table_rows(self):
+        rows = []
+        for row in range(self.tableWidget.rowCount()):
+            kbp_table_item = self.tableWidget.item(row, TrackTableColumn.KBP_ASS.value)
+            rows.append((
+                kbp_table_item.data(Qt.UserRole) or kbp_table_item.text(),
+                self.tableWidget.filename(row, TrackTableColumn.Audio.value),
+                self.tableWidget.filename(row, TrackTableColumn.Background.value),
+                self.tableWidget.item(row, TrackTableColumn.Advanced.value).data(Qt.UserRole) or {}))
+        return rows
 
     # Defining this to be invoked from a thread
     @Slot(str, str, result=int)
@@ -1383,233 +1639,58 @@ class Ui_MainWindow(QMainWindow):
     def info(self, title, text):
         QMessageBox.information(self, title, text)
 
-    def conversion_runner(self, signals, assOnly = False):
+    # Called from the conversion thread before replacing an existing .ass file
+    def confirm_overwrite(self, assfile):
+        return QMessageBox.StandardButton(QMetaObject.invokeMethod(
+            self,
+            'yesno',
+            Qt.BlockingQueuedConnection,
+            Q_RETURN_ARG(int),
+            Q_ARG(str, "Replace file?"),
+            Q_ARG(str, f"Overwrite {assfile}?"))) == QMessageBox.Yes
+
+    # Called from the conversion thread if the batch might not fit on disk
+    def confirm_space(self, message):
+        return QMessageBox.StandardButton(QMetaObject.invokeMethod(
+            self,
+            'yesno',
+            Qt.BlockingQueuedConnection,
+            Q_RETURN_ARG(int),
+            Q_ARG(str, "Not enough space"),
+            Q_ARG(str, f"{message}\n\nSizes are estimated from the song lengths and video settings. Start anyway?"))) == QMessageBox.Yes
+
+    # Point the row at the .ass file written by an .ass-only conversion
+    def ass_written(self, row, assfile):
+        kbp_table_item = self.tableWidget.item(row, TrackTableColumn.KBP_ASS.value)
+        kbp_table_item.setData(Qt.UserRole, KBPASSWrapper(assfile))
+        kbp_table_item.setText(os.path.basename(assfile))
+        kbp_table_item.setToolTip(assfile)
+        kbp_table_item.setFlags(Qt.ItemIsSelectable | Qt.ItemIsEnabled | Qt.ItemNeverHasChildren)
+
+    def conversion_runner(self, signals, settings, rows, assOnly = False, spool_dir = None, confirm_overwrite = None, skip = ()):
         signals.started.emit()
-        unsupported_message = False
-        kbputils_options = {}
-        ratio, border = self.get_aspect_ratio()
-        if ratio[0] is None or border is None:
-            QMetaObject.invokeMethod(
-                self,
-                'info', 
-                Qt.AutoConnection,
-                Q_ARG(str, "Invalid Aspect Ratio setting"),
-                Q_ARG(str, f"Invalid Aspect Ratio setting\nPlease choose from the available options or follow the format in parens if you set a custom value."))
-            return
-        if ratio[1] is None:
-            ratio[1] = 216
-        resolution = self.resolutionBox.currentText().split()[0]
-        if len(tmp := resolution.split("x")) != 2 or any(not re.match(r'\d+$', x) for x in tmp):
-            QMetaObject.invokeMethod(
-                self,
-                'info', 
-                Qt.AutoConnection,
-                Q_ARG(str, "Invalid Resolution setting"),
-                Q_ARG(str, f"Invalid Resolution setting\nPlease choose from the available options or enter a width and height separated by x."))
-            return
-        tmp = [int(x) for x in tmp]
-        if tmp[1] * ratio[0] / ratio[1] >= tmp[0]:
-            kbputils_options['target_x'] = tmp[0]
-            kbputils_options['target_y'] = int(tmp[0] * ratio[1] / ratio[0])
+        if spool_dir:
+            success, submitted = False, []
+            try:
+                success, submitted = spool.submit_jobs(signals, rows, settings, spool_dir, self.confirm_overwrite)
+            except:
+                signals.error.emit(f"Failed to prepare files for conversion\n\nError Output:\n{traceback.format_exc()}", True)
+            signals.status.emit(f"Submitted {len(submitted)} job(s) to {spool_dir}{'' if success else ' (with errors)'}")
+            signals.finished.emit()
+        elif assOnly:
+            conversion_errors = not conversion.prepare_jobs(signals, rows, settings, confirm_overwrite=self.confirm_overwrite, ass_only=True, ass_written=self.ass_written)
+            signals.status.emit(f"Conversion completed{' (with errors)' if conversion_errors else ''}!")
+            signals.finished.emit()
         else:
-            kbputils_options['target_y'] = tmp[1]
-            kbputils_options['target_x'] = int(tmp[1] * ratio[0] / ratio[1])
-        width = round((216 if border else 192) * ratio[0] / ratio[1])
-        default_bg = self.colorText.text().strip(" #")
-        if not border:
-            kbputils_options['border'] = False
-        kbputils_options['fade_in'] = self.fadeIn.value()
-        kbputils_options['fade_out'] = self.fadeOut.value()
-        if self.overrideOffset.checkState() == Qt.Checked:
-            kbputils_options['offset'] = int(self.offset.value()*1000)
-        if self.transparencyBox.checkState() != Qt.Checked:
-            kbputils_options['transparency'] = False
-        if self.ktBox.checkState() == Qt.Checked:
-            kbputils_options['allow_kt'] = True
-        if self.spacingBox.checkState() == Qt.Checked:
-            kbputils_options['experimental_spacing'] = True
-        kbputils_options['overflow'] = kbputils.AssOverflow[self.overflowBox.currentText().replace(" ", "_").upper()]
-        conversion_errors = False
-        ffmpeg_processes = []
-        for row in range(self.tableWidget.rowCount()):
-            kbp_table_item = self.tableWidget.item(row, TrackTableColumn.KBP_ASS.value)
-            kbp_obj = kbp_table_item.data(Qt.UserRole) or kbp_table_item.text()
-            kbp = str(kbp_obj)
-            audio = self.tableWidget.filename(row, TrackTableColumn.Audio.value)
-            background = self.tableWidget.filename(row, TrackTableColumn.Background.value)
-            advanced = self.tableWidget.item(row, TrackTableColumn.Advanced.value).data(Qt.UserRole) or {}
-            use_alpha = False
-            print(f"Retrieved Advanced settings for {kbp}:")
-            print(advanced)
-            if not kbp:
-                continue
-            self.statusbar.showMessage(f"Converting file {row+1} of {self.tableWidget.rowCount()} ({kbp})")
-            signals.progress.emit(row, self.tableWidget.rowCount(), kbp, 0, 0)
-            if not background:
-                background_type = 0
-                background = default_bg
-            elif background.startswith("color:"):
-                background = background[6:].strip(" #")
-                if len(background) == 8:
-                    use_alpha = True
-                background_type = 0
-            else:
-                background_type = 1
-
-            assfile = self.assFile(kbp)
-
-            # Handle manually-typed filename. TODO: convert earlier, when the text value is updated
-            if not isinstance(kbp_obj, KBPASSWrapper):
-                try:
-                    kbp_obj = KBPASSWrapper(kbp_obj)
-                except:
-                    conversion_errors = True
-                    signals.error.emit(f"Failed to process file\n{kbp}\n\nError Output:\n{traceback.format_exc()}", True)
-                    continue
-            if hasattr(kbp_obj, "kbp_path"):
-                print(kbputils_options)
-                try:
-                    data = kbp_obj.ass_data(**kbputils_options)
-                except:
-                    conversion_errors = True
-                    signals.error.emit(f"Failed to process .kbp file\n{kbp}\n\nError Output:\n{traceback.format_exc()}", True)
-                    continue
-            else: # kbp_obj is a KBPASSWrapper with a .ass file
-                if any(x in kbp for x in ":;,'=\""):
-                    print("Already .ass file, but needs new filename for ffmpeg")
-                    QFile(kbp).copy(assfile)
-                else:
-                    print("Using existing .ass file")
-                    assfile = kbp
-                    
-            # QDir is inconsistent. Needs to be static to check existence, and
-            # mkdir needs to be run from an instantiated instance in the parent
-            # directory, not worth the hassle
-            if not os.path.isdir(outdir := self.resolved_output_dir(kbp)):
-                try:
-                    os.mkdir(outdir)
-                except:
-                    conversion_errors = True
-                    signals.error.emit(f"Failed to create output folder\n{outdir}\nassociated with .kbp file\n{kbp}\n\nError Output:\n{traceback.format_exc()}", True)
-                    continue
-
-            # File was converted and .ass file needs to be written
-            if kbp.casefold().endswith(".kbp"):
-                f = QFile(assfile)
-                if f.exists():
-                    answer = QMessageBox.StandardButton(QMetaObject.invokeMethod(
-                        self,
-                        'yesno',
-                        Qt.BlockingQueuedConnection,
-                        Q_RETURN_ARG(int),
-                        Q_ARG(str, "Replace file?"),
-                        Q_ARG(str, f"Overwrite {assfile}?")))
-                    if answer != QMessageBox.Yes:
-                        signals.error.emit(f"Skipped {kbp} per user request (.ass file exists)", True)
-                        continue
-                if not f.open(QIODevice.WriteOnly | QIODevice.Text):
-                    continue
-                out = QTextStream(f)
-                out << data
-                f.close()
-                if assOnly:
-                    kbp_table_item.setData(Qt.UserRole, KBPASSWrapper(assfile))
-                    kbp_table_item.setText(os.path.basename(assfile))
-                    kbp_table_item.setToolTip(assfile)
-                    kbp_table_item.setFlags(Qt.ItemIsSelectable | Qt.ItemIsEnabled | Qt.ItemNeverHasChildren)
-
-            if assOnly:
-                continue
-
-            output_options = {}
-            base_assfile = os.path.basename(assfile)
-
-            if (container := self.containerBox.currentText()) == 'mkv':
-                container = 'matroska'
-
-            # Retrieve the enabled intro/outro parameters, excluding the X_enabled keys themselves
-            advanced_params = {k: v for k, v in advanced.items() if (
-                        (k.startswith('intro_') and advanced['intro_enable']) or 
-                        (k.startswith('outro') and advanced['outro_enable'])) 
-                    and not k.endswith('_enable')}
-
-            if self.acodecBox.currentText() != "None":
-                audio_opts = {
-                        "audio_file": audio,
-                        "audio_codec": self.acodecBox.currentText(),
-                        "audio_bitrate": self.abitrateBox.value(),
-                    }
-            else:
-                audio_opts = {}
-
-            converter = kbputils.VideoConverter(
-                        assfile,
-                        self.vidFile(kbp),
-                        preview = True,
-                        aspect_ratio = kbputils.Ratio(*ratio),
-                        target_x = resolution.split('x')[0],
-                        target_y = resolution.split('x')[1],
-                        **({"background_color": background} if background_type == 0 else {"background_media": background}),
-                        loop_background_video = check2bool(self.loopBGBox),
-                        media_container = container,
-                        video_codec = self.vcodecBox.currentText(),
-                        video_quality = 0 if check2bool(self.lossless) else self.quality.value(),
-                        **audio_opts,
-                        **advanced_params,
-                        output_options = {
-                                "pix_fmt": "rgba" if self.vcodecBox.currentText() == "png" else "yuva420p" if use_alpha else "yuv420p",
-                                "hide_banner": None,
-                                "progress": "-",
-                                "loglevel": "warning"
-                            }
-                    )
-
-            # This is going to be a slight regression in error reporting for now,
-            # as kbputils doesn't have as much explicit error handling yet
+            # Each job is handed to the EncodeRunner as soon as it is ready,
+            # so encoding starts while later rows are still being prepared
+            success = False
             try:
-                ffmpeg_cmdinfo = converter.run()
+                success = conversion.prepare_jobs(signals, rows, settings, signals.job.emit, confirm_overwrite or self.confirm_overwrite, skip=skip, confirm_space=self.confirm_space)
             except:
-                conversion_errors = True
-                signals.error.emit(f"Skipped {kbp}:\nUnable to generate ffmpeg command\n{traceback.format_exc()}", True)
-                continue
-
-            q = QProcess(program=ffmpeg_cmdinfo['args'][0], arguments=ffmpeg_cmdinfo['args'][1:], workingDirectory=ffmpeg_cmdinfo['cwd'])
-            q.setReadChannel(QProcess.StandardOutput)
-            ffmpeg_processes.append((kbp, ffmpeg_cmdinfo['length'], q))
-
-        for row, (kbp, song_length_ms, q) in enumerate(ffmpeg_processes):
-            q.start()
-            q.waitForStarted(-1)
-            while not q.waitForFinished(100):
-                if signals.cancelled:
-                    self.statusbar.showMessage(f"Conversion cancelled during file {row+1} of {len(ffmpeg_processes)}!")
-                    signals.finished.emit()
-                    return
-                while q.canReadLine():
-                    if (ffmpeg_out_line := q.readLine().toStdString()).startswith("out_time_us="):
-                        try:
-                            out_time = int(ffmpeg_out_line.split("=")[1]) / 1000
-                        except:
-                            pass # TODO: maybe switch to throbber if ffmpeg isn't outputting progress properly?
-                        else:
-                            signals.progress.emit(row, len(ffmpeg_processes), kbp, out_time, song_length_ms)
-
-            if q.exitStatus() != QProcess.NormalExit or q.exitCode() != 0:
-                conversion_errors = True
-                #QMetaObject.invokeMethod(
-                #    self,
-                #    'info',
-                #    Qt.AutoConnection,
-                #    Q_ARG(str, "Failed to convert file"),
-                #    Q_ARG(str, f"Failed to process file\n{kbp}\n\nError Output:\n{q.readAllStandardError().toStdString()}"))
-                signals.error.emit(f"Failed to process file\n{kbp}\n\nError Output:\n{q.readAllStandardError().toStdString()}", True)
-                print(q.exitStatus())
-                print(q.exitCode())
-
-            signals.progress.emit(row, len(ffmpeg_processes), kbp, song_length_ms, song_length_ms)
-        
-        self.statusbar.showMessage(f"Conversion completed{' (with errors)' if conversion_errors else ''}!")
-        signals.finished.emit()
+                signals.error.emit(f"Failed to prepare files for conversion\n\nError Output:\n{traceback.format_exc()}", True)
+            finally:
+                signals.prepared.emit(success)
 
     def retranslateUi(self):
         self.setWindowTitle(QCoreApplication.translate(
@@ -1702,8 +1783,48 @@ class Ui_MainWindow(QMainWindow):
             "MainWindow", "Ig&nore BG files in drag/drop", None))
         self.skipBackgroundsLabel.setToolTip(QCoreApplication.translate(
             "MainWindow", "When dragging and dropping files, do not import any image or video files\nas backgrounds. This is useful if you have your output and input files\nin the same place and usually use solid color backgrounds.", None))
+        self.concurrentJobsLabel.setText(QCoreApplication.translate(
+            "MainWindow", "Simultaneous encodes (&J)", None))
+        self.concurrentJobsLabel.setToolTip(QCoreApplication.translate(
+            "MainWindow", "Number of ffmpeg processes to run at the same time when converting to video.\nA single encode leaves most cores idle on large machines, but each one\nrunning uses more memory.", None))
+        self.scheduleLabel.setText(QCoreApplication.translate(
+            "MainWindow", "Encode &order", None))
+        self.scheduleBox.setToolTip(QCoreApplication.translate(
+            "MainWindow", "Order to start encodes in when running several at once\n  Table order: the order files are listed on the left\n  Longest first: start the biggest jobs early so the whole batch finishes sooner\n  Shortest first: get the first finished videos back as soon as possible\nLength is estimated from the song length, resolution and video codec.", None))
+        self.priorityLabel.setText(QCoreApplication.translate(
+            "MainWindow", "Encode priori&ty", None))
+        self.priorityBox.setToolTip(QCoreApplication.translate(
+            "MainWindow", "How much ffmpeg competes with other programs for the computer\n  Normal: as fast as possible\n  Low: other programs get the CPU first, so the computer stays responsive\n  Idle: only use CPU and disk time nothing else wants\nRunning encodes can also be paused from the progress window.", None))
+        self.chunkLengthLabel.setText(QCoreApplication.translate(
+            "MainWindow", "Split long songs every", None))
+        self.chunkLength.setSuffix(QCoreApplication.translate(
+            "MainWindow", " s", None))
+        self.chunkLength.setSpecialValueText(QCoreApplication.translate(
+            "MainWindow", "Never", None))
+        self.chunkLengthLabel.setToolTip(QCoreApplication.translate(
+            "MainWindow", "Encode songs longer than this in chunks of this many seconds, which run at the same\ntime like separate files (see Simultaneous encodes) and are joined without re-encoding.\nSpeeds up one long song on a machine with cores to spare. Finished chunks are kept\nuntil the video is done, so a cancelled encode picks up where it left off.\nNot used when an overlaid intro or outro plays its sound over the song.", None))
+        self.scratchDirLabel.setText(QCoreApplication.translate(
+            "MainWindow", "Scratch fol&der", None))
+        self.scratchDir.setPlaceholderText(QCoreApplication.translate(
+            "MainWindow", "Render straight to the output folder", None))
+        self.scratchDirLabel.setToolTip(QCoreApplication.translate(
+            "MainWindow", "Folder on a fast local disk to render videos in. Each one is moved to the output\nfolder once it's done, so the output folder never has half-written files in it.", None))
+        self.scratchDirButton.setText(QCoreApplication.translate(
+            "MainWindow", "Browse…", None))
+        self.skipUpToDateLabel.setText(QCoreApplication.translate(
+            "MainWindow", "Skip videos that are up to date", None))
+        self.skipUpToDateLabel.setToolTip(QCoreApplication.translate(
+            "MainWindow", "Don't render a video again if it was made by kbp2video from the same project,\naudio, background, intro/outro and settings, and hasn't been changed since.\nUncheck to always render every file.", None))
         self.checkUpdatesLabel.setText(QCoreApplication.translate(
             "MainWindow", "Check for updates at start (&X)", None))
+        self.updateIntervalLabel.setText(QCoreApplication.translate(
+            "MainWindow", "Check again after", None))
+        self.updateInterval.setSuffix(QCoreApplication.translate(
+            "MainWindow", " h", None))
+        self.updateInterval.setSpecialValueText(QCoreApplication.translate(
+            "MainWindow", "Every start", None))
+        self.updateIntervalLabel.setToolTip(QCoreApplication.translate(
+            "MainWindow", "How long to reuse the result of the update check at start before asking the internet again.\nThe check runs in the background and shows its result in the status bar.", None))
         self.skipBackgroundsLabel.setToolTip(QCoreApplication.translate(
             "MainWindow", "When kbp2video is started, check for updates and alert if one is available.", None))
         self.generalDivider.setText(QCoreApplication.translate(
@@ -1726,33 +1847,57 @@ class Ui_MainWindow(QMainWindow):
 
 
 def run(argv=sys.argv, ffmpeg_path=None):
+    startup.mark("imports")
+    # Before anything can use QSettings, whichever mode is run
+    set_application_names()
+    if len(argv) > 1 and argv[1] == "render":
+        from .render import render_main
+        sys.exit(render_main(argv, ffmpeg_path))
+    elif len(argv) > 1 and argv[1] == "worker":
+        from .render import worker_main
+        sys.exit(worker_main(argv, ffmpeg_path))
     QApplication.setStyle("Fusion")
-    QApplication.setApplicationName("kbp2video")
-    QApplication.setApplicationVersion(__version__)
     app = QApplication(argv)
+    startup.mark("QApplication")
     parser = QCommandLineParser()
-    parser.setApplicationDescription(QCoreApplication.translate("MainWindow", "Tool to work with karaoke projects and render high quality videos. Input files can be provided via the command line, but the GUI is shown regardless, to configure options for conversion.", None))
+    parser.setApplicationDescription(QCoreApplication.translate("MainWindow", "Tool to work with karaoke projects and render high quality videos. Input files can be provided via the command line, but the GUI is shown regardless, to configure options for conversion. To render without the GUI, use the render sub-command (see kbp2video render --help).", None))
     parser.addPositionalArgument(QCoreApplication.translate("MainWindow", "files", None),
                                  QCoreApplication.translate("MainWindow", "files to import", None),
                                  f'[{QCoreApplication.translate("MainWindow", "files", None)}...]')
+    profileOption = QCommandLineOption(["profile-startup"], QCoreApplication.translate("MainWindow", "Print how long each part of starting up takes.", None))
+    parser.addOption(profileOption)
     parser.addHelpOption()
     parser.addVersionOption()
     parser.process(app)
     orig_path = os.environ['PATH']
     if ffmpeg_path:
         os.environ['PATH'] = os.pathsep.join([ffmpeg_path, os.environ['PATH']])
-    if not shutil.which("ffmpeg"):
-        result = QFileDialog.getExistingDirectory(None, "Locate folder with ffmpeg and ffprobe")
-        if result:
-            os.environ['PATH'] = os.pathsep.join([result, orig_path])
+    settings = QSettings()
+    if tools := discovery.cached_tools(settings, os.environ['PATH']):
+        if tools["extra_dir"]:
+            os.environ['PATH'] = os.pathsep.join([tools["extra_dir"], orig_path])
+    elif not discovery.find_tools(settings, search_path := os.environ['PATH']):
         if not shutil.which("ffmpeg"):
-            QMessageBox.critical(None, "ffmpeg not found", "ffmpeg still not found, please download the full release or otherwise install ffmpeg.")
+            result = QFileDialog.getExistingDirectory(None, "Locate folder with ffmpeg and ffprobe")
+            if result:
+                os.environ['PATH'] = os.pathsep.join([result, orig_path])
+                # Remembered for next time, as long as PATH is the same
+                discovery.find_tools(settings, search_path, result)
+            if not shutil.which("ffmpeg"):
+                QMessageBox.critical(None, "ffmpeg not found", "ffmpeg still not found, please download the full release or otherwise install ffmpeg.")
+                sys.exit(1)
+        if not shutil.which("ffprobe"):
+            QMessageBox.critical(None, "ffprobe not found", "ffprobe still not found, please download the full release or otherwise install ffmpeg.")
             sys.exit(1)
-    if not shutil.which("ffprobe"):
-        QMessageBox.critical(None, "ffprobe not found", "ffprobe still not found, please download the full release or otherwise install ffmpeg.")
-        sys.exit(1)
+    startup.mark("find ffmpeg")
     if preload_files := parser.positionalArguments():
         print(f"Found preload files: {preload_files}")
     window = Ui_MainWindow(app, preload_files)
     window.show()
+    if parser.isSet(profileOption):
+        # Once the window has been drawn
+        def report():
+            startup.mark("show window")
+            startup.report()
+        QTimer.singleShot(0, report)
     sys.exit(app.exec())
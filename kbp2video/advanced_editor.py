@@ -1,7 +1,6 @@
 from PySide6.QtCore import Qt, QCoreApplication, QTime
 from PySide6.QtWidgets import QLabel, QDialogButtonBox, QDialog, QSizePolicy, QCheckBox, QVBoxLayout, QPushButton, QWidget, QMessageBox, QFileDialog, QLineEdit, QTabWidget, QTimeEdit, QGridLayout
 from .utils import ClickLabel, mimedb, check2bool, bool2check
-import ffmpeg
 
 class AdvancedEditor(QDialog):
 
@@ -291,8 +290,9 @@ class AdvancedEditor(QDialog):
         # TODO: figure out a starting dir?
         if result:
             getattr(self, f"{where}_media").setText(file)
-            if mimedb.mimeTypeForFile(file).name().startswith('video/'):
+            if mimedb().mimeTypeForFile(file).name().startswith('video/'):
                 # Maybe not perfect if it contains multiple streams of varying sizes, but should be unlikely
+                import ffmpeg
                 try:
                     if vid_length := ffmpeg.probe(file)['format']['duration']:
                         getattr(self, f"{where}_length").setTime(QTime.fromMSecsSinceStartOfDay(int(float(vid_length)*1000)))
@@ -0,0 +1,128 @@
+from PySide6.QtCore import QStandardPaths
+import hashlib
+import json
+import os
+import subprocess
+import threading
+from . import resources
+from .fingerprint import file_identity
+
+# kbputils reads a still background with -loop 1, which has ffmpeg decode the
+# image again for every frame of the video (60 per second of the song). A
+# large PNG or JPEG shared by a whole batch ends up being decoded hundreds of
+# thousands of times. Instead, each still is decoded once into a one-frame
+# lossless clip, which kbputils treats as a video shorter than the song and
+# pads by repeating the frame, so the image is never decoded again. The clip
+# keeps the image's size, since kbputils doesn't scale backgrounds, and is
+# stored as 8-bit RGB (with alpha if the image has it), which converts to the
+# output format the same as the image would, to within rounding. AVI is used
+# since its 1/60 time base gives the same frame count as the image would.
+# Colors and real videos are passed through unchanged: the color source is
+# already cheap, and videos have to be decoded anyway.
+# kbputils probes the background when it builds the song's command, so the
+# clip has to exist before the job is prepared, and can't be left to the
+# runner like a segment. It's made while preparing instead, at the batch's
+# priority, and stopped if the batch is cancelled
+
+# Seconds between checks for the batch being cancelled while making a clip
+CANCEL_POLL = 0.1
+
+# Bump when the clip format changes so old entries aren't used
+CACHE_VERSION = 1
+
+# Number of clips to keep. Older ones are removed when a new one is made
+MAX_ENTRIES = 32
+
+# Demuxers ffmpeg uses for single images (image2 for a file name, *_pipe when
+# probing finds the format from the contents)
+STILL_FORMATS = ("image2",)
+STILL_FORMAT_SUFFIX = "_pipe"
+
+# Pixel formats of images that may have transparency
+ALPHA_PIX_FMTS = ("rgba", "bgra", "argb", "abgr", "ya", "yuva", "gbrap", "pal8")
+
+def cache_dir():
+    return os.path.join(QStandardPaths.writableLocation(QStandardPaths.CacheLocation), "backgrounds")
+
+def cache_key(identity):
+    return hashlib.sha256(json.dumps([CACHE_VERSION, identity]).encode()).hexdigest()
+
+# The single video stream of media if it's a still image, otherwise None
+def still_stream(info):
+    format_name = info['format'].get('format_name', '')
+    if format_name not in STILL_FORMATS and not format_name.endswith(STILL_FORMAT_SUFFIX):
+        return None
+    streams = info['streams']
+    if len(streams) != 1 or streams[0]['codec_type'] != 'video':
+        return None
+    return streams[0]
+
+# Path to use instead of the background media, or None to use it as-is.
+# priority is a resources.NICE_VALUES index, and cancelled() is True once the
+# batch has been cancelled. Never raises: if anything goes wrong the original
+# is used
+def cached_background(media, priority=0, cancelled=lambda: False):
+    if not (identity := file_identity(media)):
+        return None
+    path = os.path.join(cache_dir(), f"{cache_key(identity)}.avi")
+    if os.path.exists(path):
+        # Keep recently used entries from being pruned
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+    import ffmpeg
+    try:
+        if not (stream := still_stream(ffmpeg.probe(media))):
+            return None
+        return make_clip(media, stream, path, priority, cancelled)
+    except Exception as e:
+        print(f"Unable to cache background {media}: {e}")
+        return None
+
+# Returns None if cancelled. Raises RuntimeError if ffmpeg fails
+def make_clip(media, stream, path, priority=0, cancelled=lambda: False):
+    pix_fmt = "bgra" if stream.get("pix_fmt", "").startswith(ALPHA_PIX_FMTS) else "bgr0"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Unique per thread and process, so workers sharing the cache don't
+    # clobber each other's partial files
+    tmp = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp.avi"
+    args = ["ffmpeg", "-v", "error", "-y", "-i", media, "-frames:v", "1", "-r", "60", "-c:v", "ffv1", "-pix_fmt", pix_fmt, tmp]
+    try:
+        process = subprocess.Popen(resources.priority_command(args, priority), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        resources.set_process_priority(process.pid, priority)
+        while True:
+            try:
+                errors = process.communicate(timeout=CANCEL_POLL)[1]
+                break
+            except subprocess.TimeoutExpired:
+                if cancelled():
+                    process.kill()
+                    process.communicate()
+                    print(f"Stopped caching background {media}, cancelled")
+                    return None
+        if process.returncode != 0:
+            raise RuntimeError(errors.strip())
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    print(f"Cached background {media} as {path}")
+    prune()
+    return path
+
+def prune():
+    entries = []
+    try:
+        for entry in os.scandir(cache_dir()):
+            if entry.name.endswith(".avi") and ".tmp" not in entry.name:
+                entries.append((entry.stat().st_mtime, entry.path))
+    except OSError:
+        # Another process pruning at the same time
+        return
+    for _, path in sorted(entries, reverse=True)[MAX_ENTRIES:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,103 @@
+from PySide6.QtCore import QStandardPaths
+import json
+import os
+import re
+import shutil
+import subprocess
+from .fingerprint import file_identity
+
+# ffmpeg builds differ in which encoders and filters they include, and a
+# missing one otherwise only shows up as an ffmpeg error for every row, after
+# the .kbp files have all been converted. Instead, the encoders and filters of
+# the ffmpeg on PATH are listed once, so unsupported choices can be greyed out
+# and a batch can be checked before it starts. Running ffmpeg takes a moment,
+# so the lists are cached by the binary's path, size and modification time,
+# which change whenever it's replaced or upgraded
+
+# Bump when what's stored in the cache changes so old entries aren't used
+CACHE_VERSION = 1
+
+# Filters used by kbputils for every render or for intros/outros. ass needs
+# ffmpeg to be built with libass
+REQUIRED_FILTERS = ("ass", "color", "format", "overlay", "scale", "fade", "amix")
+
+# How long to wait for ffmpeg to list what it has, in seconds
+PROBE_TIMEOUT = 10
+
+# What an ffmpeg binary can do. Codec names in conversion.CONTAINER_OPTIONS
+# are either encoder names (e.g. libx265) or names of what's encoded (h264),
+# which ffmpeg maps to the first encoder it has for it
+class Capabilities:
+    def __init__(self, encoders, codecs, filters):
+        self.encoders = set(encoders)
+        self.codecs = set(codecs)
+        self.filters = set(filters)
+
+    def supports(self, codec):
+        return codec == "None" or codec in self.encoders or codec in self.codecs
+
+    def missing_filters(self):
+        return [x for x in REQUIRED_FILTERS if x not in self.filters]
+
+    # Descriptions of what's missing to render with the given codecs (audio
+    # "None" for no audio)
+    def problems(self, video_codec, audio_codec):
+        result = [f"The {kind} codec {codec} isn't supported" for kind, codec in (("video", video_codec), ("audio", audio_codec))
+                  if not self.supports(codec)]
+        if missing := self.missing_filters():
+            result.append(f"Missing filters: {', '.join(missing)}")
+        return result
+
+    def to_json(self):
+        return {"encoders": sorted(self.encoders), "codecs": sorted(self.codecs), "filters": sorted(self.filters)}
+
+def cache_path():
+    return os.path.join(QStandardPaths.writableLocation(QStandardPaths.CacheLocation), "ffmpeg_capabilities.json")
+
+# (encoder names, codec names) from ffmpeg -encoders
+def parse_encoders(text):
+    encoders, codecs = [], []
+    listing = False
+    for line in text.splitlines():
+        if line.strip().startswith("------"):
+            listing = True
+        elif listing and (match := re.match(r"\s*[VAS][A-Z.]{5}\s+(\S+)(.*\(codec (\S+)\))?", line)):
+            encoders.append(match[1])
+            if match[3]:
+                codecs.append(match[3])
+    return (encoders, codecs)
+
+# Filter names from ffmpeg -filters
+def parse_filters(text):
+    return [match[1] for line in text.splitlines() if (match := re.match(r"\s*[A-Z.]{3}\s+(\S+)\s+\S*->\S*", line))]
+
+def probe(ffmpeg):
+    listings = [subprocess.run([ffmpeg, "-hide_banner", option], capture_output=True, text=True, timeout=PROBE_TIMEOUT, check=True).stdout
+                for option in ("-encoders", "-filters")]
+    return Capabilities(*parse_encoders(listings[0]), parse_filters(listings[1]))
+
+# Capabilities of the ffmpeg on PATH, from the cache if it's the same binary
+# as last time. None if ffmpeg can't be found or run
+def ffmpeg_capabilities():
+    if not (identity := file_identity(shutil.which("ffmpeg"))):
+        return None
+    path = cache_path()
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached["version"] == CACHE_VERSION and cached["ffmpeg"] == identity:
+            return Capabilities(cached["encoders"], cached["codecs"], cached["filters"])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    try:
+        result = probe(identity[0])
+    except (OSError, subprocess.SubprocessError) as e:
+        print(f"Unable to list ffmpeg capabilities: {e}")
+        return None
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"version": CACHE_VERSION, "ffmpeg": identity, **result.to_json()}, f)
+    except OSError:
+        pass
+    return result
@@ -0,0 +1,153 @@
+import os
+import re
+from . import fingerprint
+from .encoder import EncodeJob
+from .segments import THREAD_OPTIONS, output_args, write_concat_list
+
+# A long song can take longer to encode than the rest of a batch put
+# together, using only as many threads as one encoder keeps busy. Instead, it
+# can be split into chunks of a fixed length that are encoded as separate
+# ffmpeg processes, so they run in parallel like jobs for different rows, and
+# then joined with the concat demuxer using stream copy. Each chunk renders
+# the song with every source in the filter graph trimmed to the chunk's time,
+# so the subtitles and overlay only work on its own frames, and output seeking
+# so it starts on a keyframe at time 0.
+#
+# Chunks are video only. The audio is encoded once while joining, since
+# splitting it would leave encoder padding at every boundary. This only works
+# when the song's audio is taken straight from the audio file; if kbputils has
+# to filter it (e.g. mixing in an intro's sound) the job isn't split.
+#
+# Chunks are kept in a hidden folder next to the output (in the scratch folder
+# if there is one) until the join succeeds, each with a fingerprint sidecar,
+# so if the batch is cancelled or crashes only unfinished chunks are encoded
+# again next time. The folder is only made when the job is about to start
+# (see EncodeJob.split), so preparing a job, e.g. to submit it to a spool,
+# doesn't write anything
+
+# Hidden folder next to output that holds its chunks
+def chunk_dir(output):
+    directory, name = os.path.split(output)
+    return os.path.join(directory, f".{name}.chunks")
+
+# Whether the audio of a kbputils ffmpeg command comes straight from an input,
+# rather than from the filter graph, so the video can be rendered without it
+def can_split(args):
+    maps = [args[n+1] for n, arg in enumerate(args) if arg == "-map"]
+    return len(maps) >= 1 and not any(x.startswith("[") for x in maps[1:])
+
+# args with thread options removed, for fingerprints
+def without_thread_options(args):
+    result = []
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg in THREAD_OPTIONS:
+            skip = True
+        else:
+            result.append(arg)
+    return result
+
+# Filter graph with each chain that starts from a source (e.g. color) or an
+# input's video (labelled N:v, or just N as for a still background) trimmed
+# to start..end (seconds, end None for no limit), so later filters skip
+# everything outside it. trim keeps the timestamps, so the subtitles still
+# line up with the song
+def trim_sources(graph, start, end):
+    window = f"trim=start={start}" + (f":end={end}" if end is not None else "")
+    chains = []
+    for chain in graph.split(";"):
+        inputs, filters, outputs = re.fullmatch(r"((?:\[[^\]]*\])*)(.*?)((?:\[[^\]]*\])*)", chain).groups()
+        if all(re.fullmatch(r"\d+(?::v)?", label) for label in re.findall(r"\[([^\]]*)\]", inputs)):
+            filters = f"{filters},{window}" if filters else window
+        chains.append(f"{inputs}{filters}{outputs}")
+    return ";".join(chains)
+
+# ffmpeg command rendering the video from start (seconds) for duration (or to
+# the end if None) to path, from the kbputils command args rendering to output
+def chunk_args(args, output, start, duration, path):
+    first_map = args.index("-map")
+    inputs = list(args[:first_map])
+    if "-filter_complex" in inputs:
+        n = inputs.index("-filter_complex") + 1
+        inputs[n] = trim_sources(inputs[n], start, start + duration if duration is not None else None)
+    end = args.index(output)
+    codec_args = output_args(args, output)
+    # Drop the audio map and audio options
+    video_args = []
+    skip = False
+    for arg in codec_args:
+        if skip:
+            skip = False
+        elif arg.endswith(":a"):
+            skip = True
+        elif arg != "-an":
+            video_args.append(arg)
+    window = ["-ss", str(start)] + (["-t", str(duration)] if duration is not None else [])
+    return [*inputs, *args[first_map:first_map+2], *video_args, "-an", *window, "-progress", "-", path, *args[end+1:]]
+
+# ffmpeg command joining the chunks listed in concat_list and encoding the
+# audio from audio_file, with the options of the kbputils command args
+# rendering to output
+def join_args(args, output, concat_list, audio_file):
+    codec_args = output_args(args, output)
+    audio_args = []
+    container = []
+    for n, arg in enumerate(codec_args):
+        if arg.endswith(":a"):
+            audio_args += codec_args[n:n+2]
+        elif arg == "-f":
+            container = codec_args[n:n+2]
+    audio = ["-i", audio_file] if audio_file and "-an" not in codec_args else []
+    return ["ffmpeg", "-hide_banner", "-loglevel", "warning", "-f", "concat", "-safe", "0", "-i", concat_list, *audio,
+            "-map", "0:v", *(["-map", "1:a", *audio_args] if audio else ["-an"]),
+            "-c:v", "copy", *container, "-progress", "-", output, "-y"]
+
+# Split job, rendering length ms of video to target (its output, or the part
+# file if intro/outro segments are joined afterwards), into chunks of about
+# chunk_length seconds. The job's own command becomes the join, run once all
+# of job.parts are done. Leaves the job alone if it's too short or can't be
+# split. Writes the chunk folder, so it's called as the job is about to start.
+# Raises OSError
+def split_job(job, chunk_length, target, length):
+    length /= 1000
+    if chunk_length <= 0 or not can_split(job.args):
+        return
+    # The last chunk takes whatever's left over, so there's no tiny one at
+    # the end
+    if (count := round(length / chunk_length)) < 2:
+        return
+    directory = chunk_dir(os.path.abspath(job.render_to))
+    os.makedirs(directory, exist_ok=True)
+    extension = os.path.splitext(job.output)[1]
+    key_base = {
+        "project": fingerprint.file_digest(job.assfile),
+        "media": {key: fingerprint.file_identity(value) for key, value in job.options.items()
+                  if key in ("audio_file", "background_media") or key.endswith("_media")},
+    }
+    files = []
+    done = 0
+    for n in range(count):
+        start = n * chunk_length
+        duration = chunk_length if n < count - 1 else None
+        path = os.path.join(directory, f"{n:04d}{extension}")
+        files.append(path)
+        args = chunk_args(job.args, target, start, duration, path)
+        key = fingerprint.digest({**key_base, "args": without_thread_options(args)})
+        ms = (duration if duration is not None else length - start) * 1000
+        if fingerprint.up_to_date(path, key):
+            job.part_time[path] = ms
+            done += 1
+            continue
+        part = EncodeJob(job.row, job.kbp, {"args": args, "cwd": job.cwd, "length": ms}, job.cost,
+                         job.work * ms / (length * 1000), assfile=job.assfile, output=path, options=job.options,
+                         lossless=job.lossless, fingerprint=key)
+        part.whole = job
+        job.parts.append(part)
+    print(f"Split {job.kbp} into {count} chunks, {done} already encoded")
+    concat_list = write_concat_list(files, os.path.join(directory, "chunks"))
+    job.args = join_args(job.args, target, concat_list, job.options.get("audio_file"))
+    # Stream copy and audio only
+    job.cost = (1, 0)
+    job.resume_dirs.append(directory)
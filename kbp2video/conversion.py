@@ -0,0 +1,608 @@
+from PySide6.QtCore import QFile, QIODevice, QTextStream
+import collections
+import functools
+import io
+import os
+import re
+import threading
+import traceback
+from . import backgrounds, chunks, proof, resources, segments, storage
+from .capabilities import ffmpeg_capabilities
+from .encoder import EncodeJob, Priority, SchedulePolicy
+from .fingerprint import render_fingerprint, up_to_date
+
+ASPECT_RATIO_OPTIONS = [
+    "CDG, borders (25:18, True)",
+    "Wide, borders (16:9, True)",
+    "Standard, borders (4:3, True)",
+    "CDG no border (3:2, False)",
+    "Wide no border (16:9, False)",
+]
+
+RESOLUTION_OPTIONS = [
+    "1500x1080",
+    "1920x1080 (1080p)",
+    "3000x2160",
+    "3840x2160 (4K)",
+    "1000x720",
+    "1280x720 (720p)",
+    "640x480"
+]
+
+# Container: (video codecs, audio codecs). The audio codec list is followed
+# by "None" in the GUI
+CONTAINER_OPTIONS = {
+    "mp4": (("h264", "libvpx-vp9", "libx265", "libsvtav1"), ("aac", "mp3", "libopus")),
+    "mkv": (("libvpx-vp9", "h264", "libx265", "libsvtav1"), ("flac", "libopus", "aac", "mp3")),
+    "webm": (("libvpx-vp9", "libsvtav1"), ("libopus",)),
+    "mov": (("png",), ("aac",)),
+}
+
+# A single encode rarely keeps more than a few cores busy (libass rendering,
+# audio encoding and muxing are all single-threaded), so run roughly one
+# ffmpeg per 4 cores by default
+DEFAULT_CONCURRENT_JOBS = max(1, min(8, (os.cpu_count() or 1) // 4))
+
+# Everything that affects a conversion, as stored by Ui_MainWindow.saveSettings
+SETTING_DEFAULTS = {
+    "subtitle/aspect_ratio": ASPECT_RATIO_OPTIONS[0],
+    "subtitle/fade_in": 50,
+    "subtitle/fade_out": 50,
+    "subtitle/offset": 0.0,
+    "subtitle/override_offset": False,
+    "subtitle/transparent_bg": True,
+    "subtitle/allow_kt": False,
+    "subtitle/style1_spacing": False,
+    "subtitle/overflow": "no wrap",
+    "video/background_color": "#000000",
+    "video/loop_bg": False,
+    "video/output_resolution": RESOLUTION_OPTIONS[0],
+    "video/container_format_index": 0,
+    "video/video_codec_index": 0,
+    "video/lossless": False,
+    "video/quality": 23,
+    "video/audio_codec_index": 0,
+    "video/audio_bitrate_kb": 256,
+    "kbp2video/relative_path": True,
+    "kbp2video/output_dir": "kbp2video",
+    "kbp2video/ignore_bg_files_drag_drop": False,
+    "kbp2video/concurrent_jobs": DEFAULT_CONCURRENT_JOBS,
+    "kbp2video/schedule_index": SchedulePolicy.TABLE_ORDER.value,
+    "kbp2video/check_updates": False,
+    "kbp2video/update_check_hours": 24,
+    "kbp2video/skip_up_to_date": True,
+    "kbp2video/chunk_seconds": 0,
+    "kbp2video/priority_index": Priority.NORMAL.value,
+    "kbp2video/scratch_dir": "",
+}
+
+# Bounded least recently used cache of parsed .kbp files and the .ass data
+# generated from them, so converting the same rows again (e.g. Subtitle only,
+# then Convert to Video) doesn't redo the work. Keys start with the file's path
+# and its (size, mtime) when it was read, so a file that changed on disk is
+# never served from the cache, and entries for older versions of it are
+# dropped. Shared by the GUI and conversion threads
+class KBPCache:
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # Cached value for key, calling make() to create it if needed. make runs
+    # without the lock held, so two threads may both build the same entry
+    def get(self, key, make):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+        value = make()
+        with self.lock:
+            for stale in [k for k in self.entries if k[0] == key[0] and k[1] != key[1]]:
+                del self.entries[stale]
+            self.entries[key] = value
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __str__(self):
+        return f"{len(self.entries)} entries, {self.hits} hits, {self.misses} misses"
+
+# TODO: Possibly pull PlayRes? from .ass to letterbox
+class KBPASSWrapper:
+    cache = KBPCache()
+
+    def __init__(self, path):
+        if path.casefold().endswith(".ass"):
+            self.ass_path = path
+            # raise correct exception we would get later from opening
+            with open(path, "r") as _:
+                pass
+        else:
+            self.kbp_path = path
+            self.kbp_obj = self.parsed()[1]
+
+    # (cache key, KBPFile) for the current contents of the .kbp file. Stat is
+    # taken before reading, so a change while parsing makes the next lookup miss
+    def parsed(self):
+        import kbputils
+        stat = os.stat(self.kbp_path)
+        key = (os.path.abspath(self.kbp_path), (stat.st_size, stat.st_mtime_ns))
+        return (key, KBPASSWrapper.cache.get((*key, "kbp"), lambda: kbputils.KBPFile(self.kbp_path)))
+
+    def ass_data(self, **kwargs):
+        if hasattr(self,"kbp_path"):
+            import kbputils
+            # Re-read file in case it changed on disk
+            key, self.kbp_obj = self.parsed()
+            # Without an offset option, kbputils takes it from the KBS
+            # settings (in hundredths of a second), so it's filled in here to
+            # be part of the key
+            if "offset" not in kwargs:
+                from kbputils import kbs
+                kwargs = {**kwargs, "offset": kbs.offset * 10}
+
+            def convert():
+                tmp = io.StringIO()
+                kbputils.AssConverter(self.kbp_obj,**kwargs).ass_document().dump_file(tmp)
+                return tmp.getvalue()
+            return KBPASSWrapper.cache.get((*key, "ass", tuple(sorted(kwargs.items()))), convert)
+        else:
+            # Added for symmetry or something, but...
+            print("Probably shouldn't reach this code")
+            f = QFile(self.ass_path)
+            if not f.open(QIODevice.ReadOnly | QIODevice.Text):
+                raise IOError(f"Unable to open {self.ass_path}")
+            res = QTextStream(f).readAll()
+            f.close()
+            return res
+
+    def __str__(self):
+        return self.kbp_path if hasattr(self,"kbp_path") else self.ass_path
+
+# A setting can't be used for conversion. title and message are meant to be
+# shown to the user as-is
+class SettingsError(Exception):
+    def __init__(self, title, message):
+        super().__init__(message)
+        self.title = title
+        self.message = message
+
+# One file failed to convert. The message is meant to be shown to the user
+class ConversionError(Exception):
+    pass
+
+# The user chose not to convert a file, so it's not counted as an error
+class SkippedError(ConversionError):
+    pass
+
+# Conversion settings, independent of any widgets so they can be built from
+# the GUI, a QSettings/ini file or the command line. Values use the same keys
+# as SETTING_DEFAULTS, which fill in anything missing
+class ConversionSettings:
+    def __init__(self, values=None, proof=None):
+        self.values = dict(SETTING_DEFAULTS)
+        self.values.update(values or {})
+        # proof.ProofWindow to only render part of each video, or None
+        self.proof = proof
+
+    @staticmethod
+    def from_qsettings(settings):
+        return ConversionSettings({
+            key: settings.value(key, type=type(default), defaultValue=default)
+            for key, default in SETTING_DEFAULTS.items()})
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    # Check everything needed for a batch up front, including that the
+    # installed ffmpeg can do it. Raises SettingsError
+    def validate(self):
+        try:
+            self.video_codec
+            self.audio_codec
+        except IndexError:
+            raise SettingsError("Invalid Video options", "Invalid Video options\nThe container or codec setting is out of range.")
+        if (capabilities := ffmpeg_capabilities()) and (problems := capabilities.problems(self.video_codec, self.audio_codec)):
+            raise SettingsError("Unsupported Video options", "Unsupported Video options\nThe installed ffmpeg can't render with these settings:\n" + "\n".join(problems))
+        self.aspect_ratio
+        self.resolution
+        self.kbputils_options
+        if (scratch_dir := self["kbp2video/scratch_dir"]) and not os.path.isdir(scratch_dir):
+            raise SettingsError("Invalid Scratch Folder setting", f"Invalid Scratch Folder setting\nThe folder {scratch_dir} doesn't exist.")
+
+    @functools.cached_property
+    def aspect_ratio(self):
+        text = self["subtitle/aspect_ratio"]
+        if (res := re.search(r'\((.*)\)', text)):
+            text = res.group(1)
+        ratio, border = (x.strip() for x in text.partition(",")[0:3:2])
+        if border.upper() == "TRUE" or border == "":
+            border = True
+        elif border.upper() == "FALSE":
+            border = False
+        else:
+            border = None
+        ratio = list(ratio.partition(":")[0:3:2])
+        for n, i in enumerate(ratio):
+            try:
+                ratio[n] = int(i.strip())
+            except ValueError:
+                ratio[n] = None
+        if ratio[0] is None or border is None:
+            raise SettingsError("Invalid Aspect Ratio setting", "Invalid Aspect Ratio setting\nPlease choose from the available options or follow the format in parens if you set a custom value.")
+        if ratio[1] is None:
+            ratio[1] = 216
+        return (ratio, border)
+
+    @functools.cached_property
+    def resolution(self):
+        resolution = self["video/output_resolution"].split()[0] if self["video/output_resolution"].strip() else ""
+        if len(tmp := resolution.split("x")) != 2 or any(not re.match(r'\d+$', x) for x in tmp):
+            raise SettingsError("Invalid Resolution setting", "Invalid Resolution setting\nPlease choose from the available options or enter a width and height separated by x.")
+        return tuple(int(x) for x in tmp)
+
+    @property
+    def container(self):
+        return list(CONTAINER_OPTIONS)[self["video/container_format_index"]]
+
+    @property
+    def video_codec(self):
+        return CONTAINER_OPTIONS[self.container][0][self["video/video_codec_index"]]
+
+    # "None" if the output should have no audio
+    @property
+    def audio_codec(self):
+        return (*CONTAINER_OPTIONS[self.container][1], "None")[self["video/audio_codec_index"]]
+
+    # mov only supports lossless png
+    @property
+    def lossless(self):
+        return self["video/lossless"] or self.container == "mov"
+
+    @property
+    def default_background(self):
+        return self["video/background_color"].strip(" #")
+
+    @functools.cached_property
+    def kbputils_options(self):
+        import kbputils
+        kbputils_options = {}
+        ratio, border = self.aspect_ratio
+        width, height = self.resolution
+        if height * ratio[0] / ratio[1] >= width:
+            kbputils_options['target_x'] = width
+            kbputils_options['target_y'] = int(width * ratio[1] / ratio[0])
+        else:
+            kbputils_options['target_y'] = height
+            kbputils_options['target_x'] = int(height * ratio[0] / ratio[1])
+        if not border:
+            kbputils_options['border'] = False
+        kbputils_options['fade_in'] = self["subtitle/fade_in"]
+        kbputils_options['fade_out'] = self["subtitle/fade_out"]
+        if self["subtitle/override_offset"]:
+            kbputils_options['offset'] = int(self["subtitle/offset"]*1000)
+        if not self["subtitle/transparent_bg"]:
+            kbputils_options['transparency'] = False
+        if self["subtitle/allow_kt"]:
+            kbputils_options['allow_kt'] = True
+        if self["subtitle/style1_spacing"]:
+            kbputils_options['experimental_spacing'] = True
+        try:
+            kbputils_options['overflow'] = kbputils.AssOverflow[self["subtitle/overflow"].replace(" ", "_").upper()]
+        except KeyError:
+            raise SettingsError("Invalid Word Wrapping setting", f"Invalid Word Wrapping setting\n{self['subtitle/overflow']}")
+        return kbputils_options
+
+    def resolved_output_dir(self, kbp):
+        if self["kbp2video/relative_path"]:
+
+            # If relative is set, assume .ass dir is the output dir because we
+            # no longer know the project file
+            if kbp.casefold().endswith(".ass"):
+                return os.path.dirname(kbp)
+            else:
+                # TODO: check if self.outputDir starts with a slash? Otherwise it behaves like an absolute path
+                return os.path.join(os.path.dirname(kbp), self["kbp2video/output_dir"])
+        else:
+            return self["kbp2video/output_dir"]
+
+    def ass_file(self, kbp):
+        filename = os.path.basename(kbp)
+        return self.resolved_output_dir(kbp) + "/" + filename[:-4].translate(str.maketrans("","",":;,'=\"")) + ".ass"
+
+    def vid_file(self, kbp):
+        filename = os.path.basename(kbp)
+        result = self.resolved_output_dir(kbp) + "/" + filename[:-4] + "." + self.container
+        return proof.proof_file(result, self.proof) if self.proof else result
+
+# Keyword arguments for kbputils.VideoConverter, except for the thread options
+# that depend on the machine running the encode (see encode_job). Only plain
+# JSON types are used so a job can be written out and run elsewhere, which
+# means aspect_ratio is an [x, y] list instead of a kbputils.Ratio
+def video_options(settings, audio, background, advanced):
+    use_alpha = False
+    if not background:
+        background_type = 0
+        background = settings.default_background
+    elif background.startswith("color:"):
+        background = background[6:].strip(" #")
+        if len(background) == 8:
+            use_alpha = True
+        background_type = 0
+    else:
+        background_type = 1
+
+    # Retrieve the enabled intro/outro parameters, excluding the X_enabled keys themselves
+    advanced_params = {k: v for k, v in advanced.items() if (
+                (k.startswith('intro_') and advanced['intro_enable']) or
+                (k.startswith('outro') and advanced['outro_enable']))
+            and not k.endswith('_enable')}
+
+    if settings.audio_codec != "None":
+        audio_opts = {
+                "audio_file": audio,
+                "audio_codec": settings.audio_codec,
+                "audio_bitrate": settings["video/audio_bitrate_kb"],
+            }
+    else:
+        audio_opts = {}
+
+    if (container := settings.container) == 'mkv':
+        container = 'matroska'
+
+    width, height = settings.resolution
+    return {
+        "aspect_ratio": list(settings.aspect_ratio[0]),
+        "target_x": width,
+        "target_y": height,
+        **({"background_color": background} if background_type == 0 else {"background_media": background}),
+        "loop_background_video": settings["video/loop_bg"],
+        "media_container": container,
+        "video_codec": settings.video_codec,
+        "video_quality": 0 if settings.lossless else settings["video/quality"],
+        **audio_opts,
+        **advanced_params,
+        "output_options": {
+                "pix_fmt": "rgba" if settings.video_codec == "png" else "yuva420p" if use_alpha else "yuv420p",
+                "hide_banner": None,
+                "progress": "-",
+                "loglevel": "warning",
+            },
+    }
+
+# Build the EncodeJob rendering assfile to output with the given
+# video_options, limited to the threads this machine can spare for it. Still
+# background images are swapped for a clip from this machine's background
+# cache, made at priority (a resources.NICE_VALUES index) unless cancelled()
+# becomes True first. Concatenated intros/outros are taken from the segment
+# cache (the job needs jobs encoding any that aren't there yet) and joined to
+# the song once it's rendered. Songs longer than chunk_length are split into
+# chunks when the job starts. If scratch_dir is set, the video and any
+# intermediate files are written there, and moved to output once it's done.
+# If spooled is set, the job is only being written to a spool for a worker to
+# run, so none of that is done here: the worker sets it up when it runs the
+# job. Raises whatever kbputils does if the ffmpeg command can't be generated
+def encode_job(row, kbp, assfile, output, options, lossless=False, fingerprint=None, chunk_length=0, scratch_dir="", spooled=False, priority=0, cancelled=lambda: False):
+    import kbputils
+    video_codec = options["video_codec"]
+    width, height = options["target_x"], options["target_y"]
+    cost = resources.estimate_cost(video_codec, width, height, lossless=lossless)
+    background = {}
+    if "background_media" in options and not spooled and (clip := backgrounds.cached_background(options["background_media"], priority, cancelled)):
+        # Looping would decode the clip over and over instead of repeating its frame
+        background = {"background_media": clip, "loop_background_video": False}
+    kinds = [] if spooled else segments.concat_kinds(options)
+    render_options = {**segments.without_segments(options, kinds), **background}
+    target = storage.scratch_file(scratch_dir, output) if scratch_dir else output
+    render_output = segments.part_file(os.path.abspath(target)) if kinds else target
+    converter = kbputils.VideoConverter(
+                assfile,
+                render_output,
+                preview = True,
+                **{
+                    **render_options,
+                    "aspect_ratio": kbputils.Ratio(*options["aspect_ratio"]),
+                    "output_options": {
+                        **options["output_options"],
+                        **resources.ffmpeg_thread_options(video_codec, cost[0], lossless),
+                    },
+                }
+            )
+    ffmpeg_cmdinfo = converter.run()
+    work = resources.estimate_work(ffmpeg_cmdinfo['length'], video_codec, width, height, lossless=lossless)
+    job = EncodeJob(row, kbp, ffmpeg_cmdinfo, cost, work, assfile=assfile, output=output, options=options, lossless=lossless, fingerprint=fingerprint)
+    job.chunk_length = chunk_length
+    job.render_to = target
+    # Needs the command as kbputils made it, before it's split into chunks
+    if kinds:
+        segments.add_segments(job, {**options, **background}, kinds, render_output)
+    if chunk_length and not spooled:
+        job.split = functools.partial(chunks.split_job, job, chunk_length, render_output, ffmpeg_cmdinfo['length'])
+    return job
+
+# Fingerprint of everything that affects the video rendered for a row, or
+# None if the project file can't be read. kbputils options only matter if the
+# project is a .kbp
+def job_fingerprint(kbp, audio, background, advanced, settings):
+    try:
+        return render_fingerprint(
+                kbp,
+                settings.kbputils_options if kbp.casefold().endswith(".kbp") else None,
+                video_options(settings, audio, background, advanced))
+    except OSError:
+        return None
+
+# Convert one file to .ass and, unless ass_only is set, build the EncodeJob to
+# render it. kbp_obj is a KBPASSWrapper or a path to a .kbp/.ass file, and
+# advanced is the row's intro/outro settings. confirm_overwrite(assfile) is
+# called before replacing an existing .ass file. Returns (assfile, job), with
+# job None if ass_only is set. fingerprint, spooled and cancelled are passed on
+# to encode_job. Raises ConversionError if the file can't be converted
+def prepare_job(row, kbp_obj, audio, background, advanced, settings, confirm_overwrite=lambda assfile: True, ass_only=False, fingerprint=None, spooled=False, cancelled=lambda: False):
+    kbp = str(kbp_obj)
+    if not settings["kbp2video/relative_path"] and not settings["kbp2video/output_dir"]:
+        raise ConversionError(f"Failed to process file\n{kbp}\n\nNo output folder is set")
+    assfile = settings.ass_file(kbp)
+
+    # Handle manually-typed filename. TODO: convert earlier, when the text value is updated
+    if not isinstance(kbp_obj, KBPASSWrapper):
+        try:
+            kbp_obj = KBPASSWrapper(kbp_obj)
+        except:
+            raise ConversionError(f"Failed to process file\n{kbp}\n\nError Output:\n{traceback.format_exc()}")
+    if hasattr(kbp_obj, "kbp_path"):
+        print(settings.kbputils_options)
+        try:
+            data = kbp_obj.ass_data(**settings.kbputils_options)
+        except:
+            raise ConversionError(f"Failed to process .kbp file\n{kbp}\n\nError Output:\n{traceback.format_exc()}")
+
+    # QDir is inconsistent. Needs to be static to check existence, and
+    # mkdir needs to be run from an instantiated instance in the parent
+    # directory, not worth the hassle
+    if not os.path.isdir(outdir := settings.resolved_output_dir(kbp)):
+        try:
+            os.mkdir(outdir)
+        except:
+            raise ConversionError(f"Failed to create output folder\n{outdir}\nassociated with .kbp file\n{kbp}\n\nError Output:\n{traceback.format_exc()}")
+
+    if not hasattr(kbp_obj, "kbp_path"): # kbp_obj is a KBPASSWrapper with a .ass file
+        if any(x in kbp for x in ":;,'=\""):
+            print("Already .ass file, but needs new filename for ffmpeg")
+            QFile(kbp).copy(assfile)
+        else:
+            print("Using existing .ass file")
+            assfile = kbp
+
+    # File was converted and .ass file needs to be written
+    if kbp.casefold().endswith(".kbp"):
+        f = QFile(assfile)
+        if f.exists() and not confirm_overwrite(assfile):
+            raise SkippedError(f"Skipped {kbp} per user request (.ass file exists)")
+        if not f.open(QIODevice.WriteOnly | QIODevice.Text):
+            raise ConversionError(f"Failed to write {assfile}")
+        out = QTextStream(f)
+        out << data
+        f.close()
+
+    if ass_only:
+        return (assfile, None)
+
+    # This is going to be a slight regression in error reporting for now,
+    # as kbputils doesn't have as much explicit error handling yet
+    try:
+        options = video_options(settings, audio, background, advanced)
+        if settings.proof:
+            job = encode_job(row, kbp, assfile, settings.vid_file(kbp), segments.without_segments(options, segments.concat_kinds(options)), settings.lossless, scratch_dir=settings["kbp2video/scratch_dir"], priority=settings["kbp2video/priority_index"], cancelled=cancelled)
+            proof.apply(job, settings.proof)
+        else:
+            job = encode_job(row, kbp, assfile, settings.vid_file(kbp), options, settings.lossless, fingerprint, settings["kbp2video/chunk_seconds"], settings["kbp2video/scratch_dir"], spooled, settings["kbp2video/priority_index"], cancelled)
+    except:
+        raise ConversionError(f"Skipped {kbp}:\nUnable to generate ffmpeg command\n{traceback.format_exc()}")
+    return (assfile, job)
+
+# Length in ms of a song's audio file, or 0 if it can't be read
+def audio_length(audio):
+    import ffmpeg
+    try:
+        return float(ffmpeg.probe(audio)['format']['duration']) * 1000
+    except Exception:
+        return 0
+
+# Estimated space a batch needs, as {folder: bytes}: every video in its output
+# folder, plus the biggest ones that can be rendering at once in the scratch
+# folder, if there is one, counting the song rendered without its intro/outro
+# or in chunks as well as the finished video. Rows in skip are left out, as
+# are songs without audio, since their length isn't known until the .kbp has
+# been converted
+def space_needed(rows, settings, skip=()):
+    needs = collections.Counter()
+    in_progress = []
+    width, height = settings.resolution
+    for row, (kbp_obj, audio, background, advanced) in enumerate(rows):
+        if row in skip or not (kbp := str(kbp_obj)) or not audio:
+            continue
+        options = video_options(settings, audio, background, advanced)
+        kinds = segments.concat_kinds(options)
+        length = audio_length(audio) + sum(options[f"{kind}_length"] for kind in kinds)
+        size = resources.estimate_output_size(length, settings.video_codec, width, height,
+                                              settings["video/quality"], settings.lossless,
+                                              settings.audio_codec, settings["video/audio_bitrate_kb"])
+        needs[settings.resolved_output_dir(kbp)] += size
+        in_progress.append(size * 2 if kinds or settings["kbp2video/chunk_seconds"] else size)
+    if scratch_dir := settings["kbp2video/scratch_dir"]:
+        needs[scratch_dir] += sum(sorted(in_progress, reverse=True)[:max(1, settings["kbp2video/concurrent_jobs"])])
+    return needs
+
+# Message describing storage.shortfalls for the user
+def space_message(shortfalls):
+    lines = [f"{folder}: about {storage.format_size(needed)} needed, {storage.format_size(free)} free" for folder, needed, free in shortfalls]
+    return "Not enough free space for this batch\n\n" + "\n".join(lines)
+
+# Prepare every entry in rows, a list of (kbp_obj, audio, background, advanced),
+# reporting through a ConverterSignals. Each EncodeJob is passed to add_job as
+# soon as it's ready, so encoding can start while later rows are still being
+# prepared. If ass_only is set, only the .ass files are written, and
+# ass_written(row, assfile) is called for each one converted from a .kbp.
+# Rows in skip are reported as done without doing anything, as are rows whose
+# output is already up to date, if the skip_up_to_date setting is on and this
+# isn't a proof render. If confirm_space is given, the free space the batch
+# needs is checked first, and if there isn't enough, nothing is prepared
+# unless confirm_space(message) returns True. spooled is set when the jobs
+# are written to a spool rather than run here (see encode_job). Returns False
+# if any row failed
+def prepare_jobs(signals, rows, settings, add_job=None, confirm_overwrite=lambda assfile: True, ass_only=False, ass_written=None, skip=(), confirm_space=None, spooled=False):
+    conversion_errors = False
+    if confirm_space and not ass_only and not settings.proof:
+        signals.status.emit("Checking free space")
+        if (shortfalls := storage.shortfalls(space_needed(rows, settings, skip))) and not confirm_space(message := space_message(shortfalls)):
+            signals.error.emit(message, True)
+            return False
+    for row, (kbp_obj, audio, background, advanced) in enumerate(rows):
+        if signals.cancelled:
+            break
+        kbp = str(kbp_obj)
+        if row in skip:
+            print(f"Skipping {kbp}, already done")
+            signals.skipped.emit(row, kbp)
+            signals.file_done.emit(row, True)
+            continue
+        print(f"Retrieved Advanced settings for {kbp}:")
+        print(advanced)
+        if not kbp:
+            signals.file_done.emit(row, False)
+            continue
+        fingerprint = None
+        if not ass_only and not settings.proof:
+            fingerprint = job_fingerprint(kbp, audio, background, advanced, settings)
+            if fingerprint and settings["kbp2video/skip_up_to_date"] and up_to_date(settings.vid_file(kbp), fingerprint):
+                print(f"Skipping {kbp}, output is up to date")
+                signals.status.emit(f"Skipping file {row+1} of {len(rows)} ({kbp}), output is up to date")
+                signals.skipped.emit(row, kbp)
+                signals.file_done.emit(row, True)
+                continue
+        signals.status.emit(f"Converting file {row+1} of {len(rows)} ({kbp})")
+        signals.progress.emit(row, len(rows), kbp, 0, 0)
+        try:
+            assfile, job = prepare_job(row, kbp_obj, audio, background, advanced, settings, confirm_overwrite, ass_only, fingerprint, spooled, lambda: signals.cancelled)
+        except ConversionError as e:
+            if not isinstance(e, SkippedError):
+                conversion_errors = True
+            signals.error.emit(str(e), True)
+            signals.file_done.emit(row, False)
+            continue
+        if ass_only:
+            if kbp.casefold().endswith(".kbp") and ass_written:
+                ass_written(row, assfile)
+            signals.file_done.emit(row, True)
+        else:
+            add_job(job)
+    return not conversion_errors
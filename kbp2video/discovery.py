@@ -0,0 +1,85 @@
+import json
+import os
+import re
+import shutil
+import subprocess
+from .fingerprint import file_identity
+
+# Finding ffmpeg and ffprobe means searching every folder on PATH, and getting
+# the version means running ffmpeg, both of which can be slow when PATH or the
+# home folder is on a network drive. The paths found are kept in QSettings
+# along with the size and modification time of each binary and the PATH they
+# were found on, and reused on later launches as long as none of those have
+# changed, which only takes a stat of each binary. The version is cached the
+# same way, and looked up off the GUI thread when it isn't known yet
+
+SETTINGS_KEY = "kbp2video/ffmpeg_tools"
+TOOLS = ("ffmpeg", "ffprobe")
+
+# How long to wait for ffmpeg -version, in seconds
+VERSION_TIMEOUT = 10
+
+# The cached entry in settings if it's still good for path (the PATH searched),
+# otherwise None. An entry is a dict of
+#   path       the PATH searched
+#   extra_dir  folder chosen by the user to search before it, or ""
+#   ffmpeg     file_identity of ffmpeg, including its full path
+#   ffprobe    file_identity of ffprobe
+#   version    ffmpeg's version, or "" if not known yet
+def cached_tools(settings, path):
+    try:
+        cached = json.loads(settings.value(SETTINGS_KEY, type=str, defaultValue=""))
+        if cached["path"] == path and all(file_identity(cached[tool][0]) == cached[tool] for tool in TOOLS):
+            return cached
+    except (ValueError, KeyError, TypeError, IndexError):
+        pass
+    return None
+
+# Search for ffmpeg and ffprobe in extra_dir (if given) and then path, and
+# cache what's found. Returns the entry, or None if either is missing
+def find_tools(settings, path, extra_dir=""):
+    search = os.pathsep.join([extra_dir, path]) if extra_dir else path
+    identities = {tool: file_identity(shutil.which(tool, path=search)) for tool in TOOLS}
+    if not all(identities.values()):
+        return None
+    entry = {"path": path, "extra_dir": extra_dir, **identities, "version": ""}
+    try:
+        if (cached := json.loads(settings.value(SETTINGS_KEY, type=str, defaultValue="")))["ffmpeg"] == entry["ffmpeg"]:
+            entry["version"] = cached["version"]
+    except (ValueError, KeyError, TypeError):
+        pass
+    settings.setValue(SETTINGS_KEY, json.dumps(entry))
+    return entry
+
+# Record the version of the cached ffmpeg, if it's the one at ffmpeg (a
+# file_identity)
+def remember_version(settings, ffmpeg, version):
+    try:
+        cached = json.loads(settings.value(SETTINGS_KEY, type=str, defaultValue=""))
+        if cached["ffmpeg"] == ffmpeg:
+            cached["version"] = version
+            settings.setValue(SETTINGS_KEY, json.dumps(cached))
+    except (ValueError, KeyError, TypeError):
+        pass
+
+# Version of the ffmpeg on PATH as (its file_identity, version), running it to
+# find out. Blocks. The version is "MISSING/UNKNOWN" if it can't be run
+def ffmpeg_version():
+    if not (identity := file_identity(shutil.which("ffmpeg"))):
+        return (None, "MISSING/UNKNOWN")
+    try:
+        output = subprocess.run([identity[0], "-version"], capture_output=True, text=True, timeout=VERSION_TIMEOUT).stdout
+    except (OSError, subprocess.SubprocessError):
+        return (identity, "MISSING/UNKNOWN")
+    match = re.match(r"\S+ version (\S+)", output)
+    return (identity, match[1] if match else "UNKNOWN")
+
+# Cached version of ffmpeg, or "" if it isn't known or ffmpeg has changed
+def cached_version(settings):
+    try:
+        cached = json.loads(settings.value(SETTINGS_KEY, type=str, defaultValue=""))
+        if file_identity(cached["ffmpeg"][0]) == cached["ffmpeg"]:
+            return cached["version"]
+    except (ValueError, KeyError, TypeError, IndexError):
+        pass
+    return ""
@@ -0,0 +1,460 @@
+from PySide6.QtCore import QObject, QProcess, QRunnable, QTimer, Signal, Slot
+import enum
+import os
+import shutil
+import threading
+from . import fingerprint, resources, storage
+
+# How long ffmpeg gets to exit after being asked to stop before it's killed
+STOP_GRACE_MS = 3000
+
+class ConverterSignals(QObject):
+    started = Signal()
+    finished = Signal()
+    progress = Signal(int, int, str, int, int)
+    # Row is done processing, successfully or not
+    file_done = Signal(int, bool)
+    # Row didn't need to be rendered, with the file name. Followed by file_done
+    skipped = Signal(int, str)
+    error = Signal(str, bool)
+    data = Signal(dict)
+    # Message for the status bar
+    status = Signal(str)
+    # EncodeJob ready to be run
+    job = Signal(object)
+    # All jobs have been prepared. False if any failed
+    prepared = Signal(bool)
+    # Pause (True) or resume (False) running encodes, from the progress window
+    paused = Signal(bool)
+
+class Converter(QRunnable):
+    def __init__(self, function, *args, **kwargs):
+        super().__init__()
+        self.signals = ConverterSignals()
+        self.function = function
+        self.signals.cancelled = False #TODO: Seems to work, but is this a good idea?
+        self.args = args
+        self.kwargs = kwargs
+
+    @Slot()
+    def run(self):
+        self.function(self.signals, *self.args, **self.kwargs)
+
+# Order in which prepared jobs are started. Values are the index in
+# Ui_MainWindow.scheduleBox
+class SchedulePolicy(enum.Enum):
+    # Same order as the table
+    TABLE_ORDER = 0
+    # Start the biggest jobs first so a long one doesn't run alone at the end
+    # of the batch, minimizing total time
+    LONGEST_FIRST = 1
+    # Finish as many files as possible early
+    SHORTEST_FIRST = 2
+
+    # Choose the next job to run from the ones that are ready. Jobs are
+    # prepared in table order, so this can only pick among those already done
+    def next_job(self, pending):
+        if self == SchedulePolicy.LONGEST_FIRST:
+            return max(pending, key=lambda job: job.work)
+        elif self == SchedulePolicy.SHORTEST_FIRST:
+            return min(pending, key=lambda job: job.work)
+        else:
+            return min(pending, key=lambda job: job.row)
+
+# OS priority to run ffmpeg at, so a batch can be left running while the
+# machine is used for something else. Values are the index in
+# Ui_MainWindow.priorityBox and resources.NICE_VALUES
+class Priority(enum.Enum):
+    NORMAL = 0
+    # Gives way to anything else that wants the CPU
+    LOW = 1
+    # Only uses CPU and disk time that nothing else wants
+    IDLE = 2
+
+# ffmpeg command for one row of the table, as prepared by
+# conversion.prepare_job and run by EncodeRunner
+class EncodeJob:
+    def __init__(self, row, kbp, ffmpeg_cmdinfo, cost, work, assfile=None, output=None, options=None, lossless=False, fingerprint=None):
+        self.row = row
+        self.kbp = kbp
+        self.assfile = assfile
+        self.output = output
+        # Where the finished video is written, which is moved to output once
+        # it's done if it's not the same (see storage)
+        self.render_to = output
+        # kbputils.VideoConverter arguments, as made by conversion.video_options
+        self.options = options
+        self.lossless = lossless
+        # fingerprint.render_fingerprint of the inputs, recorded next to the
+        # output once it has been rendered
+        self.fingerprint = fingerprint
+        self.args = ffmpeg_cmdinfo['args']
+        self.cwd = ffmpeg_cmdinfo['cwd']
+        self.length = ffmpeg_cmdinfo['length']
+        # (threads, memory) as estimated by resources.estimate_cost
+        self.cost = cost
+        # Relative encode time as estimated by resources.estimate_work
+        self.work = work
+        # Length in seconds of the chunks the job is split into, 0 for none
+        self.chunk_length = 0
+        # Further (args, cwd) commands to run in turn once ffmpeg succeeds,
+        # e.g. joining cached intro/outro segments
+        self.steps = []
+        # Intermediate files to remove once the job is over
+        self.temp_files = []
+        # Folders of intermediate files that are kept if the job fails or is
+        # cancelled, so running it again can pick up where it left off, and
+        # removed once it succeeds
+        self.resume_dirs = []
+        # Called when the job is about to start for the first time, to split
+        # it into parts (see chunks.split_job), or None
+        self.split = None
+        # Jobs rendering pieces of this one that need to succeed before it's
+        # run, and the job a part belongs to
+        self.parts = []
+        self.whole = None
+        # Jobs making cached files this one uses (e.g. an intro segment), which
+        # need to succeed before it's started. Ones making the same file are
+        # merged by the runner, so it's only made once
+        self.needs = []
+        # For a job in others' needs: what it makes, for errors, the jobs
+        # waiting on it, and once it has run, "" if it succeeded or why it failed
+        self.description = None
+        self.needed_by = []
+        self.result = None
+        # Rendered time in ms of each part by output, including any finished
+        # earlier, and the parts that have finished
+        self.part_time = {}
+        self.finished_parts = set()
+        # Whether the row has been reported as started
+        self.started = False
+        self.process = None
+        # File the running command writes to
+        self.writing = None
+        # stderr from ffmpeg once it has finished
+        self.log = ''
+
+    def remove_temp_files(self):
+        for path in self.temp_files:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.temp_files = []
+
+    def remove_resume_dirs(self):
+        for path in self.resume_dirs:
+            shutil.rmtree(path, ignore_errors=True)
+        self.resume_dirs = []
+
+# Runs ffmpeg jobs as they are added, keeping up to concurrency of them going
+# at once, as long as their estimated threads and memory fit in what the
+# machine has available. Ready jobs are started in the order chosen by policy,
+# after any cached files they need, which other jobs are waiting on.
+# Everything is driven by QProcess signals, so this needs to live in a thread
+# with an event loop (normally the GUI thread) and never blocks it.
+# A failing process is reported but does not stop the others. Cancelling
+# stops every process right away; finished is only emitted once they have all
+# exited and their partial output has been removed.
+class EncodeRunner(QObject):
+    # Same arguments as ConverterSignals.progress
+    progress = Signal(int, int, str, int, int)
+    # ffmpeg has been started for the row
+    started = Signal(int)
+    file_done = Signal(int, bool)
+    error = Signal(str, bool)
+    status = Signal(str)
+    # Emitted once all jobs are done. False if any failed or it was cancelled
+    finished = Signal(bool)
+    # A finished video has been moved from scratch to its output, from the
+    # thread that moved it. The error is empty if it succeeded
+    published = Signal(object, str)
+
+    def __init__(self, rows, concurrency, policy=SchedulePolicy.TABLE_ORDER, parent=None, priority=Priority.NORMAL):
+        super().__init__(parent)
+        self.rows = rows
+        self.concurrency = concurrency
+        self.policy = policy
+        self.priority = priority
+        self.budget = resources.ResourceBudget()
+        self.pending = []
+        self.active = []
+        # Jobs that have been told to stop and haven't exited yet
+        self.stopping = []
+        # Finished jobs whose video is being moved to the output folder
+        self.publishing = []
+        self.published.connect(self.job_published)
+        # Jobs making cached files (see EncodeJob.needs) by the file they make
+        self.needed = {}
+        self.input_done = False
+        self.success = True
+        self.done = False
+        self.cancelled = False
+        # Running encodes are suspended and no new ones are started
+        self.paused = False
+
+    @Slot(object)
+    def add_job(self, job):
+        if self.cancelled:
+            job.remove_temp_files()
+            return
+        for n, need in enumerate(job.needs):
+            if need.output in self.needed:
+                need = job.needs[n] = self.needed[need.output]
+            else:
+                self.needed[need.output] = need
+                self.pending.append(need)
+            need.needed_by.append(job)
+        if failed := next((need.result for need in job.needs if need.result), None):
+            self.job_failed(job, failed)
+            self.check_finished()
+            return
+        job.needs = [need for need in job.needs if need.result is None]
+        self.pending.append(job)
+        self.start_jobs()
+
+    # No more jobs will be added. success is False if some couldn't be prepared
+    @Slot(bool)
+    def finish_input(self, success=True):
+        self.input_done = True
+        self.success &= success
+        self.check_finished()
+
+    @Slot()
+    def cancel(self):
+        if self.done or self.cancelled:
+            return
+        self.cancelled = True
+        self.status.emit(f"Cancelling, stopping {count_rows(self.active)} file(s)…")
+        for job in self.pending:
+            job.remove_temp_files()
+        self.pending.clear()
+        for job in list(self.active):
+            self.stop_job(job)
+        self.check_finished()
+
+    # Ask the job's ffmpeg to quit, and kill it if it hasn't within
+    # STOP_GRACE_MS. What it was writing is removed once it has exited
+    def stop_job(self, job):
+        self.active.remove(job)
+        self.budget.release(job.cost)
+        self.stopping.append(job)
+        job.process.terminate()
+        if self.paused:
+            # Can't act on the request while suspended
+            resources.suspend_process(job.process.processId(), False)
+        QTimer.singleShot(STOP_GRACE_MS, job.process, job.process.kill)
+
+    # Suspend (True) or continue (False) every running encode. Nothing is
+    # lost, ffmpeg just carries on from where it was
+    @Slot(bool)
+    def set_paused(self, paused):
+        if paused == self.paused or self.done or self.cancelled:
+            return
+        self.paused = paused
+        for job in self.active:
+            resources.suspend_process(job.process.processId(), paused)
+        if paused:
+            self.status.emit(f"Paused {count_rows(self.active)} file(s)")
+        else:
+            self.status.emit(f"Encoding {count_rows(self.active)} file(s), {count_rows(self.pending, self.active)} waiting")
+            self.start_jobs()
+
+    def start_jobs(self):
+        started = False
+        while self.pending and not self.paused and len(self.active) < self.concurrency:
+            if not (ready := [job for job in self.pending if not job.needs]):
+                break
+            # Others are waiting on cached files, so they're made first
+            job = next((job for job in ready if job.needed_by), None) or self.policy.next_job(ready)
+            if job.split:
+                self.split_job(job)
+                continue
+            # Always allow one job, even if it's over budget by itself
+            if self.active and not self.budget.fits(job.cost):
+                break
+            self.pending.remove(job)
+            self.budget.acquire(job.cost)
+            self.active.append(job)
+            if not job.needed_by and not (whole := job.whole or job).started:
+                whole.started = True
+                self.progress.emit(whole.row, self.rows, whole.kbp, sum(whole.part_time.values()), whole.length)
+                self.started.emit(whole.row)
+            self.start_process(job, job.args, job.cwd)
+            started = True
+        if started:
+            self.status.emit(f"Encoding {count_rows(self.active)} file(s), {count_rows(self.pending, self.active)} waiting")
+        self.check_finished()
+
+    # Replace job in pending with its parts, if it's split into any
+    def split_job(self, job):
+        split, job.split = job.split, None
+        self.pending.remove(job)
+        try:
+            split()
+        except OSError as e:
+            self.job_failed(job, f"Unable to split into chunks: {e}")
+            return
+        self.pending.extend(job.parts or [job])
+
+    def start_process(self, job, args, cwd):
+        # Every command run here ends with its output file and -y
+        job.writing = args[-2]
+        args = resources.priority_command(args, self.priority.value)
+        job.process = q = QProcess(self, program=args[0], arguments=args[1:], workingDirectory=cwd)
+        q.setReadChannel(QProcess.StandardOutput)
+        q.started.connect(lambda job=job: self.process_started(job))
+        q.readyReadStandardOutput.connect(lambda job=job: self.read_progress(job))
+        q.finished.connect(lambda code, status, job=job: self.job_finished(job, code, status))
+        q.errorOccurred.connect(lambda err, job=job: self.job_error(job, err))
+        q.start()
+
+    def process_started(self, job):
+        pid = job.process.processId()
+        resources.set_process_priority(pid, self.priority.value)
+        # The next step of a job that finished just as everything was paused
+        if self.paused:
+            resources.suspend_process(pid)
+
+    def read_progress(self, job):
+        q = job.process
+        while q.canReadLine():
+            if (ffmpeg_out_line := q.readLine().toStdString()).startswith("out_time_us="):
+                try:
+                    out_time = int(ffmpeg_out_line.split("=")[1]) / 1000
+                except:
+                    pass # TODO: maybe switch to throbber if ffmpeg isn't outputting progress properly?
+                else:
+                    if whole := job.whole:
+                        whole.part_time[job.output] = out_time
+                        self.progress.emit(whole.row, self.rows, whole.kbp, sum(whole.part_time.values()), whole.length)
+                    elif not job.parts and not job.needed_by:
+                        # Joining parts is quick, so progress stays where
+                        # the parts left it
+                        self.progress.emit(job.row, self.rows, job.kbp, out_time, job.length)
+
+    def job_error(self, job, err):
+        # Any other error is followed by finished
+        if err == QProcess.FailedToStart and job in self.active:
+            self.remove_job(job)
+            self.job_failed(job, f"Unable to start ffmpeg: {job.process.errorString()}")
+            self.start_jobs()
+
+    def job_finished(self, job, code, status):
+        if job in self.stopping:
+            self.stopping.remove(job)
+            job.process.deleteLater()
+            job.remove_temp_files()
+            try:
+                os.remove(job.writing)
+                print(f"Removed partial output {job.writing}")
+            except OSError:
+                pass
+            self.check_finished()
+            return
+        if job not in self.active:
+            return
+        self.read_progress(job)
+        job.log += job.process.readAllStandardError().toStdString()
+        if status == QProcess.NormalExit and code == 0 and job.steps:
+            job.process.deleteLater()
+            self.start_process(job, *job.steps.pop(0))
+            return
+        self.remove_job(job)
+        job.remove_temp_files()
+        if status != QProcess.NormalExit or code != 0:
+            print(status)
+            print(code)
+            self.job_failed(job, f"Error Output:\n{job.log}")
+        elif whole := job.whole:
+            if job.fingerprint:
+                fingerprint.record(job.output, job.fingerprint)
+            whole.part_time[job.output] = job.length
+            whole.finished_parts.add(job)
+            if len(whole.finished_parts) == len(whole.parts):
+                self.pending.append(whole)
+        elif job.needed_by:
+            # Written under a temporary name, so a file that's there is whole
+            self.publish_job(job)
+        else:
+            self.progress.emit(job.row, self.rows, job.kbp, job.length, job.length)
+            if job.render_to != job.output:
+                self.publish_job(job)
+            else:
+                self.job_done(job)
+        self.start_jobs()
+
+    def job_done(self, job):
+        if job.fingerprint and job.output:
+            fingerprint.record(job.output, job.fingerprint)
+        job.remove_resume_dirs()
+        self.file_done.emit(job.row, True)
+
+    # Move the job's video from scratch to its output. This can mean copying
+    # it to another disk, so it's done on its own thread
+    def publish_job(self, job):
+        self.publishing.append(job)
+        def run():
+            try:
+                storage.publish(job.render_to, job.output)
+                self.published.emit(job, "")
+            except OSError as e:
+                self.published.emit(job, str(e))
+        threading.Thread(target=run, daemon=True).start()
+
+    @Slot(object, str)
+    def job_published(self, job, error):
+        self.publishing.remove(job)
+        if error:
+            self.job_failed(job, f"Unable to move the finished video\n{job.render_to}\nto\n{job.output}\n\n{error}")
+        elif job.needed_by:
+            job.result = ""
+            for other in job.needed_by:
+                other.needs.remove(job)
+        else:
+            self.job_done(job)
+        self.start_jobs()
+
+    # Report job, which has been removed from active, as failed. If it's part
+    # of another job, the rest of the parts are stopped and the whole job fails.
+    # If other jobs need what it makes, they fail instead
+    def job_failed(self, job, details):
+        if job.needed_by:
+            job.result = f"Unable to make {job.description}\n\n{details}"
+            for other in job.needed_by:
+                if other in self.pending:
+                    self.pending.remove(other)
+                    self.job_failed(other, job.result)
+            return
+        if whole := job.whole:
+            for part in whole.parts:
+                if part in self.pending:
+                    self.pending.remove(part)
+                elif part in self.active:
+                    self.stop_job(part)
+            job = whole
+        job.remove_temp_files()
+        self.success = False
+        self.error.emit(f"Failed to process file\n{job.kbp}\n\n{details}", True)
+        self.file_done.emit(job.row, False)
+
+    def remove_job(self, job):
+        self.active.remove(job)
+        self.budget.release(job.cost)
+        job.process.deleteLater()
+
+    def check_finished(self):
+        if self.done or self.stopping or self.publishing:
+            return
+        if self.cancelled:
+            self.done = True
+            self.status.emit("Conversion cancelled!")
+            self.finished.emit(False)
+        elif self.input_done and not self.pending and not self.active:
+            self.done = True
+            self.finished.emit(self.success)
+
+# Number of different rows jobs are for, counting parts of a job as one, and
+# leaving out rows that also have jobs in exclude
+def count_rows(jobs, exclude=()):
+    return len({job.row for job in jobs} - {job.row for job in exclude})
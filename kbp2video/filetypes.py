@@ -0,0 +1,72 @@
+import functools
+import os
+from PySide6.QtCore import QMimeDatabase
+from .utils import mimedb
+
+# Imported files are sorted by type on every import, and folders can hold
+# thousands of them, most of which have one of a handful of extensions. Those
+# are looked up in a table, and other extensions are looked up once each in
+# Qt's MIME database by name. Only files with an extension nothing knows about
+# have their contents read, and what was found is kept for as long as the
+# file's size and modification time stay the same, so importing the same
+# folder again doesn't read them again
+
+# Media types offered when picking files to import
+AUDIO_EXTENSIONS = "flac wav ogg opus mp3 aac".split()
+BACKGROUND_EXTENSIONS = "mp4 mkv avi webm mov mpg mpeg jpg jpeg png gif jfif jxl bmp tiff webp".split()
+
+RELEVANT_FILE_FILTER = "*." + " *.".join(["kbp", *AUDIO_EXTENSIONS, *BACKGROUND_EXTENSIONS])
+
+# {extension: type}. txt and lrc are lyrics that can be converted to .kbp
+EXTENSIONS = {
+    ".kbp": "kbp",
+    ".ass": "ass",
+    ".txt": "txt",
+    ".lrc": "lrc",
+    **{f".{x}": "audio" for x in AUDIO_EXTENSIONS},
+    **{f".{x}": "background" for x in BACKGROUND_EXTENSIONS},
+}
+
+# Returned by by_name when only the contents can tell
+UNKNOWN = "unknown"
+
+# 'audio' or 'background' for a QMimeType of either, otherwise None
+def media_type(mime):
+    kind = mime.name().split('/')[0]
+    if kind == 'audio':
+        return 'audio'
+    elif kind in ('image', 'video'):
+        return 'background'
+    else:
+        return None
+
+@functools.cache
+def extension_type(extension):
+    if extension in EXTENSIONS:
+        return EXTENSIONS[extension]
+    mime = mimedb().mimeTypeForFile(f"file{extension}", QMimeDatabase.MatchExtension)
+    return UNKNOWN if mime.isDefault() else media_type(mime)
+
+# Type of a file going by its name alone: one of the types in EXTENSIONS,
+# None if it's something else, or UNKNOWN
+def by_name(name):
+    return extension_type(os.path.splitext(name)[1].casefold())
+
+# {path: (size, modification time, type)} of the files whose contents were read
+_sniffed = {}
+
+# Type of a file going by its contents, 'audio', 'background' or None
+def by_content(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if (cached := _sniffed.get(path)) and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+        return cached[2]
+    result = media_type(mimedb().mimeTypeForFile(path, QMimeDatabase.MatchContent))
+    _sniffed[path] = (stat.st_size, stat.st_mtime_ns, result)
+    return result
+
+# Type of a file: one of the types in EXTENSIONS, or None
+def classify(path):
+    return by_content(path) if (result := by_name(path)) == UNKNOWN else result
@@ -0,0 +1,72 @@
+import enum
+import hashlib
+import json
+import os
+from . import __version__
+
+# Fingerprints of finished renders are stored in a hidden file next to each
+# output, so up-to-date checks work for anything that can see the output
+# (another machine running a spool worker, a later headless render, ...)
+SIDECAR_SUFFIX = ".kbp2video"
+
+# Enough to tell if a file has changed without reading it. None if the file
+# doesn't exist
+def file_identity(path):
+    try:
+        stat = os.stat(path)
+    except (OSError, ValueError, TypeError):
+        return None
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            h.update(chunk)
+    return h.hexdigest()
+
+def digest(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=lambda x: x.name if isinstance(x, enum.Enum) else str(x)).encode()).hexdigest()
+
+# Fingerprint of everything that goes into rendering a video. The project is
+# hashed by content, since it's what gets edited between runs, while media is
+# identified by path, size and modification time. options are the
+# conversion.video_options, which include the media paths and intro/outro
+# parameters. kbputils_options is None for .ass projects that are used as-is
+def render_fingerprint(project, kbputils_options, options):
+    import kbputils
+    return digest({
+        "versions": [__version__, kbputils.__version__],
+        "project": file_digest(project),
+        "kbputils_options": kbputils_options,
+        "options": options,
+        "media": {key: file_identity(value) for key, value in options.items()
+                  if key in ("audio_file", "background_media") or key.endswith("_media")},
+    })
+
+def sidecar_path(output):
+    directory, name = os.path.split(output)
+    return os.path.join(directory, f".{name}{SIDECAR_SUFFIX}")
+
+# Whether output was rendered with the given fingerprint and hasn't been
+# touched since
+def up_to_date(output, fingerprint):
+    try:
+        with open(sidecar_path(output), "r", encoding="utf-8") as f:
+            recorded = json.load(f)
+        return recorded["fingerprint"] == fingerprint and recorded["output"] == file_identity(output)[1:]
+    except (OSError, ValueError, KeyError, TypeError):
+        return False
+
+# Called once output has been rendered successfully
+def record(output, fingerprint):
+    if not (identity := file_identity(output)):
+        return
+    tmp = f"{sidecar_path(output)}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": fingerprint, "output": identity[1:]}, f)
+        os.replace(tmp, sidecar_path(output))
+    except OSError:
+        # Only costs a re-render next time
+        pass
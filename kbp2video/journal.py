@@ -0,0 +1,148 @@
+from PySide6.QtCore import QObject, QStandardPaths, Slot
+import datetime
+import hashlib
+import json
+import os
+from . import segments, storage
+from .fingerprint import file_identity
+
+# Per-job states recorded in the journal
+PENDING = "pending"
+ENCODING = "encoding"
+DONE = "done"
+FAILED = "failed"
+
+# Settings that only affect how a batch is run, not what it produces
+RUN_ONLY_SETTINGS = (
+    "kbp2video/concurrent_jobs",
+    "kbp2video/schedule_index",
+    "kbp2video/check_updates",
+    "kbp2video/update_check_hours",
+    "kbp2video/ignore_bg_files_drag_drop",
+    "kbp2video/skip_up_to_date",
+    "kbp2video/chunk_seconds",
+    "kbp2video/priority_index",
+    "kbp2video/scratch_dir",
+)
+
+def default_journal_path():
+    return os.path.join(QStandardPaths.writableLocation(QStandardPaths.AppDataLocation), "batch_journal.json")
+
+# Hash of everything that goes into rendering a row: the files it uses and
+# the settings that affect the output
+def input_fingerprint(kbp, audio, background, advanced, settings):
+    data = {
+        "kbp": file_identity(kbp) if kbp else None,
+        "audio": file_identity(audio) if audio else None,
+        # Either a file or a color
+        "background": file_identity(background) or background,
+        "advanced": {k: file_identity(v) or v if k.endswith("_media") else v for k, v in sorted(advanced.items())},
+        "settings": {k: v for k, v in sorted(settings.values.items()) if k not in RUN_ONLY_SETTINGS},
+    }
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+# Persistent record of a batch conversion, so it can be resumed after a crash,
+# the app being closed or the user cancelling. Every state change is written
+# to disk right away, replacing the file atomically so an interruption can't
+# leave it half-written. Lives in the GUI thread, so the file_done slot can be
+# connected to signals from the conversion thread
+class BatchJournal(QObject):
+    def __init__(self, path=None, parent=None):
+        super().__init__(parent)
+        self.path = path or default_journal_path()
+        self.data = None
+
+    # Read the journal from disk. Returns False if there is none or it can't
+    # be used
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.data = json.load(f)
+            self.data["rows"]
+            self.data["settings"]
+        except (OSError, ValueError, KeyError, TypeError):
+            self.data = None
+            return False
+        return True
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        self.data = None
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    # Begin a new batch. rows are as passed to conversion.prepare_jobs
+    def start(self, settings, rows):
+        self.data = {
+            "created": datetime.datetime.now().astimezone().isoformat(timespec="seconds"),
+            "settings": settings.values,
+            "rows": [{
+                "kbp": (kbp := str(kbp_obj)),
+                "audio": audio,
+                "background": background,
+                "advanced": advanced,
+                "output": os.path.abspath(settings.vid_file(kbp)) if kbp else None,
+                "fingerprint": input_fingerprint(kbp, audio, background, advanced, settings),
+                "state": PENDING,
+            } for kbp_obj, audio, background, advanced in rows],
+        }
+        self.save()
+
+    def rows(self):
+        return [(row["kbp"], row["audio"], row["background"], row["advanced"]) for row in self.data["rows"]]
+
+    def set_state(self, row, state):
+        if self.data and 0 <= row < len(self.data["rows"]):
+            self.data["rows"][row]["state"] = state
+            self.save()
+
+    @Slot(int)
+    def job_started(self, row):
+        self.set_state(row, ENCODING)
+
+    @Slot(int, bool)
+    def file_done(self, row, success):
+        self.set_state(row, DONE if success else FAILED)
+
+    # Rows that still need to be rendered
+    def unfinished(self):
+        if not self.data:
+            return []
+        return [n for n, row in enumerate(self.data["rows"]) if row["state"] != DONE]
+
+    # Get ready to run the batch again. Returns the rows that are already done
+    # and don't need to be run again: the output is there and none of the
+    # inputs have changed. Partial outputs of the others are deleted, and
+    # they're marked pending
+    def prepare_resume(self, settings):
+        finished = set()
+        for n, row in enumerate(self.data["rows"]):
+            if row["state"] == DONE and row["output"] and os.path.exists(row["output"]) and \
+                    row["fingerprint"] == input_fingerprint(row["kbp"], row["audio"], row["background"], row["advanced"], settings):
+                finished.add(n)
+                continue
+            if row["state"] in (ENCODING, FAILED) and row["output"]:
+                # Wherever encode_job had it rendered: in place or in the
+                # scratch folder, possibly as a part before intros/outros
+                partials = [row["output"]]
+                if scratch_dir := settings["kbp2video/scratch_dir"]:
+                    partials.append(storage.scratch_file(scratch_dir, row["output"]))
+                for partial in partials + [segments.part_file(os.path.abspath(path)) for path in partials]:
+                    try:
+                        os.remove(partial)
+                    except OSError:
+                        # Gets overwritten anyway
+                        pass
+            row["state"] = PENDING
+        self.save()
+        return finished
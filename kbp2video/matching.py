@@ -0,0 +1,250 @@
+import collections
+import heapq
+
+# Files are matched to each other by comparing their normalized names with
+# difflib. Comparing each name to every other one gets slow once a folder
+# with thousands of files is imported, so names are indexed to skip the ones
+# that can't score high enough, giving exactly the matches difflib would.
+#
+# difflib's ratio is 2 * (characters matched) / (total length), and the
+# characters it matches are always a common subsequence of the two names, so
+# a name can't score more than its longest common subsequence allows. Names
+# are grouped by length, and only those whose length and longest common
+# subsequence allow the score needed are compared. The subsequence is found
+# with bit operations, a character of the name at a time, which is far
+# quicker than difflib's own matching. When only the best few matches are
+# wanted, the names sharing the most trigrams (runs of three characters) are
+# scored first, and once enough good matches are found the score needed
+# rises to theirs, which rules most of the other names out by length alone
+
+PADDING = "\0\0"
+
+def trigrams(word):
+    padded = f"{PADDING}{word}{PADDING}"
+    return {padded[n:n+3] for n in range(len(padded) - 2)}
+
+class TrigramIndex:
+    def __init__(self, words=()):
+        self.words = set()
+        # {length: words of that length}
+        self.lengths = collections.defaultdict(set)
+        # {trigram: words containing it}
+        self.postings = collections.defaultdict(set)
+        for word in words:
+            self.add(word)
+
+    def add(self, word):
+        if word in self.words:
+            return
+        self.words.add(word)
+        self.lengths[len(word)].add(word)
+        for trigram in trigrams(word):
+            self.postings[trigram].add(word)
+
+    # Indexed words that could score at least cutoff against word
+    def candidates(self, word, cutoff):
+        # Bit n of positions[char] is set if word[n] is char
+        positions = collections.defaultdict(int)
+        for n, char in enumerate(word):
+            positions[char] |= 1 << n
+        everything = (1 << len(word)) - 1
+        result = []
+        for length, words in self.lengths.items():
+            total = len(word) + length
+            # Computed as difflib does, so a bound equal to a score compares equal
+            if total and 2.0 * min(len(word), length) / total < cutoff:
+                continue
+            for candidate in words:
+                # Zero bits of unmatched are the longest common subsequence
+                unmatched = everything
+                for char in candidate:
+                    if char in positions:
+                        matched = unmatched & positions[char]
+                        unmatched = (unmatched + matched) | (unmatched - matched)
+                common = len(word) - bin(unmatched & everything).count("1")
+                if not total or 2.0 * common / total >= cutoff:
+                    result.append(candidate)
+        return result
+
+    # Up to n indexed words sharing the most trigrams with word
+    def likely(self, word, n):
+        shared = collections.Counter()
+        for trigram in trigrams(word):
+            if trigram in self.postings:
+                shared.update(self.postings[trigram])
+        return [x for x, _ in shared.most_common(n)]
+
+    # {word: difflib ratio} of the indexed words scoring at least cutoff
+    def scores(self, word, cutoff=0.6):
+        import difflib
+        matcher = difflib.SequenceMatcher()
+        matcher.set_seq2(word)
+        result = {}
+        for candidate in self.candidates(word, cutoff):
+            matcher.set_seq1(candidate)
+            if (score := matcher.ratio()) >= cutoff:
+                result[candidate] = score
+        return result
+
+    # Same as difflib.get_close_matches(word, words, n, cutoff): up to n words
+    # scoring at least cutoff, best first
+    def close_matches(self, word, n=3, cutoff=0.6):
+        import difflib
+        matcher = difflib.SequenceMatcher()
+        matcher.set_seq2(word)
+        # The n best (score, word) so far, worst first
+        best = []
+        scored = set()
+        def score(candidate):
+            scored.add(candidate)
+            matcher.set_seq1(candidate)
+            if (ratio := matcher.ratio()) >= cutoff:
+                if len(best) < n:
+                    heapq.heappush(best, (ratio, candidate))
+                else:
+                    heapq.heappushpop(best, (ratio, candidate))
+        for candidate in self.likely(word, n):
+            score(candidate)
+        # Ties with the worst of the best can still take its place
+        needed = best[0][0] if len(best) == n else cutoff
+        for candidate in self.candidates(word, needed):
+            if candidate not in scored:
+                score(candidate)
+        return [x for _, x in sorted(best, reverse=True)]
+
+# When a batch of projects and media is imported, matching media to each
+# project on its own can give the same audio file to two projects, and needs
+# the user to pick whenever a project has more than one close match. Instead,
+# every project is scored against every file, and files are assigned so the
+# total score is as high as possible, with each file going to at most one
+# project (a maximum weight bipartite matching). Only projects where a
+# different choice would be nearly as good are left for the user to review
+
+# How much lower than the assignment's total score another one can be and
+# still be too close to call
+AMBIGUITY_MARGIN = 0.05
+
+# Assign files to projects. projects and files are {name: key}, where keys
+# are compared as in FileResultSet.search. Returns (chosen, review): chosen
+# is {project: file} for each project that was given a file, and review is
+# {project: candidate files, best first} for the projects that need a look.
+# When unique, no file is given to more than one project. Otherwise each
+# project gets its own best match, for files that can be shared, like a
+# background used by several songs
+def assign(projects, files, cutoff=0.6, margin=AMBIGUITY_MARGIN, unique=True):
+    index = TrigramIndex(files.values())
+    by_key = collections.defaultdict(list)
+    for file, key in sorted(files.items()):
+        by_key[key].append(file)
+    scores = {project: {file: score for match, score in index.scores(key, cutoff).items() for file in by_key[match]}
+              for project, key in projects.items()}
+    ranked = {project: sorted(candidates, key=lambda x: (-candidates[x], x))
+              for project, candidates in scores.items()}
+    if unique:
+        chosen = best_assignment(scores)
+        flagged = contested(scores, chosen, margin)
+    else:
+        chosen = {project: files[0] for project, files in ranked.items() if files}
+        flagged = {project for project, files in ranked.items()
+                   if len(files) > 1 and scores[project][files[1]] > scores[project][files[0]] - margin}
+    review = {project: ranked[project] for project in flagged}
+    return (chosen, review)
+
+# {project: file} with the highest total score, from scores ({project: {file:
+# score}}). Projects and files only compete with those they share candidates
+# with, so each group of those is solved on its own, keeping the matrices small
+def best_assignment(scores):
+    owners = collections.defaultdict(list)
+    for project, candidates in scores.items():
+        for file in candidates:
+            owners[file].append(project)
+    chosen = {}
+    seen = set()
+    for start in sorted(scores):
+        if start in seen or not scores[start]:
+            continue
+        group, files, pending = [], set(), [start]
+        seen.add(start)
+        while pending:
+            project = pending.pop()
+            group.append(project)
+            for file in scores[project]:
+                if file not in files:
+                    files.add(file)
+                    for other in owners[file]:
+                        if other not in seen:
+                            seen.add(other)
+                            pending.append(other)
+        group.sort()
+        files = sorted(files)
+        # Pairs that aren't candidates score 0, the same as no file at all
+        cost = [[-scores[project].get(file, 0) for file in files] + [0] * max(0, len(group) - len(files))
+                for project in group]
+        for project, column in zip(group, hungarian(cost)):
+            if column < len(files) and files[column] in scores[project]:
+                chosen[project] = files[column]
+    return chosen
+
+# Column for each row of the cost matrix (rows no longer than columns) that
+# minimizes the total cost, by the Hungarian algorithm
+def hungarian(cost):
+    n, m = len(cost), len(cost[0])
+    u, v = [0] * (n + 1), [0] * (m + 1)
+    # Row assigned to each column, 1-based with 0 for none
+    row = [0] * (m + 1)
+    way = [0] * (m + 1)
+    for i in range(1, n + 1):
+        row[0] = i
+        column = 0
+        minimum = [float("inf")] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[column] = True
+            current = row[column]
+            delta, next_column = float("inf"), 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    reduced = cost[current - 1][j - 1] - u[current] - v[j]
+                    if reduced < minimum[j]:
+                        minimum[j], way[j] = reduced, column
+                    if minimum[j] < delta:
+                        delta, next_column = minimum[j], j
+            for j in range(m + 1):
+                if used[j]:
+                    u[row[j]] += delta
+                    v[j] -= delta
+                else:
+                    minimum[j] -= delta
+            column = next_column
+            if not row[column]:
+                break
+        while column:
+            previous = way[column]
+            row[column] = row[previous]
+            column = previous
+    result = [0] * n
+    for j in range(1, m + 1):
+        if row[j]:
+            result[row[j] - 1] = j - 1
+    return result
+
+# Projects whose file could be swapped for another candidate (taking it from
+# the project it was given to, which gets the swapped file instead) while
+# losing less than margin from the total score. Both projects in a swap are
+# included, as are ties between files with the same key
+def contested(scores, chosen, margin):
+    owner = {file: project for project, file in chosen.items()}
+    result = set()
+    for project, candidates in scores.items():
+        current = chosen.get(project)
+        for file, score in candidates.items():
+            if file == current:
+                continue
+            change = score - candidates.get(current, 0)
+            if (other := owner.get(file)) is not None:
+                change += scores[other].get(current, 0) - scores[other][file]
+            if change > -margin:
+                result.add(project)
+                if other is not None:
+                    result.add(other)
+    return result
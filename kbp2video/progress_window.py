@@ -1,6 +1,6 @@
-from PySide6.QtCore import QObject, Qt, QCoreApplication, QTimer
+from PySide6.QtCore import QObject, Qt, QCoreApplication, QElapsedTimer, QTimer, Signal
 from PySide6.QtWidgets import QVBoxLayout, QLabel, QTextEdit, QDialogButtonBox, QDialog, QProgressBar
-from .utils import ClickLabel, mimedb, check2bool, bool2check
+from .utils import ClickLabel, check2bool, bool2check
 
 #class ProgressSignals(QObject):
 #    # File has reached current of max steps
@@ -11,6 +11,12 @@ from .utils import ClickLabel, mimedb, check2bool, bool2check
 #    finished = Signal()
 
 class ProgressWindow(QDialog):
+    # Pause (True) or resume (False) was clicked
+    paused = Signal(bool)
+
+    # Wait for this much progress before estimating time left, since the
+    # start of an encode isn't representative
+    MIN_ETA_FRACTION = 0.02
 
     # Convenience method for adding a Qt object as a property in self and
     # setting its Qt object name
@@ -20,10 +26,21 @@ class ProgressWindow(QDialog):
         obj.setObjectName(name)
         return obj
 
-    def __init__(self, file_count, parent=None):
+    def __init__(self, file_count, parent=None, can_pause=False):
         super().__init__(parent)
         self.file_count = file_count
+        self.can_pause = can_pause
+        # Time spent converting, not counting while paused
+        self.elapsed = QElapsedTimer()
+        self.elapsed.start()
+        self.paused_ms = 0
+        self.pause_started = None
         self.fatal_errors = 0
+        # Several files can be encoding at once, so progress is tracked per row
+        self.file_bars = {}
+        self.file_fraction = {}
+        self.failed = set()
+        self.skipped = 0
         self.setupUi()
 
     def setupUi(self):
@@ -31,14 +48,22 @@ class ProgressWindow(QDialog):
         self.bind("verticalLayout", QVBoxLayout(self))
         self.verticalLayout.addWidget(self.bind("overall_label", QLabel(self)))
         self.verticalLayout.addWidget(self.bind("overall", QProgressBar(self)))
+        self.verticalLayout.addWidget(self.bind("eta_label", QLabel(self)))
+        self.verticalLayout.addWidget(self.bind("skipped_label", QLabel(self, visible=False)))
         self.verticalLayout.addWidget(self.bind("file_label", QLabel(self)))
-        self.verticalLayout.addWidget(self.bind("file", QProgressBar(self)))
+        self.verticalLayout.addLayout(self.bind("files", QVBoxLayout()))
         self.verticalLayout.addWidget(self.bind("errors_label", QLabel(self)))
         self.verticalLayout.addWidget(self.bind("errors", QTextEdit(self, readOnly=True)))
         self.verticalLayout.addWidget(self.bind("buttonBox", QDialogButtonBox(self,
             standardButtons=QDialogButtonBox.Cancel, 
             orientation=Qt.Horizontal)))
 
+        self.pause_button = self.buttonBox.addButton("", QDialogButtonBox.ActionRole)
+        self.pause_button.setObjectName("pause_button")
+        self.pause_button.setCheckable(True)
+        self.pause_button.setVisible(self.can_pause)
+        self.pause_button.toggled.connect(self.toggle_pause)
+
         self.retranslateUi()
 
         self.buttonBox.rejected.connect(self.reject)
@@ -50,20 +75,78 @@ class ProgressWindow(QDialog):
         self.overall_label.setText(QCoreApplication.translate("ProgressWindow", "Overall progress"))
         self.file_label.setText(QCoreApplication.translate("ProgressWindow", "File progress"))
         self.errors_label.setText(QCoreApplication.translate("ProgressWindow", "Errors encountered:"))
+        self.pause_button.setText(QCoreApplication.translate("ProgressWindow", "&Resume" if self.pause_button.isChecked() else "&Pause"))
+        self.pause_button.setToolTip(QCoreApplication.translate("ProgressWindow", "Suspend the running encodes to free up the machine, and carry on later without losing any work"))
+
+    def toggle_pause(self, paused):
+        if paused:
+            self.pause_started = self.elapsed.elapsed()
+        elif self.pause_started is not None:
+            self.paused_ms += self.elapsed.elapsed() - self.pause_started
+            self.pause_started = None
+        self.retranslateUi()
+        self.update_eta()
+        self.paused.emit(paused)
+
+    # Milliseconds spent converting so far, not counting pauses
+    def active_ms(self):
+        now = self.elapsed.elapsed()
+        return now - self.paused_ms - (now - self.pause_started if self.pause_started is not None else 0)
 
     def process_progress(self, cur, rows, file, progress, total):
-        # Avoid double-counting ones that were removed during initial processing
-        cur = cur - self.fatal_errors + self.file_count - rows
-        count = self.file_count - self.fatal_errors
-        self.file_label.setText(f"Processing file {cur + 1} of {count}: {file}")
-        self.file.setMaximum(total)
-        self.file.setValue(progress)
-        if count == 0:
+        if cur not in self.file_bars:
+            label = QLabel(self)
+            bar = QProgressBar(self)
+            self.files.addWidget(label)
+            self.files.addWidget(bar)
+            self.file_bars[cur] = (label, bar)
+        label, bar = self.file_bars[cur]
+        label.setText(f"Processing file {cur + 1} of {rows}: {file}")
+        # A maximum of 0 shows a busy indicator until ffmpeg reports progress
+        bar.setMaximum(total)
+        bar.setValue(progress)
+        self.file_fraction[cur] = progress / total if total else 0
+        self.update_overall()
+
+    def process_skipped(self, cur, file):
+        self.skipped += 1
+        self.skipped_label.setText(QCoreApplication.translate("ProgressWindow", "%n file(s) skipped, already up to date", None, self.skipped))
+        self.skipped_label.show()
+
+    def process_file_done(self, cur, success):
+        for widget in self.file_bars.pop(cur, ()):
+            self.files.removeWidget(widget)
+            widget.deleteLater()
+        if success:
+            self.file_fraction[cur] = 1
+        else:
+            # Avoid counting ones that won't be completed
+            self.file_fraction.pop(cur, None)
+            self.failed.add(cur)
+        self.update_overall()
+
+    def update_overall(self):
+        count = self.file_count - len(self.failed)
+        if count <= 0:
             self.overall.setMaximum(100)
             self.overall.setValue(100)
-        elif total != 0:
+        else:
             self.overall.setMaximum(count * 100)
-            self.overall.setValue(cur * 100 + int(progress * 100 / total))
+            self.overall.setValue(int(sum(self.file_fraction.values()) * 100))
+        self.update_eta()
+
+    def update_eta(self):
+        if self.pause_started is not None:
+            self.eta_label.setText(QCoreApplication.translate("ProgressWindow", "Paused"))
+            return
+        done = self.overall.value() / self.overall.maximum() if self.overall.maximum() else 0
+        if done < self.MIN_ETA_FRACTION or done >= 1:
+            self.eta_label.setText("")
+            return
+        minutes, seconds = divmod(round(self.active_ms() / 1000 * (1 - done) / done), 60)
+        hours, minutes = divmod(minutes, 60)
+        left = f"{hours}:{minutes:02}:{seconds:02}" if hours else f"{minutes}:{seconds:02}"
+        self.eta_label.setText(QCoreApplication.translate("ProgressWindow", "About %1 left").replace("%1", left))
 
     def process_error(self, message, fatal):
         if fatal:
@@ -71,6 +154,8 @@ class ProgressWindow(QDialog):
         self.errors.append(message)
     
     def process_finished(self):
+        self.eta_label.setText("")
+        self.pause_button.hide()
         self.buttonBox.setStandardButtons(QDialogButtonBox.Ok)
         if self.fatal_errors:
             self.file_label.setText("Complete with errors! Please review below.")
@@ -80,9 +165,13 @@ class ProgressWindow(QDialog):
             self.file_label.setText("Complete! Closing window in 5 seconds")
             timer.start(5000)
         
-    def showProgressWindow(file_count, sig_object, parent=None):
-        p = ProgressWindow(file_count, parent)
+    # can_pause shows the Pause button, which emits sig_object.paused
+    def showProgressWindow(file_count, sig_object, parent=None, can_pause=False):
+        p = ProgressWindow(file_count, parent, can_pause)
+        p.paused.connect(sig_object.paused)
         sig_object.progress.connect(p.process_progress)
+        sig_object.file_done.connect(p.process_file_done)
+        sig_object.skipped.connect(p.process_skipped)
         sig_object.error.connect(p.process_error)
         sig_object.finished.connect(p.process_finished)
         return p.exec()
@@ -0,0 +1,78 @@
+import os
+
+# A proof render is a quick look at part of a song, e.g. to check a timing
+# fix, without rendering all of it. It runs the same ffmpeg command as the
+# real render, cut down to a time window with output seeking, so what's shown
+# matches the final video: everything before the window is still decoded and
+# filtered, but only the window is encoded. It can also be scaled down at the
+# very end of the filter graph and encoded with the codec's fastest preset.
+# The result is written next to the real output with the window in its name,
+# and isn't recorded as up to date or in the batch journal. Concatenated
+# intros/outros are left out, since the window is in song time
+
+# Seconds of song shown before and after a lyric page
+PAGE_MARGIN = 1
+
+# Output options to have each video codec encode as fast as it can
+FAST_OPTIONS = {
+    "h264": ("-preset", "ultrafast"),
+    "libx265": ("-preset", "ultrafast"),
+    "libsvtav1": ("-preset", "12"),
+    "libvpx-vp9": ("-deadline", "realtime", "-cpu-used", "8"),
+}
+
+# Time window (ms) of a proof render and how to encode it. scale is the
+# fraction of the normal resolution to render at
+class ProofWindow:
+    def __init__(self, start, end, scale=1, fast=False):
+        self.start = start
+        self.end = end
+        self.scale = scale
+        self.fast = fast
+
+    def __str__(self):
+        return f"{format_time(self.start)}-{format_time(self.end)}"
+
+# Time in ms for file names, like 1m15.5s
+def format_time(ms):
+    return f"{ms // 60000}m{ms % 60000 / 1000:g}s"
+
+# Where to write the proof render of a video that would go to output
+def proof_file(output, window):
+    stem, extension = os.path.splitext(output)
+    return f"{stem} (proof {window}){extension}"
+
+# (start ms, end ms, first line) of each page of a kbputils.KBPFile, with
+# PAGE_MARGIN around it. offset is as passed to kbputils.AssConverter, where
+# None means the KBS setting
+def page_windows(kbp, offset=None):
+    if offset is None:
+        import kbputils
+        offset = kbputils.kbs.offset * 10
+    result = []
+    for page in kbp.pages:
+        if not page.lines:
+            continue
+        start = min(line.start for line in page.lines) * 10 + offset - PAGE_MARGIN * 1000
+        end = max(line.end for line in page.lines) * 10 + offset + PAGE_MARGIN * 1000
+        text = "".join(x.syllable for x in page.lines[0].syllables).strip()
+        result.append((max(0, start), end, text))
+    return result
+
+# Cut an EncodeJob made by conversion.encode_job (without segments or chunks)
+# down to window
+def apply(job, window):
+    args = job.args
+    label = args[args.index("-map") + 1]
+    if window.scale != 1 and label.startswith("[") and "-filter_complex" in args:
+        n = args.index("-filter_complex") + 1
+        args[n] += f";{label}scale=trunc(iw*{window.scale}/2)*2:trunc(ih*{window.scale}/2)*2[proof]"
+        args[args.index(label)] = "[proof]"
+    end = args.index(job.render_to)
+    extra = ["-ss", str(window.start / 1000), "-t", str((window.end - window.start) / 1000)]
+    if window.fast:
+        extra += FAST_OPTIONS.get(job.options["video_codec"], ())
+    args[end:end] = extra
+    length = max(0, min(window.end, job.length) - window.start)
+    job.work *= length / job.length * window.scale ** 2 if job.length else 0
+    job.length = length
@@ -0,0 +1,108 @@
+from PySide6.QtCore import Qt, QCoreApplication, QTime
+from PySide6.QtWidgets import QCheckBox, QComboBox, QDialog, QDialogButtonBox, QGridLayout, QTimeEdit, QVBoxLayout
+from .proof import ProofWindow
+from .utils import ClickLabel, check2bool, bool2check
+
+# Asks for the time window and encode options of a proof render. pages are
+# proof.page_windows for the selected song if there's just one .kbp, so a
+# lyric page can be picked instead of typing the times. The choices are kept
+# in settings (a QSettings) for next time
+class ProofDialog(QDialog):
+
+    # Convenience method for adding a Qt object as a property in self and
+    # setting its Qt object name
+    def bind(self, name, obj):
+        setattr(self, name, obj)
+        obj.setObjectName(name)
+        return obj
+
+    def __init__(self, settings, pages=(), parent=None):
+        super().__init__(parent)
+        self.settings = settings
+        self.pages = pages
+        self.setupUi()
+        self.loadSettings()
+
+    def loadSettings(self):
+        self.start.setTime(QTime.fromMSecsSinceStartOfDay(self.settings.value("proof/start_ms", type=int, defaultValue=0)))
+        self.end.setTime(QTime.fromMSecsSinceStartOfDay(self.settings.value("proof/end_ms", type=int, defaultValue=30000)))
+        self.halfResolution.setCheckState(bool2check(self.settings.value("proof/half_resolution", type=bool, defaultValue=True)))
+        self.fast.setCheckState(bool2check(self.settings.value("proof/fast", type=bool, defaultValue=True)))
+
+    def saveSettings(self):
+        self.settings.setValue("proof/start_ms", self.start.time().msecsSinceStartOfDay())
+        self.settings.setValue("proof/end_ms", self.end.time().msecsSinceStartOfDay())
+        self.settings.setValue("proof/half_resolution", check2bool(self.halfResolution))
+        self.settings.setValue("proof/fast", check2bool(self.fast))
+
+    def setupUi(self):
+        self.setObjectName("ProofDialog")
+        self.bind("verticalLayout", QVBoxLayout(self))
+        self.verticalLayout.addLayout(self.bind("gridLayout", QGridLayout()))
+        self.verticalLayout.addWidget(self.bind("buttonBox", QDialogButtonBox(self,
+            standardButtons=QDialogButtonBox.Cancel|QDialogButtonBox.Ok,
+            orientation=Qt.Horizontal)))
+
+        gridRow = 0
+        self.gridLayout.addWidget(self.bind("pageBox", QComboBox(enabled=bool(self.pages))), gridRow, 1)
+        self.gridLayout.addWidget(self.bind("pageLabel", ClickLabel(buddy=self.pageBox)), gridRow, 0)
+        self.pageBox.addItem("")
+        for start, end, text in self.pages:
+            self.pageBox.addItem(f"{QTime.fromMSecsSinceStartOfDay(start).toString('mm:ss')} {text}")
+        self.pageBox.currentIndexChanged.connect(self.page_selected)
+
+        gridRow += 1
+        self.gridLayout.addWidget(self.bind("start", QTimeEdit(displayFormat="mm:ss.zzz")), gridRow, 1)
+        self.gridLayout.addWidget(self.bind("startLabel", ClickLabel(buddy=self.start)), gridRow, 0)
+
+        gridRow += 1
+        self.gridLayout.addWidget(self.bind("end", QTimeEdit(displayFormat="mm:ss.zzz")), gridRow, 1)
+        self.gridLayout.addWidget(self.bind("endLabel", ClickLabel(buddy=self.end)), gridRow, 0)
+
+        gridRow += 1
+        self.gridLayout.addWidget(self.bind("halfResolution", QCheckBox()), gridRow, 0, alignment=Qt.AlignRight)
+        self.gridLayout.addWidget(self.bind("halfResolutionLabel", ClickLabel(buddy=self.halfResolution, buddyMethod=QCheckBox.toggle)), gridRow, 1)
+
+        gridRow += 1
+        self.gridLayout.addWidget(self.bind("fast", QCheckBox()), gridRow, 0, alignment=Qt.AlignRight)
+        self.gridLayout.addWidget(self.bind("fastLabel", ClickLabel(buddy=self.fast, buddyMethod=QCheckBox.toggle)), gridRow, 1)
+
+        self.retranslateUi()
+
+        self.buttonBox.accepted.connect(self.accept)
+        self.buttonBox.rejected.connect(self.reject)
+
+    def page_selected(self, index):
+        if index > 0:
+            start, end, _ = self.pages[index - 1]
+            self.start.setTime(QTime.fromMSecsSinceStartOfDay(start))
+            self.end.setTime(QTime.fromMSecsSinceStartOfDay(end))
+
+    def window(self):
+        return ProofWindow(
+                self.start.time().msecsSinceStartOfDay(),
+                self.end.time().msecsSinceStartOfDay(),
+                0.5 if check2bool(self.halfResolution) else 1,
+                check2bool(self.fast))
+
+    def accept(self):
+        if self.end.time() <= self.start.time():
+            self.end.setFocus()
+            return
+        self.saveSettings()
+        super().accept()
+
+    def retranslateUi(self):
+        self.setWindowTitle(QCoreApplication.translate("ProofDialog", "Proof Render", None))
+        self.pageLabel.setText(QCoreApplication.translate("ProofDialog", "Lyric &page", None))
+        self.pageBox.setItemText(0, QCoreApplication.translate("ProofDialog", "Custom", None))
+        self.pageBox.setToolTip(QCoreApplication.translate("ProofDialog", "Fill in the times around one page of lyrics.\nOnly available when a single .kbp file is selected.", None))
+        self.startLabel.setText(QCoreApplication.translate("ProofDialog", "&Start", None))
+        self.endLabel.setText(QCoreApplication.translate("ProofDialog", "&End", None))
+        self.halfResolutionLabel.setText(QCoreApplication.translate("ProofDialog", "&Half resolution", None))
+        self.fastLabel.setText(QCoreApplication.translate("ProofDialog", "&Fast encode (lower quality)", None))
+
+    # ProofWindow chosen by the user, or None if cancelled
+    def showProofDialog(settings, pages=(), parent=None):
+        dialog = ProofDialog(settings, pages, parent)
+        return dialog.window() if dialog.exec() else None
@@ -0,0 +1,368 @@
+import json
+import os
+import shutil
+import sys
+import traceback
+from PySide6.QtCore import QObject, QCoreApplication, QCommandLineOption, QCommandLineParser, QSettings, QThreadPool, QTimer, Slot
+import kbputils
+from . import conversion
+from . import filetypes
+from . import spool
+from .conversion import ConversionSettings, SettingsError
+from .encoder import Converter, EncodeRunner, Priority, SchedulePolicy
+from ._gui import FileResultSet
+from .utils import set_application_names
+
+SCHEDULE_NAMES = {
+    "table": SchedulePolicy.TABLE_ORDER,
+    "longest": SchedulePolicy.LONGEST_FIRST,
+    "shortest": SchedulePolicy.SHORTEST_FIRST,
+}
+
+PRIORITY_NAMES = {
+    "normal": Priority.NORMAL,
+    "low": Priority.LOW,
+    "idle": Priority.IDLE,
+}
+
+# Same categories as DropLabel.identifyFile, minus the lyric imports that need
+# to create new .kbp files
+def identify_file(path):
+    filetype = filetypes.classify(path)
+    return None if filetype in ('txt', 'lrc') else filetype
+
+# Sort the given files and folders (recursively) into a FileResultSet,
+# skipping the output folder so earlier results aren't picked up as inputs
+def collect_files(paths, settings):
+    result = FileResultSet()
+    for path in paths:
+        path = os.path.abspath(path)
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                output_dir = os.path.normpath(os.path.join(root, settings["kbp2video/output_dir"]))
+                dirs[:] = sorted(d for d in dirs if os.path.normpath(os.path.join(root, d)) != output_dir)
+                for f in sorted(files):
+                    if filetype := identify_file(os.path.join(root, f)):
+                        result.add(filetype, os.path.join(root, f))
+        elif filetype := identify_file(path):
+            result.add(filetype, path)
+    return result
+
+# Rows for conversion.prepare_jobs, matching audio and backgrounds to each
+# .kbp/.ass the same way DropLabel.importFiles does, except that matches too
+# close to call are left as they were assigned instead of asking
+def collect_rows(result, settings):
+    rows = []
+    kbp_ass_data = result.merged_kbp_ass_data()
+    projects = {sorted(kbp_ass_data[key])[0]: key for key in sorted(kbp_ass_data)}
+    assigned = {}
+    for filetype in ('audio', 'background'):
+        if filetype == 'background' and settings["kbp2video/ignore_bg_files_drag_drop"]:
+            continue
+        assigned[filetype], review = result.assign(filetype, projects)
+        for kbp in sorted(review):
+            print(f"Several close {filetype} matches for {kbp}, using {assigned[filetype].get(kbp) or 'none'}")
+    for kbp in projects:
+        matches = {filetype: chosen[kbp] for filetype, chosen in assigned.items() if kbp in chosen}
+        # Fall back to the audio file and background color set in the project
+        if kbp.casefold().endswith(".kbp") and len(matches) < 2:
+            try:
+                kbp_obj = kbputils.KBPFile(kbp)
+            except:
+                # Reported when the row is prepared
+                pass
+            else:
+                if 'audio' not in matches and (audio := kbp_obj.trackinfo["Audio"]):
+                    matches['audio'] = os.path.join(os.path.dirname(kbp), audio)
+                if 'background' not in matches:
+                    matches['background'] = f"color: #{kbp_obj.colors.as_rgb24()[0]}"
+        rows.append((kbp, matches.get('audio', ''), matches.get('background', ''), {}))
+    return rows
+
+# Prints one JSON object per line for each conversion event. kbputils and
+# ffmpeg-python print their own messages, so those are sent to stderr to keep
+# stdout machine-readable. Being a QObject in the main thread means events
+# from the conversion thread are printed in order
+class EventPrinter(QObject):
+    def __init__(self, out):
+        super().__init__()
+        self.out = out
+        self.files = {}
+        self.percent = {}
+        self.failed = []
+        self.skipped = []
+        # Rows reported done, successful or not
+        self.reported = set()
+        self.closed = False
+
+    def emit(self, event, **kwargs):
+        if self.closed:
+            return
+        print(json.dumps({"event": event, **kwargs}), file=self.out, flush=True)
+
+    @Slot(int, int, str, int, int)
+    def progress(self, row, total, file, time, length):
+        self.files[row] = file
+        percent = int(time * 100 / length) if length else 0
+        if self.percent.get(row) != percent:
+            self.percent[row] = percent
+            self.emit("progress", row=row, file=file, percent=percent)
+
+    @Slot(int, str)
+    def skipped_file(self, row, file):
+        self.files[row] = file
+        self.skipped.append(file)
+        self.emit("skipped", row=row, file=file)
+
+    @Slot(int, bool)
+    def file_done(self, row, success):
+        file = self.files.get(row, "")
+        self.reported.add(row)
+        if not success:
+            self.failed.append(file)
+        self.emit("done", row=row, file=file, success=success)
+
+    @Slot(str, bool)
+    def error(self, message, fatal):
+        self.emit("error", message=message)
+
+    # Last event. Anything still queued after this is dropped
+    def finish(self, **kwargs):
+        self.emit("finished", **kwargs)
+        self.closed = True
+
+    def connect(self, source):
+        if hasattr(source, "skipped"):
+            source.skipped.connect(self.skipped_file)
+        source.progress.connect(self.progress)
+        source.file_done.connect(self.file_done)
+        source.error.connect(self.error)
+
+# check_space is False to render without checking for free space
+def render_runner(signals, rows, settings, check_space=True):
+    signals.started.emit()
+    success = False
+    try:
+        success = conversion.prepare_jobs(signals, rows, settings, signals.job.emit, confirm_space=(lambda message: False) if check_space else None)
+    except:
+        signals.error.emit(f"Failed to prepare files for conversion\n\nError Output:\n{traceback.format_exc()}", True)
+    finally:
+        signals.prepared.emit(success)
+
+def submit_runner(signals, rows, settings, spool_dir):
+    signals.started.emit()
+    success, submitted = False, []
+    try:
+        success, submitted = spool.submit_jobs(signals, rows, settings, spool_dir)
+    except:
+        signals.error.emit(f"Failed to prepare files for conversion\n\nError Output:\n{traceback.format_exc()}", True)
+    finally:
+        signals.data.emit({"success": success, "jobs": submitted})
+
+def fail(message):
+    print(f"kbp2video: {message}", file=sys.stderr)
+    return 2
+
+def check_ffmpeg(ffmpeg_path):
+    if ffmpeg_path:
+        os.environ['PATH'] = os.pathsep.join([ffmpeg_path, os.environ['PATH']])
+    for tool in ("ffmpeg", "ffprobe"):
+        if not shutil.which(tool):
+            return f"{tool} not found, please install ffmpeg or add it to PATH"
+    return None
+
+def add_schedule_options(parser):
+    jobs_option = QCommandLineOption(["j", "jobs"], "Number of simultaneous encodes.", "count")
+    order_option = QCommandLineOption(["order"], f"Encode order: {', '.join(SCHEDULE_NAMES)}.", "order")
+    priority_option = QCommandLineOption(["priority"], f"Encoder priority: {', '.join(PRIORITY_NAMES)}.", "priority")
+    parser.addOption(jobs_option)
+    parser.addOption(order_option)
+    parser.addOption(priority_option)
+    return (jobs_option, order_option, priority_option)
+
+# Apply --jobs, --order and --priority to settings. Returns an error message
+# if invalid
+def apply_schedule_options(parser, settings, jobs_option, order_option, priority_option):
+    if parser.isSet(jobs_option):
+        try:
+            settings.values["kbp2video/concurrent_jobs"] = int(parser.value(jobs_option))
+        except ValueError:
+            return f"invalid job count {parser.value(jobs_option)}"
+    if parser.isSet(order_option):
+        if (order := parser.value(order_option)) not in SCHEDULE_NAMES:
+            return f"invalid encode order {order}, must be one of {', '.join(SCHEDULE_NAMES)}"
+        settings.values["kbp2video/schedule_index"] = SCHEDULE_NAMES[order].value
+    if parser.isSet(priority_option):
+        if (priority := parser.value(priority_option)) not in PRIORITY_NAMES:
+            return f"invalid priority {priority}, must be one of {', '.join(PRIORITY_NAMES)}"
+        settings.values["kbp2video/priority_index"] = PRIORITY_NAMES[priority].value
+    try:
+        SchedulePolicy(settings["kbp2video/schedule_index"])
+    except ValueError:
+        return "invalid encode order in settings"
+    try:
+        Priority(settings["kbp2video/priority_index"])
+    except ValueError:
+        return "invalid priority in settings"
+    return None
+
+# Entry point for `kbp2video render`. Returns the exit code: 0 if everything
+# was rendered, 1 if any file failed and 2 if nothing could be attempted
+def render_main(argv, ffmpeg_path=None):
+    set_application_names()
+    app = QCoreApplication(argv)
+    parser = QCommandLineParser()
+    parser.setApplicationDescription("Render videos from karaoke projects without showing the GUI. Folders are searched recursively, and audio and background files are matched to each .kbp/.ass file by name. Progress is printed to stdout as one JSON object per line.")
+    parser.addPositionalArgument("render", "Run in render mode", "render")
+    parser.addPositionalArgument("files", "Files or folders to render", "files...")
+    settings_option = QCommandLineOption(["s", "settings"], "Settings file saved from the GUI. Defaults to the GUI's current settings.", "file")
+    output_option = QCommandLineOption(["o", "output"], "Folder to write .ass files and videos to. Defaults to the output folder from the settings.", "folder")
+    spool_option = QCommandLineOption(["spool"], "Instead of rendering, submit the jobs to a spool directory to be rendered by kbp2video worker processes.", "folder")
+    force_option = QCommandLineOption(["f", "force"], "Render every file, even if its video is up to date with its inputs and settings.")
+    space_option = QCommandLineOption(["ignore-free-space"], "Render even if the videos are estimated not to fit in the free disk space.")
+    for option in (settings_option, output_option, spool_option, force_option, space_option):
+        parser.addOption(option)
+    schedule_options = add_schedule_options(parser)
+    parser.addHelpOption()
+    parser.addVersionOption()
+    parser.process(app)
+
+    if message := check_ffmpeg(ffmpeg_path):
+        return fail(message)
+
+    if not (paths := parser.positionalArguments()[1:]):
+        return fail("no files or folders given")
+
+    if parser.isSet(settings_option):
+        if not os.path.isfile(file := parser.value(settings_option)):
+            return fail(f"settings file {file} not found")
+        qsettings = QSettings(file, QSettings.IniFormat)
+        if qsettings.status() != QSettings.NoError:
+            return fail(f"unable to read settings file {file}")
+    else:
+        qsettings = QSettings()
+    settings = ConversionSettings.from_qsettings(qsettings)
+    if parser.isSet(output_option):
+        settings.values["kbp2video/relative_path"] = False
+        settings.values["kbp2video/output_dir"] = os.path.abspath(parser.value(output_option))
+    if parser.isSet(force_option):
+        settings.values["kbp2video/skip_up_to_date"] = False
+    if message := apply_schedule_options(parser, settings, *schedule_options):
+        return fail(message)
+    try:
+        settings.validate()
+    except SettingsError as e:
+        return fail(e.message.replace("\n", ": ", 1))
+    if parser.isSet(spool_option):
+        try:
+            spool.init_spool(spool_dir := os.path.abspath(parser.value(spool_option)))
+        except spool.SpoolError as e:
+            return fail(str(e))
+
+    out = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        if not (rows := collect_rows(collect_files(paths, settings), settings)):
+            return fail("no .kbp or .ass files found")
+
+        printer = EventPrinter(out)
+        if parser.isSet(spool_option):
+            converter = Converter(submit_runner, rows, settings, spool_dir)
+            printer.connect(converter.signals)
+            def submitted(result):
+                printer.finish(success=result["success"] and not printer.failed, failed=printer.failed, skipped=printer.skipped, jobs=result["jobs"])
+                app.exit(0 if result["success"] and not printer.failed else 1)
+            converter.signals.data.connect(submitted)
+        else:
+            converter = Converter(render_runner, rows, settings, not parser.isSet(space_option))
+            runner = EncodeRunner(
+                    len(rows),
+                    max(1, settings["kbp2video/concurrent_jobs"]),
+                    SchedulePolicy(settings["kbp2video/schedule_index"]),
+                    priority=Priority(settings["kbp2video/priority_index"]))
+            converter.signals.job.connect(runner.add_job)
+            converter.signals.prepared.connect(runner.finish_input)
+            printer.connect(converter.signals)
+            printer.connect(runner)
+            def finished(success):
+                unfinished = [str(row[0]) for n, row in enumerate(rows) if n not in printer.reported]
+                printer.finish(success=success and not printer.failed, failed=printer.failed, skipped=printer.skipped, unfinished=unfinished)
+                app.exit(0 if success and not printer.failed else 1)
+            runner.finished.connect(finished)
+            def cancel():
+                converter.signals.cancelled = True
+                runner.cancel()
+            spool.install_stop_handler(cancel)
+            # Lets the handler run, as in worker_main
+            heartbeat = QTimer(interval=500, timeout=lambda: None)
+            heartbeat.start()
+        QThreadPool.globalInstance().start(converter)
+        return app.exec()
+    finally:
+        sys.stdout = out
+
+# Entry point for `kbp2video worker`. Runs jobs from a spool directory until
+# stopped with SIGINT/SIGTERM, or until no jobs are left if --exit-when-idle
+# is given. Returns 1 if any job failed
+def worker_main(argv, ffmpeg_path=None):
+    set_application_names()
+    app = QCoreApplication(argv)
+    parser = QCommandLineParser()
+    parser.setApplicationDescription("Render jobs submitted to a spool directory with kbp2video render --spool. Any number of workers can share a spool directory. Progress is printed to stdout as one JSON object per line.")
+    parser.addPositionalArgument("worker", "Run as a spool worker", "worker")
+    parser.addPositionalArgument("spool", "Spool directory", "spool")
+    poll_option = QCommandLineOption(["poll"], "Seconds between checks for new jobs (default 5).", "seconds", "5")
+    idle_option = QCommandLineOption(["exit-when-idle"], "Exit once no jobs are pending or running on this worker.")
+    parser.addOption(poll_option)
+    parser.addOption(idle_option)
+    schedule_options = add_schedule_options(parser)
+    parser.addHelpOption()
+    parser.addVersionOption()
+    parser.process(app)
+
+    if message := check_ffmpeg(ffmpeg_path):
+        return fail(message)
+    if len(args := parser.positionalArguments()) != 2:
+        return fail("exactly one spool directory must be given")
+    try:
+        spool.init_spool(spool_dir := os.path.abspath(args[1]))
+    except spool.SpoolError as e:
+        return fail(str(e))
+    try:
+        poll = float(parser.value(poll_option))
+    except ValueError:
+        return fail(f"invalid poll interval {parser.value(poll_option)}")
+    # Only the scheduling settings and scratch folder apply, everything else
+    # comes with the job
+    settings = ConversionSettings.from_qsettings(QSettings())
+    if message := apply_schedule_options(parser, settings, *schedule_options):
+        return fail(message)
+    if (scratch_dir := settings["kbp2video/scratch_dir"]) and not os.path.isdir(scratch_dir):
+        return fail(f"scratch folder {scratch_dir} not found")
+
+    out = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        printer = EventPrinter(out)
+        worker = spool.SpoolWorker(
+                spool_dir,
+                max(1, settings["kbp2video/concurrent_jobs"]),
+                SchedulePolicy(settings["kbp2video/schedule_index"]),
+                Priority(settings["kbp2video/priority_index"]),
+                settings["kbp2video/scratch_dir"],
+                poll_interval=poll,
+                exit_when_idle=parser.isSet(idle_option))
+        printer.connect(worker)
+        def finished(success):
+            printer.finish(success=success, spool=spool.spool_summary(spool_dir))
+            app.exit(0 if success else 1)
+        worker.finished.connect(finished)
+        spool.install_stop_handler(worker.stop)
+        # Python only runs signal handlers between bytecodes, so make sure
+        # the event loop hands control back regularly
+        heartbeat = QTimer(interval=500, timeout=lambda: None)
+        heartbeat.start()
+        worker.start()
+        return app.exec()
+    finally:
+        sys.stdout = out
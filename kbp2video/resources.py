@@ -0,0 +1,206 @@
+import os
+import shutil
+import signal
+import sys
+
+# Rough per-encoder figures for a 1920x1080 encode at default presets:
+# (threads the encoder can keep busy, memory used per output pixel in bytes,
+# encode time relative to h264)
+# These only need to be good enough to avoid oversubscribing the machine and
+# to tell long jobs from short ones
+ENCODER_COSTS = {
+    "h264": (8, 100, 1),
+    "libx265": (8, 300, 4),
+    "libsvtav1": (12, 600, 3),
+    "libvpx-vp9": (6, 120, 3),
+    "png": (4, 30, 0.5),
+}
+DEFAULT_ENCODER_COST = (8, 300, 2)
+# Input decoding, libass and the rest of the filter graph
+BASE_MEMORY = 200 * 1024 * 1024
+HD_PIXELS = 1920 * 1080
+# Don't plan on using everything that is free right now
+MEMORY_HEADROOM = 0.8
+
+# Cores this process is allowed to run on
+def cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+# Available physical memory in bytes, or None if it can't be determined
+def available_memory():
+    try:
+        if sys.platform.startswith("linux"):
+            with open("/proc/meminfo", "r") as f:
+                for line in f:
+                    if line.startswith("MemAvailable:"):
+                        return int(line.split()[1]) * 1024
+        elif sys.platform == "win32":
+            import ctypes
+            class MEMORYSTATUSEX(ctypes.Structure):
+                _fields_ = [
+                    ("dwLength", ctypes.c_ulong),
+                    ("dwMemoryLoad", ctypes.c_ulong),
+                    ("ullTotalPhys", ctypes.c_ulonglong),
+                    ("ullAvailPhys", ctypes.c_ulonglong),
+                    ("ullTotalPageFile", ctypes.c_ulonglong),
+                    ("ullAvailPageFile", ctypes.c_ulonglong),
+                    ("ullTotalVirtual", ctypes.c_ulonglong),
+                    ("ullAvailVirtual", ctypes.c_ulonglong),
+                    ("ullAvailExtendedVirtual", ctypes.c_ulonglong),
+                ]
+            status = MEMORYSTATUSEX(dwLength=ctypes.sizeof(MEMORYSTATUSEX))
+            if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+                return status.ullAvailPhys
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+# For each encode priority (see encoder.Priority): nice value, and Windows
+# priority class (NORMAL, BELOW_NORMAL and IDLE_PRIORITY_CLASS). On Linux,
+# processes without an I/O priority get one based on their nice value, so
+# only the lowest one needs ionice to be put in the idle I/O class
+NICE_VALUES = (0, 10, 19)
+WINDOWS_PRIORITY_CLASSES = (0x20, 0x4000, 0x40)
+IDLE_PRIORITY = 2
+
+# Command to run args at the given priority. Only the idle I/O class needs
+# a wrapper, which execs the command so the process id stays the same
+def priority_command(args, priority):
+    if priority == IDLE_PRIORITY and sys.platform.startswith("linux") and shutil.which("ionice"):
+        return ["ionice", "-c", "3", *args]
+    return args
+
+# Lower the CPU priority of a running process. Errors are ignored, since
+# the encode still works at normal priority
+def set_process_priority(pid, priority):
+    if not priority or not pid:
+        return
+    try:
+        if sys.platform == "win32":
+            import ctypes
+            kernel32 = ctypes.windll.kernel32
+            # PROCESS_SET_INFORMATION
+            if handle := kernel32.OpenProcess(0x0200, False, pid):
+                kernel32.SetPriorityClass(handle, WINDOWS_PRIORITY_CLASSES[priority])
+                kernel32.CloseHandle(handle)
+        else:
+            os.setpriority(os.PRIO_PROCESS, pid, NICE_VALUES[priority])
+    except (OSError, AttributeError):
+        pass
+
+# Stop a running process in its tracks without losing anything, or let it
+# carry on. Returns False if it couldn't be done
+def suspend_process(pid, suspend=True):
+    if not pid:
+        return False
+    try:
+        if sys.platform == "win32":
+            import ctypes
+            # PROCESS_SUSPEND_RESUME
+            if not (handle := ctypes.windll.kernel32.OpenProcess(0x0800, False, pid)):
+                return False
+            ntdll = ctypes.windll.ntdll
+            status = (ntdll.NtSuspendProcess if suspend else ntdll.NtResumeProcess)(handle)
+            ctypes.windll.kernel32.CloseHandle(handle)
+            return status == 0
+        os.kill(pid, signal.SIGSTOP if suspend else signal.SIGCONT)
+        return True
+    except (OSError, AttributeError):
+        return False
+
+# Estimated threads and memory (bytes) needed for one encode. Thread count is
+# capped to the cores available so it can be passed straight to ffmpeg
+def estimate_cost(video_codec, width, height, lossless=False, cores=None):
+    threads, bytes_per_pixel, _ = ENCODER_COSTS.get(video_codec, DEFAULT_ENCODER_COST)
+    scale = width * height / HD_PIXELS
+    # Larger frames allow more slices/tiles to be worked on in parallel, but
+    # encoders stop scaling well long before the thread count matches the area
+    threads = max(1, min(round(threads * max(scale ** 0.5, 0.5)), cores or cpu_count()))
+    memory = BASE_MEMORY + width * height * bytes_per_pixel
+    if lossless:
+        memory *= 1.25
+    return (threads, int(memory))
+
+# Relative amount of work to encode a song, for comparing jobs against each
+# other. Units are roughly seconds of 1080p h264
+def estimate_work(length_ms, video_codec, width, height, lossless=False):
+    speed = ENCODER_COSTS.get(video_codec, DEFAULT_ENCODER_COST)[2]
+    # Lossless skips most rate-distortion work but writes far more data
+    if lossless:
+        speed *= 0.75
+    return length_ms / 1000 * speed * width * height / HD_PIXELS
+
+# Rough bits per pixel per frame of each video encoder at REFERENCE_QUALITY,
+# and when lossless. Karaoke video is mostly static text on a plain or slowly
+# changing background, so real files are usually well under this, but the
+# estimate is only used to check for free space and should err on the high side
+BITS_PER_PIXEL = {
+    "h264": 0.03,
+    "libx265": 0.02,
+    "libsvtav1": 0.015,
+    "libvpx-vp9": 0.02,
+    "png": 1.5,
+}
+DEFAULT_BITS_PER_PIXEL = 0.03
+LOSSLESS_BITS_PER_PIXEL = 0.5
+REFERENCE_QUALITY = 23
+# Quality (CRF) steps that halve the bitrate
+QUALITY_HALVING = 6
+# kbputils renders at 60fps
+FRAME_RATE = 60
+# Audio codecs with no bitrate setting, in kb/s
+LOSSLESS_AUDIO_BITRATE = {"flac": 1000}
+
+# Estimated size in bytes of a video length_ms long. audio_codec is "None" for
+# no audio
+def estimate_output_size(length_ms, video_codec, width, height, quality, lossless=False, audio_codec="None", audio_bitrate_kb=0):
+    if lossless or video_codec == "png":
+        bits = BITS_PER_PIXEL["png"] if video_codec == "png" else LOSSLESS_BITS_PER_PIXEL
+    else:
+        bits = BITS_PER_PIXEL.get(video_codec, DEFAULT_BITS_PER_PIXEL) * 2 ** ((REFERENCE_QUALITY - quality) / QUALITY_HALVING)
+    video = bits * width * height * FRAME_RATE
+    audio = 0 if audio_codec == "None" else LOSSLESS_AUDIO_BITRATE.get(audio_codec, audio_bitrate_kb) * 1000
+    return int(length_ms / 1000 * (video + audio) / 8)
+
+# Extra ffmpeg output options to limit an encode to the given number of threads
+def ffmpeg_thread_options(video_codec, threads, lossless=False):
+    result = {
+        "threads": threads,
+        "filter_complex_threads": threads,
+    }
+    # libx265 and libsvtav1 ignore -threads and size their own thread pools
+    # (the other encoders here take it from -threads). These params replace
+    # the ones kbputils sets, so lossless has to be carried over
+    if video_codec == "libx265":
+        result["x265-params"] = f"{'lossless=1:' if lossless else ''}pools={threads}"
+    elif video_codec == "libsvtav1":
+        result["svtav1-params"] = f"{'lossless=1:' if lossless else ''}lp={threads}"
+    return result
+
+# Tracks the cores and memory claimed by running encodes so more are only
+# started while they fit
+class ResourceBudget:
+    def __init__(self, cores=None, memory=None):
+        self.cores = cores or cpu_count()
+        if memory is None and (memory := available_memory()) is not None:
+            memory = int(memory * MEMORY_HEADROOM)
+        # None means unknown, so memory isn't limited
+        self.memory = memory
+        self.used_cores = 0
+        self.used_memory = 0
+
+    def fits(self, cost):
+        threads, memory = cost
+        return self.used_cores + threads <= self.cores and (
+                self.memory is None or self.used_memory + memory <= self.memory)
+
+    def acquire(self, cost):
+        self.used_cores += cost[0]
+        self.used_memory += cost[1]
+
+    def release(self, cost):
+        self.used_cores -= cost[0]
+        self.used_memory -= cost[1]
@@ -0,0 +1,76 @@
+import os
+from PySide6.QtCore import Qt, QCoreApplication
+from PySide6.QtWidgets import QAbstractItemView, QComboBox, QDialog, QDialogButtonBox, QHeaderView, QLabel, QTableWidget, QTableWidgetItem, QVBoxLayout
+
+# Shows the matches from a bulk import that were too close to call (see
+# matching.assign) in one table, so each can be checked or changed without
+# a dialog per file. entries are (project, file type, candidate files best
+# first, file chosen or None)
+class ReviewDialog(QDialog):
+
+    # Convenience method for adding a Qt object as a property in self and
+    # setting its Qt object name
+    def bind(self, name, obj):
+        setattr(self, name, obj)
+        obj.setObjectName(name)
+        return obj
+
+    def __init__(self, entries, parent=None):
+        super().__init__(parent)
+        self.entries = entries
+        self.setupUi()
+
+    def setupUi(self):
+        self.setObjectName("ReviewDialog")
+        self.resize(900, 400)
+        self.bind("verticalLayout", QVBoxLayout(self))
+        self.verticalLayout.addWidget(self.bind("description", QLabel(wordWrap=True)))
+        self.verticalLayout.addWidget(self.bind("table", QTableWidget(len(self.entries), 3)))
+        self.verticalLayout.addWidget(self.bind("buttonBox", QDialogButtonBox(self,
+            standardButtons=QDialogButtonBox.Cancel|QDialogButtonBox.Ok,
+            orientation=Qt.Horizontal)))
+
+        self.table.setSelectionMode(QAbstractItemView.NoSelection)
+        self.table.verticalHeader().setVisible(False)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.table.horizontalHeader().setSectionResizeMode(2, QHeaderView.Stretch)
+        for row, (project, filetype, candidates, chosen) in enumerate(self.entries):
+            item = QTableWidgetItem(os.path.basename(project))
+            item.setToolTip(project)
+            item.setFlags(Qt.ItemIsEnabled)
+            self.table.setItem(row, 0, item)
+            item = QTableWidgetItem(filetype)
+            item.setFlags(Qt.ItemIsEnabled)
+            self.table.setItem(row, 1, item)
+            box = QComboBox()
+            box.addItem("", None)
+            for n, file in enumerate(candidates, start=1):
+                box.addItem(os.path.basename(file), file)
+                box.setItemData(n, file, Qt.ToolTipRole)
+            if chosen in candidates:
+                box.setCurrentIndex(candidates.index(chosen) + 1)
+            self.table.setCellWidget(row, 2, box)
+
+        self.retranslateUi()
+
+        self.buttonBox.accepted.connect(self.accept)
+        self.buttonBox.rejected.connect(self.reject)
+
+    # File chosen for each entry, or None to leave it empty
+    def choices(self):
+        return [self.table.cellWidget(row, 2).currentData() for row in range(self.table.rowCount())]
+
+    def retranslateUi(self):
+        self.setWindowTitle(QCoreApplication.translate("ReviewDialog", "Review Matches", None))
+        self.description.setText(QCoreApplication.translate("ReviewDialog", "These files had more than one close match. Check the file chosen for each, or pick the blank entry to leave it empty. Cancel leaves all of them empty.", None))
+        self.table.setHorizontalHeaderLabels([
+            QCoreApplication.translate("ReviewDialog", "KBP/ASS", None),
+            QCoreApplication.translate("ReviewDialog", "Type", None),
+            QCoreApplication.translate("ReviewDialog", "File", None)])
+        for row in range(self.table.rowCount()):
+            self.table.cellWidget(row, 2).setItemText(0, QCoreApplication.translate("ReviewDialog", "(none)", None))
+
+    # File chosen for each entry (None to leave it empty), or None if cancelled
+    def showReviewDialog(entries, parent=None):
+        dialog = ReviewDialog(entries, parent)
+        return dialog.choices() if dialog.exec() else None
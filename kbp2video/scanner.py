@@ -0,0 +1,126 @@
+import os
+import queue
+import threading
+import traceback
+from PySide6.QtCore import QObject, Signal
+
+# Importing a folder means listing everything under it and identifying each
+# file, which on a network drive can take minutes for a music library. The
+# folders are listed with os.scandir, whose entries already know whether
+# they're folders or files without another trip to the disk, on a few
+# threads at once so the latency of each listing overlaps. Files are only
+# identified if their name passes accept, and the results are sent to the
+# GUI thread a folder at a time (the signals are queued, as the scanner lives
+# on the GUI thread), so the window stays responsive and can show how far
+# along it is
+
+# Threads listing folders. Mostly waiting on the disk, so more than the
+# number of cores helps
+SCAN_THREADS = 8
+
+class FolderScanner(QObject):
+    # [(path, what identify returned)] for the files of one folder
+    found = Signal(list)
+    # Folders listed and files found so far
+    progress = Signal(int, int)
+    # All folders have been listed. Not emitted if cancelled
+    finished = Signal()
+
+    # identify(path) returns what a file is, or None to leave it out, and is
+    # called on the scanning threads. accept(name) is a quick check of the
+    # file name before identify is called
+    def __init__(self, folders, identify, accept=lambda name: True, threads=SCAN_THREADS, parent=None):
+        super().__init__(parent)
+        self.folders = folders
+        self.identify = identify
+        self.accept = accept
+        self.threads = threads
+        self.cancelled = threading.Event()
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        # Folders queued or being listed
+        self.pending = 0
+        # (device, inode) of each folder queued, so links back up the tree
+        # don't loop forever
+        self.visited = set()
+        self.folders_done = 0
+        self.files_found = 0
+
+    def start(self):
+        for folder in self.folders:
+            self.submit(folder)
+        if not self.pending:
+            self.finished.emit()
+            return
+        for _ in range(self.threads):
+            threading.Thread(target=self.work, daemon=True).start()
+
+    # Stop listing folders. Listings already underway finish in the background
+    # but aren't reported, though signals already queued may still arrive
+    def cancel(self):
+        self.cancelled.set()
+
+    def submit(self, folder, stat=None):
+        try:
+            stat = stat or os.stat(folder)
+        except OSError as e:
+            print(f"Unable to scan {folder}: {e}")
+            return
+        with self.lock:
+            if (stat.st_dev, stat.st_ino) in self.visited:
+                return
+            self.visited.add((stat.st_dev, stat.st_ino))
+            self.pending += 1
+        self.queue.put(folder)
+
+    def work(self):
+        while (folder := self.queue.get()) is not None:
+            try:
+                if not self.cancelled.is_set():
+                    self.scan(folder)
+            except Exception:
+                print(traceback.format_exc())
+            finally:
+                with self.lock:
+                    self.pending -= 1
+                    done = not self.pending
+                if done:
+                    for _ in range(self.threads):
+                        self.queue.put(None)
+                    if not self.cancelled.is_set():
+                        self.finished.emit()
+
+    def scan(self, folder):
+        batch = []
+        subfolders = []
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if self.cancelled.is_set():
+                        return
+                    # Hidden, as glob skipped them
+                    if entry.name.startswith('.'):
+                        continue
+                    try:
+                        if entry.is_dir():
+                            subfolders.append(entry)
+                        elif entry.is_file() and self.accept(entry.name) and (result := self.identify(entry.path)):
+                            batch.append((entry.path, result))
+                    except OSError:
+                        continue
+        except OSError as e:
+            print(f"Unable to scan {folder}: {e}")
+        for entry in subfolders:
+            try:
+                self.submit(entry.path, entry.stat())
+            except OSError:
+                continue
+        with self.lock:
+            self.folders_done += 1
+            self.files_found += len(batch)
+            counts = (self.folders_done, self.files_found)
+        if self.cancelled.is_set():
+            return
+        if batch:
+            self.found.emit(batch)
+        self.progress.emit(*counts)
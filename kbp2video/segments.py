@@ -0,0 +1,205 @@
+from PySide6.QtCore import QStandardPaths
+import hashlib
+import json
+import os
+from . import backgrounds, resources
+from .encoder import EncodeJob
+from .fingerprint import file_identity
+
+# An intro or outro that is prepended/appended (intro_concat/outro_concat)
+# instead of overlaid doesn't depend on the song at all, so when a batch uses
+# the same one for every row there's no need to encode it each time. Instead,
+# the song is rendered without it, the segment is encoded once into a cache,
+# and the two are joined with the concat demuxer using stream copy. Segments
+# are encoded by jobs of their own that the song's job waits on (see
+# EncodeJob.needs), so they're run, paused and cancelled like any other encode.
+#
+# Stream copy only works if the pieces match exactly, so segments are encoded
+# with the same output options as the song (taken from its ffmpeg command),
+# at the size and frame rate of its background, and with silence or the
+# intro/outro's sound converted to the song's sample rate, format and channel
+# layout.
+# All of these are part of the cache key, apart from the thread options,
+# which don't change the format of what's encoded
+
+# Bump when the way segments are encoded changes so old entries aren't used
+CACHE_VERSION = 1
+
+# Number of segments to keep. Older ones are removed when a new one is made
+MAX_ENTRIES = 32
+
+KINDS = ("intro", "outro")
+
+# Options that affect a concatenated segment, after the intro_/outro_ prefix
+SEGMENT_SETTINGS = ("media", "length", "fadeIn", "fadeOut", "sound")
+
+# Output options in the song's ffmpeg command that don't affect the format of
+# what's encoded, and are left out of the cache key
+THREAD_OPTIONS = tuple({f"-{option}": None for codec in ("libx265", "libsvtav1") for option in resources.ffmpeg_thread_options(codec, 1)})
+
+def cache_dir():
+    return os.path.join(QStandardPaths.writableLocation(QStandardPaths.CacheLocation), "segments")
+
+# Kinds of segment in options that are concatenated
+def concat_kinds(options):
+    return [x for x in KINDS if options.get(f"{x}_concat") and options.get(f"{x}_media")]
+
+# options without the given segments, for rendering the song by itself
+def without_segments(options, kinds):
+    return {k: v for k, v in options.items() if not any(k.startswith(f"{x}_") for x in kinds)}
+
+# Hidden file next to output to render the song to before joining
+def part_file(output):
+    directory, name = os.path.split(output)
+    return os.path.join(directory, f".{name}.part")
+
+# Output options from a kbputils ffmpeg command (everything after the maps up
+# to the output file), without -progress, which is added back where needed
+def output_args(args, output):
+    end = args.index(output)
+    start = max(n for n, arg in enumerate(args[:end]) if arg == "-map") + 2
+    result = args[start:end]
+    if "-progress" in result:
+        n = result.index("-progress")
+        del result[n:n+2]
+    return result
+
+# (width, height, frame rate) of the video kbputils renders for options
+def video_format(options):
+    if media := options.get("background_media"):
+        import ffmpeg
+        info = ffmpeg.probe(media)
+        stream = next(x for x in info['streams'] if x['codec_type'] == 'video')
+        # Still images are read at 60fps
+        rate = "60" if backgrounds.still_stream(info) else stream['r_frame_rate']
+        return (stream['width'], stream['height'], rate)
+    return (options["target_x"], options["target_y"], "60")
+
+# (sample rate, sample format, channel layout) of the song's audio, or None if
+# there is none. The encoder chooses its format based on these, e.g. flac's
+# bit depth depends on the sample format
+def audio_format(options):
+    if not (audio := options.get("audio_file")):
+        return None
+    import ffmpeg
+    stream = next(x for x in ffmpeg.probe(audio)['streams'] if x['codec_type'] == 'audio')
+    layout = stream.get('channel_layout') or ("mono" if stream.get('channels') == 1 else "stereo")
+    return (int(stream['sample_rate']), stream['sample_fmt'], layout)
+
+def cache_key(kind, options, video, audio, codec_args):
+    settings = {name: options.get(f"{kind}_{name}") for name in SEGMENT_SETTINGS}
+    settings["media"] = file_identity(settings["media"])
+    format_args = []
+    skip = False
+    for arg in codec_args:
+        if skip:
+            skip = False
+        elif arg in THREAD_OPTIONS:
+            skip = True
+        else:
+            format_args.append(arg)
+    return hashlib.sha256(json.dumps([CACHE_VERSION, kind, settings, video, audio, format_args]).encode()).hexdigest()
+
+# ffmpeg arguments to encode a segment the same way kbputils renders it when
+# concatenating, to path
+def segment_args(kind, options, video, audio, codec_args, path):
+    import ffmpeg
+    import kbputils
+    media = options[f"{kind}_media"]
+    length = options[f"{kind}_length"]
+    width, height, rate = video
+    media_type = kbputils.VideoConverter.get_stream_types(media)
+    input_opts = {"loop": 1, "framerate": 60} if kbputils.MediaType.IMAGE in media_type else {}
+    # Square pixels like the song, since stream copy keeps the first file's
+    # aspect ratio for all of them
+    stream = ffmpeg.input(media, t=f"{length}ms", **input_opts).video.filter_("scale", s=f"{width}x{height}").filter_("setsar", 1)
+    if fade := options.get(f"{kind}_fadeIn"):
+        stream = stream.filter_("fade", t="in", d=fade / 1000, st=0)
+    if fade := options.get(f"{kind}_fadeOut"):
+        stream = stream.filter_("fade", t="out", d=fade / 1000, st=(length - fade) / 1000)
+    streams = [stream.filter_("fps", rate)]
+    if audio:
+        sample_rate, sample_fmt, layout = audio
+        if options.get(f"{kind}_sound") and kbputils.MediaType.AUDIO in media_type:
+            sound = ffmpeg.input(media, t=f"{length}ms").audio
+        else:
+            sound = ffmpeg.input(f"anullsrc=r={sample_rate}:cl={layout}", f="lavfi", t=f"{length}ms").audio
+        streams.append(sound.filter_("aformat", sample_rates=sample_rate, sample_fmts=sample_fmt, channel_layouts=layout))
+    args = ["ffmpeg", *ffmpeg.output(*streams, path).overwrite_output().get_args()]
+    n = args.index(path)
+    args[n:n] = codec_args
+    return args
+
+# Path of the cached segment for job, and the EncodeJob encoding it if it
+# isn't cached yet, otherwise None
+def cached_segment(job, kind, options, video, audio, codec_args, extension):
+    path = os.path.join(cache_dir(), f"{cache_key(kind, options, video, audio, codec_args)}{extension}")
+    if os.path.exists(path):
+        # Keep recently used entries from being pruned
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return (path, None)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    prune()
+    # Unique per process, so workers sharing the cache don't clobber each
+    # other's partial files. The runner is left to move it into place
+    tmp = f"{path}.{os.getpid()}.tmp{extension}"
+    length = options[f"{kind}_length"]
+    segment = EncodeJob(job.row, job.kbp, {"args": segment_args(kind, options, video, audio, codec_args, tmp), "cwd": job.cwd, "length": length},
+                        job.cost, job.work * length / job.length if job.length else 0, output=path, options=options, lossless=job.lossless)
+    segment.render_to = tmp
+    segment.description = f"{kind} {options[f'{kind}_media']}"
+    return (path, segment)
+
+def prune():
+    entries = []
+    try:
+        for entry in os.scandir(cache_dir()):
+            if ".tmp" not in entry.name:
+                entries.append((entry.stat().st_mtime, entry.path))
+    except OSError:
+        # Another process pruning at the same time
+        return
+    for _, path in sorted(entries, reverse=True)[MAX_ENTRIES:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+# Concat demuxer list joining files, written next to part
+def write_concat_list(files, part):
+    path = f"{part}.ffconcat"
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("ffconcat version 1.0\n")
+        for file in files:
+            escaped = os.path.abspath(file).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    return path
+
+# Set up a job rendered to part (see encode_job) to be joined with its
+# segments: adds jobs encoding any segments that aren't cached yet to its
+# needs, and the concat step to the job
+def add_segments(job, options, kinds, part):
+    codec_args = output_args(job.args, part)
+    video = video_format(options)
+    audio = audio_format(options)
+    extension = os.path.splitext(job.output)[1]
+    cached = {}
+    for kind in kinds:
+        cached[kind], segment = cached_segment(job, kind, options, video, audio, codec_args, extension)
+        if segment:
+            job.needs.append(segment)
+    files = [cached[x] for x in ("intro",) if x in cached] + [part] + [cached[x] for x in ("outro",) if x in cached]
+    concat_list = write_concat_list(files, part)
+    container = []
+    if "-f" in codec_args:
+        n = codec_args.index("-f")
+        container = codec_args[n:n+2]
+    job.steps.append((
+        ["ffmpeg", "-hide_banner", "-loglevel", "warning", "-f", "concat", "-safe", "0", "-i", concat_list,
+         "-map", "0", "-c", "copy", *container, "-progress", "-", job.render_to, "-y"],
+        job.cwd))
+    job.temp_files += [part, concat_list]
+    job.length += sum(options[f"{kind}_length"] for kind in kinds)
@@ -0,0 +1,290 @@
+import datetime
+import json
+import os
+import shutil
+import signal
+import socket
+import sys
+import uuid
+from PySide6.QtCore import QObject, QTimer, Signal
+from . import conversion
+from .encoder import EncodeRunner, Priority, SchedulePolicy
+
+# A spool directory lets any number of workers, on this machine or others
+# sharing the directory, render jobs prepared by kbp2video. Each job is a
+# directory that moves between these subdirectories as it progresses:
+#   pending  ready to be claimed by a worker
+#   running  claimed by a worker, which records itself in status.json
+#   done     rendered successfully
+#   failed   ffmpeg failed or the command couldn't be generated
+# A job directory contains job.json (the kbputils.VideoConverter options,
+# media paths and output file), the .ass file to render, and once a worker has
+# run it, status.json and ffmpeg.log. Workers record the job's fingerprint
+# next to the output, so it is skipped if the same batch is submitted again.
+# Jobs are written to tmp and renamed into pending, and claimed by renaming
+# from pending to running, so no two workers can get the same job. All of
+# this relies on rename being atomic, so the whole spool needs to be on one
+# filesystem. Media and output paths are used as-is, so they need to be the
+# same on every machine
+STATES = ("pending", "running", "done", "failed")
+
+JOB_FILE = "job.json"
+STATUS_FILE = "status.json"
+LOG_FILE = "ffmpeg.log"
+
+class SpoolError(Exception):
+    pass
+
+def timestamp():
+    return datetime.datetime.now().astimezone().isoformat(timespec="seconds")
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def init_spool(spool):
+    try:
+        for state in (*STATES, "tmp"):
+            os.makedirs(os.path.join(spool, state), exist_ok=True)
+    except OSError as e:
+        raise SpoolError(f"Unable to create spool directory {spool}: {e}")
+
+def read_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def write_json(path, data):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+
+# Write a prepared EncodeJob to the spool so a worker can pick it up. Used as
+# the add_job callback for conversion.prepare_jobs. Returns the job id
+def submit_job(spool, job):
+    # Sorts in submission order, which workers use for table order
+    job_id = f"{datetime.datetime.now():%Y%m%d-%H%M%S}-{job.row:04d}-{uuid.uuid4().hex[:8]}"
+    tmp = os.path.join(spool, "tmp", job_id)
+    os.mkdir(tmp)
+    try:
+        shutil.copyfile(job.assfile, os.path.join(tmp, os.path.basename(job.assfile)))
+        write_json(os.path.join(tmp, JOB_FILE), {
+            "id": job_id,
+            "kbp": job.kbp,
+            "ass": os.path.basename(job.assfile),
+            "output": os.path.abspath(job.output),
+            "options": job.options,
+            "lossless": job.lossless,
+            "fingerprint": job.fingerprint,
+            "chunk_length": job.chunk_length,
+            "length": job.length,
+            "work": job.work,
+            "submitted": timestamp(),
+            "submitted_by": worker_name(),
+        })
+        os.rename(tmp, os.path.join(spool, "pending", job_id))
+    except:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return job_id
+
+# Prepare rows like conversion.prepare_jobs, but write each job to the spool
+# instead of running it. Reports through a ConverterSignals, with file_done
+# once a job is submitted. Returns (success, list of submitted job ids)
+def submit_jobs(signals, rows, settings, spool, confirm_overwrite=lambda assfile: True):
+    submitted = []
+    failed = []
+    def submit(job):
+        try:
+            submitted.append(submit_job(spool, job))
+        except OSError as e:
+            failed.append(job)
+            signals.error.emit(f"Failed to submit file\n{job.kbp}\nto spool directory {spool}\n\n{e}", True)
+            signals.file_done.emit(job.row, False)
+        else:
+            signals.file_done.emit(job.row, True)
+    success = conversion.prepare_jobs(signals, rows, settings, submit, confirm_overwrite, spooled=True)
+    return (success and not failed, submitted)
+
+# Jobs in the given state as {job id: job.json contents}. Jobs that move or
+# are unreadable while listing are left out
+def list_jobs(spool, state):
+    result = {}
+    try:
+        job_ids = sorted(os.listdir(path := os.path.join(spool, state)))
+    except FileNotFoundError:
+        return result
+    for job_id in job_ids:
+        try:
+            result[job_id] = read_json(os.path.join(path, job_id, JOB_FILE))
+        except (OSError, ValueError):
+            pass
+    return result
+
+# Stand-in for EncodeJob so SchedulePolicy can choose between pending jobs
+class PendingJob:
+    def __init__(self, job_id, spec):
+        self.id = job_id
+        self.row = job_id
+        self.work = spec.get("work", 0)
+
+# Claims jobs from a spool directory and runs them with an EncodeRunner,
+# writing status.json and ffmpeg.log into each job's directory before moving
+# it to done or failed. New jobs are only claimed while there's room to start
+# them, so other workers get a share of the batch
+class SpoolWorker(QObject):
+    progress = Signal(int, int, str, int, int)
+    file_done = Signal(int, bool)
+    error = Signal(str, bool)
+    # Emitted when the worker stops. False if any job failed
+    finished = Signal(bool)
+
+    def __init__(self, spool, concurrency, policy=SchedulePolicy.TABLE_ORDER, priority=Priority.NORMAL, scratch_dir="", poll_interval=5, exit_when_idle=False, parent=None):
+        super().__init__(parent)
+        self.spool = spool
+        self.concurrency = concurrency
+        self.policy = policy
+        self.exit_when_idle = exit_when_idle
+        # This machine's scratch folder, as jobs may come from others
+        self.scratch_dir = scratch_dir
+        self.name = worker_name()
+        self.success = True
+        self.stopping = False
+        # row: (job id, EncodeJob)
+        self.jobs = {}
+        self.next_row = 0
+        self.runner = EncodeRunner(0, concurrency, policy, parent=self, priority=priority)
+        self.runner.progress.connect(self.progress)
+        self.runner.error.connect(self.error)
+        self.runner.file_done.connect(self.job_done)
+        self.timer = QTimer(self, interval=int(poll_interval * 1000), timeout=self.claim_jobs)
+
+    def start(self):
+        self.requeue_stale()
+        self.timer.start()
+        self.claim_jobs()
+
+    # Stop claiming jobs and put any that are running back in pending. That
+    # waits until their ffmpeg has exited and the partial output is removed,
+    # so another worker can't start on the same output in the meantime
+    def stop(self):
+        if self.stopping:
+            return
+        self.stopping = True
+        self.timer.stop()
+        self.runner.finished.connect(self.stopped)
+        self.runner.cancel()
+
+    def stopped(self):
+        for job_id, job in self.jobs.values():
+            self.requeue(job_id)
+        self.jobs.clear()
+        self.finished.emit(self.success)
+
+    # Jobs left in running by a worker on this machine that no longer exists,
+    # e.g. after a crash or reboot
+    def requeue_stale(self):
+        host = socket.gethostname()
+        for job_id in sorted(os.listdir(os.path.join(self.spool, "running"))):
+            try:
+                status = read_json(os.path.join(self.spool, "running", job_id, STATUS_FILE))
+                worker_host, pid = status["worker"].rsplit(":", 1)
+            except (OSError, ValueError, KeyError):
+                continue
+            if worker_host == host and not pid_alive(int(pid)):
+                self.requeue(job_id)
+
+    def requeue(self, job_id):
+        try:
+            os.remove(os.path.join(self.spool, "running", job_id, STATUS_FILE))
+        except OSError:
+            pass
+        try:
+            os.rename(os.path.join(self.spool, "running", job_id), os.path.join(self.spool, "pending", job_id))
+        except OSError as e:
+            self.error.emit(f"Unable to requeue job {job_id}: {e}", False)
+
+    def has_room(self):
+        return not self.runner.pending and len(self.runner.active) < self.concurrency
+
+    def claim_jobs(self):
+        while not self.stopping and self.has_room():
+            if not (pending := [PendingJob(job_id, spec) for job_id, spec in list_jobs(self.spool, "pending").items()]):
+                break
+            while pending:
+                choice = self.policy.next_job(pending)
+                pending.remove(choice)
+                try:
+                    os.rename(os.path.join(self.spool, "pending", choice.id), job_dir := os.path.join(self.spool, "running", choice.id))
+                except OSError:
+                    # Another worker got it first
+                    continue
+                self.start_job(choice.id, job_dir)
+                break
+        if self.exit_when_idle and not self.jobs and not self.stopping:
+            self.stopping = True
+            self.timer.stop()
+            self.finished.emit(self.success)
+
+    def start_job(self, job_id, job_dir):
+        row = self.next_row
+        self.next_row += 1
+        status = {"state": "running", "worker": self.name, "started": timestamp()}
+        try:
+            write_json(os.path.join(job_dir, STATUS_FILE), status)
+            spec = read_json(os.path.join(job_dir, JOB_FILE))
+            os.makedirs(os.path.dirname(spec["output"]), exist_ok=True)
+            job = conversion.encode_job(row, spec["kbp"], os.path.join(job_dir, spec["ass"]), spec["output"], spec["options"], spec.get("lossless", False), spec.get("fingerprint"), spec.get("chunk_length", 0), self.scratch_dir,
+                                        priority=self.runner.priority.value, cancelled=lambda: self.stopping)
+        except Exception as e:
+            self.success = False
+            self.error.emit(f"Failed to start job {job_id}\n\n{e}", True)
+            self.finish_job(job_id, job_dir, status, False, f"Unable to generate ffmpeg command: {e}\n")
+            return
+        self.jobs[row] = (job_id, job)
+        self.runner.rows = self.next_row
+        self.runner.add_job(job)
+
+    def job_done(self, row, success):
+        if row not in self.jobs:
+            return
+        job_id, job = self.jobs.pop(row)
+        if not success:
+            self.success = False
+        self.finish_job(job_id, os.path.join(self.spool, "running", job_id), {"state": "running", "worker": self.name}, success, job.log)
+        self.file_done.emit(row, success)
+        # Make room for the next one right away instead of waiting for the timer
+        QTimer.singleShot(0, self.claim_jobs)
+
+    def finish_job(self, job_id, job_dir, status, success, log):
+        state = "done" if success else "failed"
+        try:
+            status.update(read_json(os.path.join(job_dir, STATUS_FILE)))
+        except (OSError, ValueError):
+            pass
+        status.update({"state": state, "finished": timestamp()})
+        try:
+            with open(os.path.join(job_dir, LOG_FILE), "w", encoding="utf-8") as f:
+                f.write(log)
+            write_json(os.path.join(job_dir, STATUS_FILE), status)
+            os.rename(job_dir, os.path.join(self.spool, state, job_id))
+        except OSError as e:
+            self.error.emit(f"Unable to record result of job {job_id}: {e}", False)
+
+def pid_alive(pid):
+    # Only used for jobs from this host. Signal 0 doesn't exist on Windows
+    if sys.platform == "win32":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+# Count of jobs in each state, for reporting
+def spool_summary(spool):
+    return {state: len(list_jobs(spool, state)) for state in STATES}
+
+# Call stop on SIGINT/SIGTERM
+def install_stop_handler(stop):
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: stop())
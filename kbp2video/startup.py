@@ -0,0 +1,28 @@
+import time
+
+# Timings of the phases of a cold start, printed with --profile-startup so
+# regressions can be measured. Each phase runs from the end of the previous
+# one, the first from the "start" mark made when the kbp2video package starts
+# to be imported. Phases marked more than once (e.g. setupUi before and after
+# loadSettings) are added together
+
+marks = []
+
+# The phase that just finished
+def mark(phase):
+    marks.append((phase, time.perf_counter()))
+
+# {phase: seconds} in the order the phases first finished
+def phases():
+    result = {}
+    last = marks[0][1] if marks else 0
+    for phase, when in marks[1:]:
+        result[phase] = result.get(phase, 0) + when - last
+        last = when
+    return result
+
+def report():
+    print("Startup profile:")
+    for phase, seconds in phases().items():
+        print(f"  {phase:<16} {seconds * 1000:8.1f} ms")
+    print(f"  {'total':<16} {(marks[-1][1] - marks[0][1] if marks else 0) * 1000:8.1f} ms")
@@ -0,0 +1,75 @@
+import errno
+import hashlib
+import os
+import shutil
+import threading
+
+# The output folder is often on a slow or shared disk, so videos can instead
+# be rendered to a scratch folder (e.g. a local SSD or tmpfs), along with any
+# intermediate files, and only moved to the output folder once they're done.
+# The move is a rename if both are on the same filesystem. Otherwise the file
+# is copied next to the output under a hidden name and renamed into place, so
+# the output never appears half-written.
+#
+# Running out of space partway through a batch wastes everything rendered
+# since the last file finished, so the space a batch needs is estimated up
+# front (see resources.estimate_output_size) and checked against what's free
+# on each disk it writes to
+
+# Where to render output in scratch_dir. Prefixed with a hash of the output
+# folder, so videos with the same name from different folders don't clash
+def scratch_file(scratch_dir, output):
+    directory, name = os.path.split(os.path.abspath(output))
+    return os.path.join(scratch_dir, f"{hashlib.sha256(directory.encode()).hexdigest()[:12]}-{name}")
+
+# Move the finished video at source to path. Raises OSError
+def publish(source, path):
+    try:
+        os.replace(source, path)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    directory, name = os.path.split(path)
+    # Unique per thread and process, as in backgrounds.make_clip
+    tmp = os.path.join(directory, f".{name}.{os.getpid()}-{threading.get_ident()}.publish")
+    try:
+        shutil.copyfile(source, tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    os.remove(source)
+
+# Closest folder to path that exists, which is on the disk path will be on
+def existing_parent(path):
+    path = os.path.abspath(path)
+    while not os.path.isdir(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    return path
+
+# needs is {folder: bytes to be written there}. Returns (folder, needed, free)
+# for each disk that doesn't have enough space, with folders on the same disk
+# added together. Disks that can't be checked are left out
+def shortfalls(needs):
+    disks = {}
+    for folder, size in needs.items():
+        folder = existing_parent(folder)
+        try:
+            device = os.stat(folder).st_dev
+        except OSError:
+            continue
+        first, total = disks.get(device, (folder, 0))
+        disks[device] = (first, total + size)
+    result = []
+    for folder, needed in disks.values():
+        try:
+            free = shutil.disk_usage(folder).free
+        except OSError:
+            continue
+        if needed > free:
+            result.append((folder, needed, free))
+    return result
+
+def format_size(size):
+    return f"{size / 1000 ** 3:.1f} GB" if size >= 1000 ** 3 else f"{size / 1000 ** 2:.0f} MB"
@@ -0,0 +1,63 @@
+import json
+import time
+import traceback
+
+# The update check at startup asks GitHub and PyPI for the latest versions,
+# which can take until the network times out when there's no connection. It
+# runs on its own thread, the main window shows the result in the status bar
+# when it arrives, and the result is kept in QSettings so the network is only
+# asked again once it's older than the interval set by the user
+
+SETTINGS_KEY = "kbp2video/update_cache"
+
+# Seconds to wait for each request the check makes. lastversion's own default
+# is 30 seconds with five retries, which is far too long to wait for a version
+# number, so its holders are set to this with no retries before checking
+TIMEOUT = 15
+
+# Newer version of each of current ({package: version}) or "" if there's none.
+# Blocks on the network. lastversion brings in requests and feedparser, which
+# take longer to import than the rest of the program, so it's only imported here.
+# Raises TimeoutError if a request times out
+def check(current):
+    import lastversion
+    import requests
+    import urllib3
+    from lastversion.repo_holders.base import BaseProjectHolder
+    BaseProjectHolder.DEFAULT_TIMEOUT = TIMEOUT
+    BaseProjectHolder.NETWORK_RETRIES = 0
+    try:
+        kbp2video = lastversion.has_update(repo="ItMightBeKaraoke/kbp2video", at="github", pre_ok=True, current_version=current["kbp2video"])
+        kbputils = lastversion.has_update(repo="kbputils", at="pip", current_version=current["kbputils"])
+    except requests.exceptions.Timeout as e:
+        raise TimeoutError(str(e)) from e
+    except requests.exceptions.ConnectionError as e:
+        # Read timeouts through a proxy come as connection errors
+        if e.args and isinstance(getattr(e.args[0], "reason", None), urllib3.exceptions.TimeoutError):
+            raise TimeoutError(str(e)) from e
+        raise
+    return {"kbp2video": str(kbp2video) if kbp2video else "", "kbputils": str(kbputils) if kbputils else ""}
+
+# Run check on a thread, reporting through a ConverterSignals. data gets
+# {"updates": result}, {"timeout": message} or {"error": message}
+def run_check(signals, current):
+    try:
+        signals.data.emit({"updates": check(current)})
+    except TimeoutError as e:
+        signals.data.emit({"timeout": str(e)})
+    except Exception:
+        signals.data.emit({"error": traceback.format_exc(limit=2)})
+
+# Result of check for current from settings, if it was made less than
+# max_age_hours ago. Otherwise None
+def cached_result(settings, current, max_age_hours):
+    try:
+        cached = json.loads(settings.value(SETTINGS_KEY, type=str, defaultValue=""))
+        if cached["current"] == current and 0 <= time.time() - cached["checked"] < max_age_hours * 3600:
+            return cached["updates"]
+    except (ValueError, KeyError, TypeError):
+        pass
+    return None
+
+def store_result(settings, current, updates):
+    settings.setValue(SETTINGS_KEY, json.dumps({"checked": time.time(), "current": current, "updates": updates}))
@@ -1,6 +1,8 @@
 from PySide6.QtWidgets import QCheckBox, QLabel
-from PySide6.QtCore import QMimeDatabase, Qt
+from PySide6.QtCore import QCoreApplication, QMimeDatabase, Qt
+import functools
 import sys
+from . import __version__
 
 # Minor enhancement to QLabel - if it has a buddy configured, that will not
 # only allow a keyboard mnemonic to be associated, but will also focus the buddy
@@ -20,7 +22,18 @@ class ClickLabel(QLabel):
             else:
                 b.setFocus(Qt.MouseFocusReason)
 
-mimedb = QMimeDatabase()
+# Created on first use rather than at import, so it isn't paid for at startup
+@functools.cache
+def mimedb():
+    return QMimeDatabase()
+
+# Where QSettings and QStandardPaths keep settings and caches depends on these,
+# so the GUI, render and worker must all set them the same way to share them
+def set_application_names():
+    QCoreApplication.setOrganizationName("ItMightBeKaraoke")
+    QCoreApplication.setOrganizationDomain("itmightbekaraoke.com")
+    QCoreApplication.setApplicationName("kbp2video")
+    QCoreApplication.setApplicationVersion(__version__)
 
 def check2bool(state_or_checkbox):
     if 'checkState' in dir(state_or_checkbox):
@@ -0,0 +1,36 @@
+import os
+import sys
+import time
+import pytest
+from kbp2video import backgrounds
+
+# Puts an ffmpeg on PATH that runs script with the arguments it's given
+@pytest.fixture
+def fake_ffmpeg(tmp_path, monkeypatch):
+    def install(script):
+        directory = tmp_path / "bin"
+        directory.mkdir()
+        path = directory / "ffmpeg"
+        path.write_text(f"#!{sys.executable}\nimport sys, time\n{script}\n")
+        path.chmod(0o755)
+        monkeypatch.setenv("PATH", os.pathsep.join([str(directory), os.environ["PATH"]]))
+    return install
+
+def test_make_clip(tmp_path, fake_ffmpeg):
+    fake_ffmpeg("open(sys.argv[-1], 'w').close()")
+    path = str(tmp_path / "cache" / "clip.avi")
+    assert backgrounds.make_clip("image.png", {"pix_fmt": "rgb24"}, path) == path
+    assert os.listdir(tmp_path / "cache") == ["clip.avi"]
+
+def test_make_clip_fails(tmp_path, fake_ffmpeg):
+    fake_ffmpeg("open(sys.argv[-1], 'w').close()\nsys.stderr.write('bad image\\n')\nsys.exit(1)")
+    with pytest.raises(RuntimeError, match="bad image"):
+        backgrounds.make_clip("image.png", {}, str(tmp_path / "cache" / "clip.avi"))
+    assert os.listdir(tmp_path / "cache") == []
+
+def test_make_clip_cancelled(tmp_path, fake_ffmpeg):
+    fake_ffmpeg("open(sys.argv[-1], 'w').close()\ntime.sleep(60)")
+    started = time.monotonic()
+    assert backgrounds.make_clip("image.png", {}, str(tmp_path / "cache" / "clip.avi"), cancelled=lambda: time.monotonic() - started > 0.5) is None
+    assert time.monotonic() - started < 10
+    assert os.listdir(tmp_path / "cache") == []
@@ -0,0 +1,9 @@
+from kbp2video import chunks
+
+def test_trim_sources():
+    graph = "[0:v]tpad=stop_duration=6010ms[s0];color=color=000000@0:r=60[s1];[s1]ass=song.ass[s2];[s0][s2]overlay[s3]"
+    assert chunks.trim_sources(graph, 10, 20) == "[0:v]tpad=stop_duration=6010ms,trim=start=10:end=20[s0];color=color=000000@0:r=60,trim=start=10:end=20[s1];[s1]ass=song.ass[s2];[s0][s2]overlay[s3]"
+    assert chunks.trim_sources(graph, 10, None).startswith("[0:v]tpad=stop_duration=6010ms,trim=start=10[s0];")
+
+def test_trim_sources_bare_input():
+    assert chunks.trim_sources("[0]loop=-1:1[s0];[1:a]volume=2[a0]", 5, 15) == "[0]loop=-1:1,trim=start=5:end=15[s0];[1:a]volume=2[a0]"
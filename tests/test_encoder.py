@@ -0,0 +1,78 @@
+import os
+import sys
+import pytest
+from PySide6.QtCore import QCoreApplication, QEventLoop, QTimer
+from kbp2video.encoder import EncodeJob, EncodeRunner
+
+# Stands in for ffmpeg: appends its output file to the log given in the
+# environment, then writes it, or fails if the output's name says to
+SCRIPT = """
+import os, sys
+with open(os.environ["KBP2VIDEO_TEST_LOG"], "a") as f:
+    f.write(os.path.basename(sys.argv[1]) + "\\n")
+if "fail" in os.path.basename(sys.argv[1]):
+    sys.exit(1)
+open(sys.argv[1], "w").close()
+"""
+
+# Kept for the whole module, as Qt only allows one to be created
+@pytest.fixture(scope="module")
+def app():
+    return QCoreApplication.instance() or QCoreApplication([])
+
+@pytest.fixture
+def log(tmp_path, monkeypatch):
+    path = tmp_path / "log"
+    monkeypatch.setenv("KBP2VIDEO_TEST_LOG", str(path))
+    return lambda: path.read_text().split() if path.exists() else []
+
+def make_job(row, path, cwd):
+    return EncodeJob(row, f"{row}.kbp", {"args": [sys.executable, "-c", SCRIPT, path, "-y"], "cwd": cwd, "length": 1000}, (1, 0), 1, output=path)
+
+# Job making path under a temporary name, as segments.cached_segment does
+def make_need(row, path, cwd):
+    need = make_job(row, f"{path}.tmp", cwd)
+    need.output = path
+    need.description = os.path.basename(path)
+    return need
+
+# Runs jobs to the end. The runner needs a parent, as in the GUI, since
+# deleting it straight away once it's done crashes Qt
+def run(runner, jobs):
+    results = {}
+    errors = []
+    runner.file_done.connect(lambda row, success: results.__setitem__(row, success))
+    runner.error.connect(lambda message, fatal: errors.append(message))
+    loop = QEventLoop()
+    runner.finished.connect(loop.quit)
+    # Owned by the loop, so it goes with it
+    QTimer(loop, singleShot=True, interval=20000, timeout=loop.quit).start()
+    for job in jobs:
+        runner.add_job(job)
+    runner.finish_input()
+    if not runner.done:
+        loop.exec()
+    assert runner.done
+    return (results, errors)
+
+def test_needs_are_made_once_and_first(app, log, tmp_path):
+    segment = str(tmp_path / "segment")
+    jobs = [make_job(row, str(tmp_path / f"video{row}"), str(tmp_path)) for row in range(2)]
+    for job in jobs:
+        job.needs.append(make_need(job.row, segment, str(tmp_path)))
+    results, errors = run(EncodeRunner(2, 2, parent=app), jobs)
+    assert results == {0: True, 1: True} and not errors
+    assert log()[0] == "segment.tmp"
+    assert sorted(log()) == ["segment.tmp", "video0", "video1"]
+    assert os.path.exists(segment) and not os.path.exists(f"{segment}.tmp")
+
+def test_failed_need_fails_the_jobs_waiting_on_it(app, log, tmp_path):
+    segment = str(tmp_path / "segment-fail")
+    jobs = [make_job(row, str(tmp_path / f"video{row}"), str(tmp_path)) for row in range(3)]
+    for job in jobs[:2]:
+        job.needs.append(make_need(job.row, segment, str(tmp_path)))
+    results, errors = run(EncodeRunner(3, 1, parent=app), jobs)
+    assert results == {0: False, 1: False, 2: True}
+    assert len(errors) == 2 and all("Unable to make segment-fail" in error for error in errors)
+    assert sorted(log()) == ["segment-fail.tmp", "video2"]
+    assert not os.path.exists(segment)
@@ -0,0 +1,64 @@
+import enum
+import os
+from kbp2video import fingerprint
+
+def test_file_identity(tmp_path):
+    path = tmp_path / "song.mp3"
+    path.write_bytes(b"audio")
+    identity = fingerprint.file_identity(str(path))
+    assert identity == [str(path), 5, os.stat(path).st_mtime_ns]
+    assert fingerprint.file_identity(str(tmp_path / "missing.mp3")) is None
+    assert fingerprint.file_identity(None) is None
+    # Background colors aren't files
+    assert fingerprint.file_identity("color: #000000") is None
+
+def test_digest_is_stable():
+    class Kind(enum.Enum):
+        A = 1
+    assert fingerprint.digest({"a": 1, "b": [2, 3]}) == fingerprint.digest({"b": [2, 3], "a": 1})
+    assert fingerprint.digest({"a": 1}) != fingerprint.digest({"a": 2})
+    assert fingerprint.digest({"kind": Kind.A}) == fingerprint.digest({"kind": "A"})
+
+def test_render_fingerprint(tmp_path):
+    project = tmp_path / "song.kbp"
+    audio = tmp_path / "song.mp3"
+    project.write_text("lyrics")
+    audio.write_bytes(b"audio")
+    options = {"audio_file": str(audio), "background_media": "color: #000000"}
+    first = fingerprint.render_fingerprint(str(project), {"offset": 0}, options)
+    assert fingerprint.render_fingerprint(str(project), {"offset": 0}, dict(options)) == first
+    assert fingerprint.render_fingerprint(str(project), {"offset": 100}, options) != first
+    # The project is hashed by content, media by size and modification time
+    os.utime(project, ns=(0, 0))
+    assert fingerprint.render_fingerprint(str(project), {"offset": 0}, options) == first
+    project.write_text("edited")
+    assert fingerprint.render_fingerprint(str(project), {"offset": 0}, options) != first
+    project.write_text("lyrics")
+    audio.write_bytes(b"louder")
+    assert fingerprint.render_fingerprint(str(project), {"offset": 0}, options) != first
+
+def test_record_and_up_to_date(tmp_path):
+    output = tmp_path / "song.mp4"
+    assert not fingerprint.up_to_date(str(output), "abc")
+    # Nothing is recorded for an output that isn't there
+    fingerprint.record(str(output), "abc")
+    assert not os.path.exists(fingerprint.sidecar_path(str(output)))
+    output.write_bytes(b"video")
+    fingerprint.record(str(output), "abc")
+    assert fingerprint.sidecar_path(str(output)) == str(tmp_path / ".song.mp4.kbp2video")
+    assert fingerprint.up_to_date(str(output), "abc")
+    assert not fingerprint.up_to_date(str(output), "def")
+    # Touching the output after it was rendered makes it out of date
+    output.write_bytes(b"edited")
+    assert not fingerprint.up_to_date(str(output), "abc")
+    fingerprint.record(str(output), "abc")
+    assert fingerprint.up_to_date(str(output), "abc")
+    os.remove(output)
+    assert not fingerprint.up_to_date(str(output), "abc")
+
+def test_broken_sidecar(tmp_path):
+    output = tmp_path / "song.mp4"
+    output.write_bytes(b"video")
+    with open(fingerprint.sidecar_path(str(output)), "w") as f:
+        f.write("{")
+    assert not fingerprint.up_to_date(str(output), "abc")
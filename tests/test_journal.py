@@ -0,0 +1,111 @@
+import json
+import os
+import pytest
+from kbp2video import journal, segments, storage
+from kbp2video.conversion import ConversionSettings
+
+@pytest.fixture
+def batch(tmp_path):
+    settings = ConversionSettings({"kbp2video/relative_path": False, "kbp2video/output_dir": str(tmp_path / "out")})
+    (tmp_path / "out").mkdir()
+    rows = []
+    for name in ("one", "two", "three"):
+        (tmp_path / f"{name}.kbp").write_text(name)
+        (tmp_path / f"{name}.mp3").write_bytes(b"audio")
+        rows.append((str(tmp_path / f"{name}.kbp"), str(tmp_path / f"{name}.mp3"), "color: #000000", {}))
+    record = journal.BatchJournal(str(tmp_path / "state" / "journal.json"))
+    record.start(settings, rows)
+    return (record, settings, rows)
+
+def states(record):
+    return [row["state"] for row in record.data["rows"]]
+
+def test_start_writes_pending_rows(batch):
+    record, settings, rows = batch
+    assert record.rows() == rows
+    assert states(record) == [journal.PENDING] * 3
+    with open(record.path, encoding="utf-8") as f:
+        assert json.load(f) == record.data
+
+def test_state_transitions_are_saved(batch):
+    record, settings, rows = batch
+    record.job_started(0)
+    record.job_started(1)
+    record.file_done(0, True)
+    record.file_done(1, False)
+    # Out of range rows are ignored
+    record.file_done(5, True)
+    assert states(record) == [journal.DONE, journal.FAILED, journal.PENDING]
+    assert record.unfinished() == [1, 2]
+    reloaded = journal.BatchJournal(record.path)
+    assert reloaded.load()
+    assert reloaded.data == record.data
+
+def test_load_rejects_missing_or_broken(tmp_path):
+    record = journal.BatchJournal(str(tmp_path / "journal.json"))
+    assert not record.load()
+    (tmp_path / "journal.json").write_text("{\"rows\": []")
+    assert not record.load()
+    (tmp_path / "journal.json").write_text("{\"rows\": []}")
+    assert not record.load()
+    assert record.data is None
+
+def test_clear(batch):
+    record, settings, rows = batch
+    record.clear()
+    assert not os.path.exists(record.path)
+    assert record.unfinished() == []
+    record.clear()
+
+def test_prepare_resume(batch):
+    record, settings, rows = batch
+    outputs = [row["output"] for row in record.data["rows"]]
+    for output in outputs:
+        with open(output, "wb") as f:
+            f.write(b"video")
+    record.file_done(0, True)
+    record.job_started(1)
+    record.file_done(2, False)
+    assert record.prepare_resume(settings) == {0}
+    assert os.path.exists(outputs[0])
+    # Partial outputs of unfinished jobs are removed
+    assert not os.path.exists(outputs[1])
+    assert not os.path.exists(outputs[2])
+    assert states(record) == [journal.DONE, journal.PENDING, journal.PENDING]
+
+def test_prepare_resume_reruns_changed_or_missing(batch, tmp_path):
+    record, settings, rows = batch
+    outputs = [row["output"] for row in record.data["rows"]]
+    for n, output in enumerate(outputs):
+        with open(output, "wb") as f:
+            f.write(b"video")
+        record.file_done(n, True)
+    # Changed input
+    with open(rows[0][1], "ab") as f:
+        f.write(b"more")
+    # Missing output
+    os.remove(outputs[1])
+    assert record.prepare_resume(settings) == {2}
+    assert states(record) == [journal.PENDING, journal.PENDING, journal.DONE]
+    # Settings that only affect how the batch runs don't count as changes
+    with open(outputs[1], "wb") as f:
+        f.write(b"video")
+    record.file_done(1, True)
+    settings.values["kbp2video/concurrent_jobs"] = 7
+    assert record.prepare_resume(settings) == {1, 2}
+    settings.values["video/output_resolution"] = "640x360"
+    assert record.prepare_resume(settings) == set()
+
+def test_prepare_resume_removes_scratch_files(batch, tmp_path):
+    record, settings, rows = batch
+    (tmp_path / "scratch").mkdir()
+    settings.values["kbp2video/scratch_dir"] = str(tmp_path / "scratch")
+    output = record.data["rows"][0]["output"]
+    scratch = storage.scratch_file(str(tmp_path / "scratch"), output)
+    partials = [output, scratch, segments.part_file(output), segments.part_file(scratch)]
+    for partial in partials:
+        with open(partial, "wb") as f:
+            f.write(b"video")
+    record.job_started(0)
+    assert record.prepare_resume(settings) == set()
+    assert not any(os.path.exists(partial) for partial in partials)
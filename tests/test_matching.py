@@ -0,0 +1,101 @@
+import difflib
+import itertools
+import random
+import string
+import pytest
+from kbp2video import matching
+
+# Up to count different random names. Small alphabets make close matches common
+def random_words(rnd, alphabet, count, longest=12):
+    return sorted({"".join(rnd.choice(alphabet) for _ in range(rnd.randint(0, longest))) for _ in range(count)})
+
+def difflib_scores(word, words, cutoff):
+    matcher = difflib.SequenceMatcher()
+    matcher.set_seq2(word)
+    result = {}
+    for x in words:
+        matcher.set_seq1(x)
+        if (score := matcher.ratio()) >= cutoff:
+            result[x] = score
+    return result
+
+@pytest.mark.parametrize("word, words, expected", [
+    ("efj", ["fji", "abc"], ["fji"]),
+    ("jibaed", ["icbedb", "xyz"], ["icbedb"]),
+    ("", ["", "a"], [""]),
+])
+def test_close_matches_without_shared_trigrams(word, words, expected):
+    assert matching.TrigramIndex(words).close_matches(word) == expected
+    assert difflib.get_close_matches(word, words) == expected
+
+@pytest.mark.parametrize("seed", range(20))
+def test_same_as_difflib(seed):
+    rnd = random.Random(seed)
+    for _ in range(100):
+        alphabet = rnd.choice(["abc", "abcdefghij", string.ascii_lowercase + string.digits])
+        words = random_words(rnd, alphabet, rnd.randint(1, 60))
+        index = matching.TrigramIndex(words)
+        word = "".join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 12)))
+        n = rnd.randint(1, 5)
+        cutoff = rnd.choice([0.0, 0.3, 0.6, 0.8, 1.0])
+        assert index.close_matches(word, n, cutoff) == difflib.get_close_matches(word, words, n, cutoff)
+        assert index.scores(word, cutoff) == difflib_scores(word, words, cutoff)
+
+def test_words_added_later():
+    index = matching.TrigramIndex(["alpha"])
+    index.add("alphabet")
+    index.add("alpha")
+    assert index.close_matches("alphabe") == difflib.get_close_matches("alphabe", ["alpha", "alphabet"])
+
+@pytest.mark.parametrize("seed", range(20))
+def test_hungarian_matches_brute_force(seed):
+    rnd = random.Random(seed)
+    for _ in range(50):
+        rows = rnd.randint(1, 5)
+        columns = rnd.randint(rows, 6)
+        cost = [[rnd.randint(-9, 9) for _ in range(columns)] for _ in range(rows)]
+        result = matching.hungarian(cost)
+        assert len(set(result)) == rows
+        best = min(sum(cost[i][j] for i, j in enumerate(p)) for p in itertools.permutations(range(columns), rows))
+        assert sum(cost[i][j] for i, j in enumerate(result)) == best
+
+def test_best_assignment_gives_each_file_once():
+    scores = {"a": {"x": 0.9, "y": 0.8}, "b": {"x": 0.95}, "c": {"z": 0.7}, "d": {}}
+    assert matching.best_assignment(scores) == {"a": "y", "b": "x", "c": "z"}
+
+def test_best_assignment_leaves_extra_projects_empty():
+    scores = {"a": {"x": 0.9}, "b": {"x": 0.7}}
+    assert matching.best_assignment(scores) == {"a": "x"}
+
+@pytest.mark.parametrize("seed", range(10))
+def test_best_assignment_matches_brute_force(seed):
+    rnd = random.Random(seed)
+    for _ in range(30):
+        projects = [f"p{i}" for i in range(rnd.randint(1, 4))]
+        files = [f"f{i}" for i in range(rnd.randint(1, 4))]
+        scores = {p: {f: rnd.randint(60, 100) / 100 for f in files if rnd.random() < 0.6} for p in projects}
+        chosen = matching.best_assignment(scores)
+        assert len(set(chosen.values())) == len(chosen)
+        assert all(file in scores[project] for project, file in chosen.items())
+        best = 0
+        for p in itertools.permutations(files + [None] * len(projects), len(projects)):
+            best = max(best, sum(scores[project].get(file, 0) for project, file in zip(projects, p)))
+        assert sum(scores[project][file] for project, file in chosen.items()) == pytest.approx(best)
+
+def test_assign_shares_files_unless_unique():
+    projects = {"one.kbp": "songone", "two.kbp": "songtwo"}
+    files = {"song.mp4": "song", "other.png": "other"}
+    chosen, review = matching.assign(projects, files, unique=False)
+    assert chosen == {"one.kbp": "song.mp4", "two.kbp": "song.mp4"}
+    assert review == {}
+    chosen, review = matching.assign(projects, files)
+    assert list(chosen.values()) == ["song.mp4"]
+    assert set(review) == set(projects)
+
+def test_assign_flags_close_calls():
+    projects = {"a.kbp": "songa"}
+    files = {"b.mp3": "songb", "c.mp3": "songc", "x.mp3": "xyz"}
+    for unique in (True, False):
+        chosen, review = matching.assign(projects, files, unique=unique)
+        assert chosen == {"a.kbp": "b.mp3"}
+        assert review == {"a.kbp": ["b.mp3", "c.mp3"]}
@@ -0,0 +1,52 @@
+import os
+import subprocess
+import sys
+import pytest
+
+PRINT_LOCATIONS = """
+from PySide6.QtCore import QSettings, QStandardPaths
+print(QSettings().fileName())
+print(QStandardPaths.writableLocation(QStandardPaths.CacheLocation))
+"""
+
+# Each mode needs a process of its own, as only one application object can be
+# created in one
+SCRIPTS = {
+    "gui": """
+from PySide6.QtWidgets import QApplication
+from kbp2video import _gui
+app = QApplication([])
+window = _gui.Ui_MainWindow(app, [])
+""",
+    # Both fail for lack of arguments once the application has been set up
+    "render": """
+from kbp2video import _gui
+try:
+    _gui.run(["kbp2video", "render"])
+except SystemExit:
+    pass
+""",
+    "worker": """
+from kbp2video import _gui
+try:
+    _gui.run(["kbp2video", "worker"])
+except SystemExit:
+    pass
+""",
+}
+
+def locations(mode, tmp_path):
+    env = dict(os.environ,
+               QT_QPA_PLATFORM="offscreen",
+               XDG_CONFIG_HOME=str(tmp_path / "config"),
+               XDG_CACHE_HOME=str(tmp_path / "cache"),
+               PYTHONPATH=os.pathsep.join([os.path.dirname(os.path.dirname(os.path.abspath(__file__))), os.environ.get("PYTHONPATH", "")]))
+    result = subprocess.run([sys.executable, "-c", SCRIPTS[mode] + PRINT_LOCATIONS], env=env, capture_output=True, text=True, timeout=60)
+    return result.stdout.splitlines()[-2:]
+
+@pytest.mark.parametrize("mode", ["render", "worker"])
+def test_settings_shared_with_gui(mode, tmp_path):
+    gui = locations("gui", tmp_path)
+    assert gui == [str(tmp_path / "config" / "ItMightBeKaraoke" / "kbp2video.conf"),
+                   str(tmp_path / "cache" / "ItMightBeKaraoke" / "kbp2video")]
+    assert locations(mode, tmp_path) == gui
@@ -0,0 +1,86 @@
+import collections
+import errno
+import os
+import pytest
+from kbp2video import storage
+
+def test_scratch_file_keeps_folders_apart(tmp_path):
+    first = storage.scratch_file(str(tmp_path / "scratch"), str(tmp_path / "a" / "song.mp4"))
+    second = storage.scratch_file(str(tmp_path / "scratch"), str(tmp_path / "b" / "song.mp4"))
+    assert os.path.dirname(first) == str(tmp_path / "scratch")
+    assert first.endswith("-song.mp4") and second.endswith("-song.mp4")
+    assert first != second
+    assert storage.scratch_file(str(tmp_path / "scratch"), str(tmp_path / "a" / "song.mp4")) == first
+
+def test_publish_renames(tmp_path):
+    source = tmp_path / "scratch.mp4"
+    source.write_bytes(b"video")
+    storage.publish(str(source), str(tmp_path / "song.mp4"))
+    assert (tmp_path / "song.mp4").read_bytes() == b"video"
+    assert not source.exists()
+
+# os.replace that fails across filesystems the first time
+def cross_device(monkeypatch):
+    replace = os.replace
+    calls = []
+    def fake(source, destination):
+        calls.append((source, destination))
+        if len(calls) == 1:
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+        return replace(source, destination)
+    monkeypatch.setattr(os, "replace", fake)
+    return calls
+
+def test_publish_across_filesystems(tmp_path, monkeypatch):
+    calls = cross_device(monkeypatch)
+    source = tmp_path / "scratch" / "song.mp4"
+    source.parent.mkdir()
+    source.write_bytes(b"video")
+    (tmp_path / "out").mkdir()
+    (tmp_path / "out" / "song.mp4").write_bytes(b"old")
+    storage.publish(str(source), str(tmp_path / "out" / "song.mp4"))
+    assert (tmp_path / "out" / "song.mp4").read_bytes() == b"video"
+    assert not source.exists()
+    assert os.listdir(tmp_path / "out") == ["song.mp4"]
+    # Copied next to the output under a hidden name, then renamed into place
+    assert len(calls) == 2
+    tmp, destination = calls[1]
+    assert os.path.dirname(tmp) == str(tmp_path / "out")
+    assert os.path.basename(tmp).startswith(".song.mp4.")
+    assert destination == str(tmp_path / "out" / "song.mp4")
+
+def test_publish_failed_copy_cleans_up(tmp_path, monkeypatch):
+    cross_device(monkeypatch)
+    def fail(source, destination):
+        with open(destination, "wb") as f:
+            f.write(b"part")
+        raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+    monkeypatch.setattr(storage.shutil, "copyfile", fail)
+    source = tmp_path / "scratch.mp4"
+    source.write_bytes(b"video")
+    (tmp_path / "out").mkdir()
+    with pytest.raises(OSError) as error:
+        storage.publish(str(source), str(tmp_path / "out" / "song.mp4"))
+    assert error.value.errno == errno.ENOSPC
+    assert os.listdir(tmp_path / "out") == []
+    assert source.exists()
+
+def test_publish_other_errors(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        storage.publish(str(tmp_path / "missing.mp4"), str(tmp_path / "song.mp4"))
+
+def test_existing_parent(tmp_path):
+    assert storage.existing_parent(str(tmp_path / "a" / "b" / "c.mp4")) == str(tmp_path)
+    assert storage.existing_parent(str(tmp_path)) == str(tmp_path)
+
+def test_shortfalls(tmp_path, monkeypatch):
+    Usage = collections.namedtuple("Usage", "total used free")
+    monkeypatch.setattr(storage.shutil, "disk_usage", lambda folder: Usage(1000, 900, 100))
+    (tmp_path / "a").mkdir()
+    assert storage.shortfalls({str(tmp_path / "a"): 60}) == []
+    # Folders on the same disk are added together
+    assert storage.shortfalls({str(tmp_path / "a"): 60, str(tmp_path / "b" / "c"): 50}) == [(str(tmp_path / "a"), 110, 100)]
+
+def test_format_size():
+    assert storage.format_size(1500 * 1000 ** 2) == "1.5 GB"
+    assert storage.format_size(250 * 1000 ** 2) == "250 MB"